@@ -0,0 +1,182 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import Column, DateTime, Index, Table, and_, func, inspect, or_, select
+
+from etl_metrics import EtlRun, estimate_bytes
+from schema import ensure_columns
+
+# The quotes the admin index lists: open Web/Inbound quotes reported on, with
+# activity within ACTIVITY_WINDOW
+ACTIONABLE_STATUSES = ("Quoted", "Draft", "Quoting")
+ACTIONABLE_CHANNELS = ("Web", "Inbound")
+ACTIVITY_WINDOW = timedelta(days=10)
+
+
+def actionable_quotes_table(metadata, Quote):
+    """
+    One row per quote number with a Quote row passing the time-independent
+    part of the actionable predicate: the outbounds' latest
+    scheduled_outbound_dt and the latest activity, the later of that and the
+    passing rows' latest last_entry_date. The activity window is applied when
+    reading, so rows never go stale just because time passes.
+
+    Quote isn't unique per quote_number, so readers must still apply
+    actionable_filter and the per-row window (see actionable_window) to the
+    joined Quote rows; last_activity only narrows the candidates.
+    """
+    return Table(
+        "actionable_quotes",
+        metadata,
+        # Same type as Quote.quote_number, so the join needs no conversion
+        Column("quote_number", Quote.__table__.c.quote_number.type, primary_key=True),
+        Column("last_scheduled", DateTime),
+        Column("last_activity", DateTime, nullable=False),
+        Index("ix_actionable_quotes_last_activity", "last_activity"),
+    )
+
+
+def actionable_filter(Quote):
+    """The time-independent conditions of the actionable predicate."""
+    return and_(
+        Quote.transaction_status.in_(ACTIONABLE_STATUSES),
+        Quote.quote_channel.in_(ACTIONABLE_CHANNELS),
+        Quote.reject_reason.is_(None),
+        Quote.sqpm_quote_sale_reporting_in == 1,
+    )
+
+
+def build_actionable_stmt(Quote, Outbound, quote_numbers=None):
+    """
+    Select, per quote number, the latest last_entry_date of the Quote rows
+    passing actionable_filter and the latest scheduled outbound, for every
+    quote number or only for `quote_numbers`.
+    """
+    scheduled = select(
+        Outbound.quote_number,
+        func.max(Outbound.scheduled_outbound_dt).label("last_scheduled"),
+    )
+    stmt = select(Quote.quote_number, func.max(Quote.last_entry_date))
+    if quote_numbers is not None:
+        scheduled = scheduled.where(Outbound.quote_number.in_(quote_numbers))
+        stmt = stmt.where(Quote.quote_number.in_(quote_numbers))
+    scheduled = scheduled.group_by(Outbound.quote_number).subquery()
+
+    return (
+        stmt.add_columns(scheduled.c.last_scheduled)
+        .outerjoin(scheduled, scheduled.c.quote_number == Quote.quote_number)
+        .where(actionable_filter(Quote))
+        .group_by(Quote.quote_number, scheduled.c.last_scheduled)
+    )
+
+
+def _actionable_rows(db_session, stmt):
+    # GREATEST isn't available before SQL Server 2022, so take the later
+    # timestamp here; quotes with no activity at all can never qualify
+    rows = []
+    for quote_number, last_entry_date, last_scheduled in db_session.execute(stmt):
+        activity = [t for t in (last_entry_date, last_scheduled) if t is not None]
+        if activity:
+            rows.append({
+                "quote_number": quote_number,
+                "last_scheduled": last_scheduled,
+                "last_activity": max(activity),
+            })
+    return rows
+
+
+def _ensure_table(engine, actionable_quotes):
+    if not inspect(engine).has_table(actionable_quotes.name):
+        print(f"Table {actionable_quotes.name} does not exist, creating it...")
+        actionable_quotes.create(bind=engine)
+    else:
+        ensure_columns(engine, actionable_quotes)
+
+
+def build_actionable_quotes(db_session, engine, metadata, Quote, Outbound, run=None):
+    """
+    Rebuild the actionable_quotes projection from scratch in one transaction.
+
+    Args:
+        db_session: Database session for target database
+        engine: SQLAlchemy engine for target database
+        metadata: SQLAlchemy MetaData object for table definitions
+        Quote: Quote ORM model
+        Outbound: Outbound ORM model
+        run: Optional EtlRun collecting metrics
+
+    Returns:
+        int: Number of rows in actionable_quotes
+    """
+    actionable_quotes = actionable_quotes_table(metadata, Quote)
+    _ensure_table(engine, actionable_quotes)
+    run = run or EtlRun("actionable_quotes")
+
+    with run.watch(engine):
+        with run.stage("query"):
+            rows = _actionable_rows(db_session, build_actionable_stmt(Quote, Outbound))
+            run.add_rows(len(rows), estimate_bytes(rows))
+
+        with run.stage("load"):
+            db_session.execute(actionable_quotes.delete())
+            if rows:
+                db_session.execute(actionable_quotes.insert(), rows)
+            db_session.commit()
+    return len(rows)
+
+
+def refresh_actionable_quotes(db_session, engine, metadata, Quote, Outbound, quote_numbers):
+    """
+    Re-evaluate the given quotes and swap their actionable_quotes rows in
+    within one transaction. Quotes that stopped qualifying are removed.
+
+    Args:
+        db_session: Database session for target database
+        engine: SQLAlchemy engine for target database
+        metadata: SQLAlchemy MetaData object for table definitions
+        Quote: Quote ORM model
+        Outbound: Outbound ORM model
+        quote_numbers: Quote numbers whose quote or outbounds changed
+
+    Returns:
+        int: Number of actionable_quotes rows written
+    """
+    quote_numbers = list(quote_numbers)
+    if not quote_numbers:
+        return 0
+
+    actionable_quotes = actionable_quotes_table(metadata, Quote)
+    _ensure_table(engine, actionable_quotes)
+
+    written = 0
+    # Stay well below SQL Server's 2100 parameter limit; the statement binds
+    # each chunk twice
+    for i in range(0, len(quote_numbers), 500):
+        chunk = quote_numbers[i:i + 500]
+        rows = _actionable_rows(db_session, build_actionable_stmt(Quote, Outbound, chunk))
+        db_session.execute(actionable_quotes.delete().where(actionable_quotes.c.quote_number.in_(chunk)))
+        if rows:
+            db_session.execute(actionable_quotes.insert(), rows)
+        written += len(rows)
+    db_session.commit()
+    return written
+
+
+def actionable_since(now=None):
+    """Earliest last_activity of a quote that is actionable at `now`."""
+    return (now or datetime.utcnow()) - ACTIVITY_WINDOW
+
+
+def actionable_window(actionable_quotes, Quote, since):
+    """
+    The activity conditions of the actionable predicate for Quote rows joined
+    to actionable_quotes: the projection's last_activity narrows the quote
+    numbers through its index, then each row must itself be recent or have a
+    recently scheduled outbound, as in the unprojected predicate.
+    """
+    return and_(
+        actionable_quotes.c.last_activity > since,
+        or_(
+            Quote.last_entry_date > since,
+            actionable_quotes.c.last_scheduled > since,
+        ),
+    )
@@ -0,0 +1,166 @@
+import asyncio
+import time
+from collections import deque
+
+
+class Rejected(Exception):
+    """A request that was not admitted: its class's queue was full or it waited too long."""
+
+    def __init__(self, name, reason, retry_after):
+        super().__init__(f"{name} requests are {reason}, retry later")
+        self.name = name
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class PriorityClass:
+    """
+    One class of requests sharing an AdmissionController.
+
+    Args:
+        name: Class name routes are admitted under
+        priority: Lower values are admitted first when a slot frees
+        limit: Most slots the class may hold at once, None for no limit
+            below the controller's capacity
+        queue_size: Most requests waiting for a slot; more are rejected
+        timeout: Seconds a request waits for a slot before it is rejected
+    """
+
+    def __init__(self, name, priority, limit=None, queue_size=100, timeout=10.0):
+        self.name = name
+        self.priority = priority
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self.waiters = deque()
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._recent_waits = deque(maxlen=1000)
+
+    def _record_wait(self, seconds):
+        self.admitted += 1
+        self.wait_total += seconds
+        self.wait_max = max(self.wait_max, seconds)
+        self._recent_waits.append(seconds)
+
+    def as_dict(self):
+        recent = sorted(self._recent_waits)
+        return {
+            "priority": self.priority,
+            "limit": self.limit,
+            "active": self.active,
+            "queued": len(self.waiters),
+            "queue_size": self.queue_size,
+            "timeout": self.timeout,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "wait_avg_ms": round(self.wait_total / self.admitted * 1000, 1) if self.admitted else 0.0,
+            "wait_p95_ms": round(recent[int(len(recent) * 0.95)] * 1000, 1) if recent else 0.0,
+            "wait_max_ms": round(self.wait_max * 1000, 1),
+        }
+
+
+class AdmissionController:
+    """
+    Priority admission control for requests doing database work.
+
+    `capacity` slots, normally the size of the database pool, are shared by
+    the priority classes. A request holds a slot for as long as it queries;
+    when none is free it waits in its class's FIFO queue, without holding a
+    worker thread, until a slot frees or its class's timeout passes. Freed
+    slots go to the highest priority class with a queued request that is
+    under its limit. Capping the heavy classes' limits below the capacity
+    reserves the remaining slots for the classes without a limit.
+
+    All methods must be called on the event loop.
+
+    Usage:
+        admission = AdmissionController(16, [
+            PriorityClass("interactive", 0),
+            PriorityClass("export", 1, limit=2, queue_size=10, timeout=30.0),
+        ])
+        await admission.acquire("export")
+        try:
+            ...
+        finally:
+            admission.release("export")
+    """
+
+    def __init__(self, capacity, classes):
+        self.capacity = capacity
+        self.classes = {priority_class.name: priority_class for priority_class in classes}
+        self._order = sorted(classes, key=lambda priority_class: priority_class.priority)
+        self.active = 0
+
+    def _can_run(self, priority_class):
+        return self.active < self.capacity and (
+            priority_class.limit is None or priority_class.active < priority_class.limit
+        )
+
+    def _start(self, priority_class):
+        priority_class.active += 1
+        self.active += 1
+
+    async def acquire(self, name):
+        """
+        Wait for a slot for a request of class `name`.
+
+        Raises:
+            Rejected: When the class's queue is full or the wait times out
+        """
+        priority_class = self.classes[name]
+        # Don't overtake requests of the same class already queued
+        if not priority_class.waiters and self._can_run(priority_class):
+            self._start(priority_class)
+            priority_class._record_wait(0.0)
+            return
+
+        if len(priority_class.waiters) >= priority_class.queue_size:
+            priority_class.rejected += 1
+            raise Rejected(name, "queued to capacity", priority_class.timeout)
+
+        started = time.monotonic()
+        waiter = asyncio.get_running_loop().create_future()
+        priority_class.waiters.append(waiter)
+        try:
+            # Shielded so a timeout can't cancel a slot handed over as it expires
+            await asyncio.wait_for(asyncio.shield(waiter), priority_class.timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as exc:
+            if not waiter.done():
+                priority_class.waiters.remove(waiter)
+                waiter.cancel()
+                if isinstance(exc, asyncio.CancelledError):
+                    raise
+                priority_class.timed_out += 1
+                raise Rejected(name, "waiting too long", priority_class.timeout) from None
+            if isinstance(exc, asyncio.CancelledError):
+                # The client went away just as its slot was granted
+                self.release(name)
+                raise
+        priority_class._record_wait(time.monotonic() - started)
+
+    def release(self, name):
+        """Free a slot acquired for class `name` and hand it to the next request."""
+        priority_class = self.classes[name]
+        priority_class.active -= 1
+        self.active -= 1
+        for candidate in self._order:
+            while candidate.waiters and self._can_run(candidate):
+                waiter = candidate.waiters.popleft()
+                if waiter.done():
+                    continue
+                self._start(candidate)
+                waiter.set_result(None)
+
+    def stats(self):
+        """Slots in use and, per class, queue depth and wait times."""
+        return {
+            "capacity": self.capacity,
+            "active": self.active,
+            "classes": {name: priority_class.as_dict() for name, priority_class in self.classes.items()},
+        }
@@ -1,8 +1,18 @@
-from sqlalchemy import case, distinct, text, cast, Integer, literal_column, Table, Column, String, func, inspect, union_all, select, or_
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, distinct, text, cast, Integer, literal_column, Table, Column, func, inspect, union_all, select, or_, and_, true, DateTime
 from sqlalchemy.orm import Session
 
+from etl_metrics import EtlRun, estimate_bytes
+from hll import HyperLogLog, position
+from schema import COUNT_COLUMNS, ensure_columns, repdata_advisor_table, repdata_generation_table, repdata_table
+from snapshots import publish_repdata, store_from_env
+
 
-def create_date_aggregation(cte, date_column, date_type_literal):
+def create_date_aggregation(cte, date_column, date_type_literal, where=None, dimensions=()):
     """
     Helper function to create date-based aggregation queries.
     Reduces code duplication for week/month/year aggregations.
@@ -11,10 +21,13 @@ def create_date_aggregation(cte, date_column, date_type_literal):
         cte: The CTE to aggregate from
         date_column: The column to use for date grouping (e.g., c.week_end_date)
         date_type_literal: The literal value for date_type (e.g., 'week', 'month', 'year')
+        where: Optional filter applied to the CTE rows before grouping
+        dimensions: Extra CTE column names to group by (e.g., ('user_id',))
     """
     return select(
         literal_column(f"'{date_type_literal}'").label("date_type"),
         date_column.label("date_value"),
+        *[cte.c[name].label(name) for name in dimensions],
         cte.c.product.label("product"),
         cte.c.quote_channel.label("quote_channel"),
         func.sum(case((cte.c.result == "Sale - Policy", 1), else_=0)).label("sale_count"),
@@ -41,37 +54,73 @@ def create_date_aggregation(cte, date_column, date_type_literal):
         func.sum(case((cte.c.result == "Total", 1), else_=1)).label("ta_total")
     ).select_from(
         cte
+    ).where(
+        where if where is not None else true()
     ).group_by(
         date_column,
+        *[cte.c[name] for name in dimensions],
         cte.c.product,
         cte.c.quote_channel
     )
 
 
-def build_repdata_table(db_session, etl_session, engine, metadata, Quote, Outbound):
+EPOCH = datetime(1900, 1, 1)
+
+
+def period_bounds(date_type, moment):
     """
-    Build and populate the repdata reporting table with aggregated metrics.
-    
-    This function performs multi-level aggregations of quote and outbound data,
-    grouping by time periods (week/month/year) and dimensions (product/channel).
-    Uses GROUPING SETS for efficient aggregation across multiple dimension combinations.
-    
-    Args:
-        db_session: Database session for target database
-        etl_session: Database session for ETL database
-        engine: SQLAlchemy engine for target database
-        metadata: SQLAlchemy MetaData object for table definitions
-        Quote: Quote ORM model
-        Outbound: Outbound ORM model
-        
-    Returns:
-        int: Number of rows inserted into repdata table
+    Half-open [start, end) range of the week/month/year containing `moment`.
+
+    Mirrors the SQL date arithmetic used for week_end_date, month_end_date and
+    year_end_date: weeks are counted in whole days from 1900-01-01 (a Monday).
     """
-    inspector = inspect(engine)
-    
-    # Step 1: Aggregate Quote data by quote_number to get bound counts
-    # Using CTE instead of subquery for better performance
-    bound_table = select(
+    if date_type == 'week':
+        start = EPOCH + timedelta(days=(moment - EPOCH).days // 7 * 7)
+        return start, start + timedelta(days=7)
+    if date_type == 'month':
+        start = datetime(moment.year, moment.month, 1)
+        end = datetime(moment.year + moment.month // 12, moment.month % 12 + 1, 1)
+        return start, end
+    if date_type == 'year':
+        return datetime(moment.year, 1, 1), datetime(moment.year + 1, 1, 1)
+    raise ValueError(f"Unknown date_type {date_type!r}")
+
+
+def period_end_value(date_type, start):
+    """The date_value repdata stores for the period starting at `start`."""
+    if date_type == 'week':
+        return start + timedelta(days=4)
+    return period_bounds(date_type, start)[1] - timedelta(days=1)
+
+
+def _created_in(column, ranges):
+    return or_(*[and_(column >= start, column < end) for start, end in ranges])
+
+
+def _outbound_key(Outbound):
+    # new_ind marks exactly one outbound per quote, identified by its key
+    (key,) = Outbound.__table__.primary_key.columns
+    return key
+
+
+def _shard_filter(column, shard):
+    # CHECKSUM is SQL Server's cheap row hash; mask the sign bit rather than
+    # use ABS(), which overflows on INT_MIN. NULL quote numbers go to shard 0.
+    index, count = shard
+    hashed = func.checksum(column).op('&', return_type=Integer)(0x7FFFFFFF) % count
+    return func.coalesce(hashed, 0) == index
+
+
+def _non_organic(created_at, last_entry_date, bound_count):
+    # Outbounds created up to the quote's last entry, or on never-bound quotes.
+    # Shared by build_lead_rows and build_quote_state_stmt, which must agree
+    # on it for first_outbound_id to mark the same outbound as new_ind.
+    return or_(created_at <= last_entry_date, bound_count == 0)
+
+
+def _bound_stmt(Quote, quote_numbers=None, shard=None):
+    # Bound count, last entry date and product/channel per quote_number
+    return select(
         Quote.quote_number,
         func.sum(case((Quote.transaction_status == "Bound", 1), else_=0)).label("bound_count"),
         func.max(Quote.last_entry_date).label("last_entry_date"), 
@@ -79,7 +128,48 @@ def build_repdata_table(db_session, etl_session, engine, metadata, Quote, Outbou
         func.max(Quote.quote_channel).label("quote_channel")
     ).select_from(
         Quote
-    ).group_by(Quote.quote_number).cte('bound_table')
+    ).where(
+        Quote.quote_number.in_(quote_numbers) if quote_numbers is not None else true(),
+        _shard_filter(Quote.quote_number, shard) if shard is not None else true()
+    ).group_by(Quote.quote_number)
+
+
+def build_lead_rows(Quote, Outbound, periods=None, state=None, shard=None):
+    """
+    Build the per-outbound CTE (dfw) the repdata aggregations read from:
+    non-organic outbounds with their quote's product/channel, period end
+    dates, attempt_ind and new_ind.
+
+    Args:
+        Quote: Quote ORM model
+        Outbound: Outbound ORM model
+        periods: Optional {date_type: [(start, end), ...]} restricting the
+            aggregation to outbounds created in those half-open ranges. Only
+            quotes with an outbound in one of the ranges are scanned; their
+            other outbounds still take part in the new_ind window so the
+            result matches a full build for those periods.
+        state: Optional quote_state Table, kept current by sync_quote_state.
+            When given, bound counts, product/channel and each quote's first
+            outbound are joined from it instead of being recomputed with a
+            group-by over Quote and a window over Outbound.
+        shard: Optional (index, count) restricting the rows to the quotes
+            whose quote_number hashes to shard `index` of `count`. A quote's
+            outbounds all land in the same shard, so new_ind is unaffected.
+
+    Returns:
+        CTE: One row per outbound
+    """
+    quote_filter = None
+    if periods is not None:
+        all_ranges = [r for ranges in periods.values() for r in ranges]
+        quote_filter = select(Outbound.quote_number).where(_created_in(Outbound.created_at_dtm, all_ranges))
+
+    if state is not None:
+        bound_table = state
+    else:
+        # Step 1: Aggregate Quote data by quote_number to get bound counts
+        # Using CTE instead of subquery for better performance
+        bound_table = _bound_stmt(Quote, quote_filter, shard).cte('bound_table')
 
     # Step 2: Join Outbound data with Quote aggregations
     outbound_bound = select(
@@ -87,12 +177,16 @@ def build_repdata_table(db_session, etl_session, engine, metadata, Quote, Outbou
         func.coalesce(bound_table.c.bound_count, 0).label("bound_count"),
         bound_table.c.last_entry_date,
         bound_table.c.product,
-        bound_table.c.quote_channel
+        bound_table.c.quote_channel,
+        *([state.c.first_outbound_id] if state is not None else [])
     ).select_from(
         Outbound
     ).outerjoin(
         bound_table,
         Outbound.quote_number == bound_table.c.quote_number
+    ).where(
+        Outbound.quote_number.in_(quote_filter) if quote_filter is not None else true(),
+        _shard_filter(Outbound.quote_number, shard) if shard is not None else true()
     ).cte('outbound_bound')
 
     # Step 3: Add date calculations and filtering
@@ -134,169 +228,900 @@ def build_repdata_table(db_session, etl_session, engine, metadata, Quote, Outbou
             )
         ).label("year_end_date")
     ).where(
-        or_(
-            outbound_bound.c.created_at_dtm <= outbound_bound.c.last_entry_date,
-            outbound_bound.c.bound_count == 0
-        )
+        _non_organic(outbound_bound.c.created_at_dtm, outbound_bound.c.last_entry_date, outbound_bound.c.bound_count)
     ).cte('outbound_non_organic')
 
-    # Step 4: Add new lead indicator using row_number
+    # Step 4: Add new lead indicator, the quote's first non-organic outbound
+    if state is not None:
+        first_outbound = outbound_non_organic.c[_outbound_key(Outbound).name] == outbound_non_organic.c.first_outbound_id
+    else:
+        first_outbound = func.row_number().over(
+            partition_by=outbound_non_organic.c.quote_number,
+            order_by=outbound_non_organic.c.created_at_dtm
+        ) == 1
     dfw = select(
         outbound_non_organic,
-        case(
-            (func.row_number().over(
-                partition_by=outbound_non_organic.c.quote_number,
-                order_by=outbound_non_organic.c.created_at_dtm
-            ) == 1, 1), 
-            else_=0
-        ).label("new_ind")
+        case((first_outbound, 1), else_=0).label("new_ind")
     ).cte('dfw')
 
+    return dfw
+
+
+def build_repdata_stmt(Quote, Outbound, periods=None, state=None):
+    """
+    Build the repdata aggregation statement.
+
+    Args:
+        Quote: Quote ORM model
+        Outbound: Outbound ORM model
+        periods: Optional {date_type: [(start, end), ...]}, see build_lead_rows
+        state: Optional quote_state Table, see build_lead_rows
+
+    Returns:
+        Select: Statement yielding one row per repdata cell
+    """
+    # Steps 1-4: Per-outbound rows with quote attributes and indicators
+    dfw = build_lead_rows(Quote, Outbound, periods, state)
+
+    # Steps 5-7: Aggregate per period and roll up product/channel
+    return _rollup_stmt(dfw, periods)
+
+
+def build_advisor_repdata_stmt(Quote, Outbound, periods=None, state=None):
+    """
+    Build the per-advisor repdata aggregation statement: the same cells as
+    build_repdata_stmt, per Outbound.user_id. Outbounds without an advisor
+    are left out, and only advisor/period combinations with outbounds
+    produce rows.
+
+    Args:
+        Quote: Quote ORM model
+        Outbound: Outbound ORM model
+        periods: Optional {date_type: [(start, end), ...]}, see build_lead_rows
+        state: Optional quote_state Table, see build_lead_rows
+
+    Returns:
+        Select: Statement yielding one row per repdata_advisor cell
+    """
+    dfw = build_lead_rows(Quote, Outbound, periods, state)
+    return _rollup_stmt(dfw, periods, dimensions=('user_id',), where=dfw.c.user_id.isnot(None))
+
+
+def _period_stmts(dfw, periods=None, dimensions=(), where=None):
     # Step 5: Create aggregations by week/month/year using helper function
-    week_stmt = create_date_aggregation(dfw, dfw.c.week_end_date, 'week')
-    month_stmt = create_date_aggregation(dfw, dfw.c.month_end_date, 'month')
-    year_stmt = create_date_aggregation(dfw, dfw.c.year_end_date, 'year')
+    date_columns = {
+        'week': dfw.c.week_end_date,
+        'month': dfw.c.month_end_date,
+        'year': dfw.c.year_end_date,
+    }
+    return [
+        create_date_aggregation(
+            dfw,
+            date_column,
+            date_type,
+            where=and_(
+                where if where is not None else true(),
+                _created_in(dfw.c.created_at_dtm, periods[date_type]) if periods is not None else true()
+            ),
+            dimensions=dimensions
+        )
+        for date_type, date_column in date_columns.items()
+        if periods is None or periods.get(date_type)
+    ]
+
+
+def _rollup_stmt(dfw, periods=None, dimensions=(), where=None):
+    period_stmts = _period_stmts(dfw, periods, dimensions, where)
 
     # Step 6: Union all time periods - using CTE for efficiency since referenced 4 times
-    aggregated_stmt = union_all(
-        week_stmt,
-        month_stmt,
-        year_stmt
-    ).cte('aggregated')
+    aggregated_stmt = union_all(*period_stmts).cte('aggregated')
 
     # Step 7: Use GROUPING SETS to create all aggregation levels in a single query
     # This replaces the previous 4 separate queries + UNION ALL approach
-    # GROUPING SETS generates:
+    # GROUPING SETS generates, within every dimension value:
     #   - Per product and channel
     #   - All products (grouped by channel)
     #   - All channels (grouped by product)  
     #   - Grand totals (all products and channels)
-    final_stmt = select(
+    # grouping_level tells the levels apart where a NULL product or channel
+    # is reported as 'All' too; the loads ignore it, as repdata has no such
+    # column
+    keys = ", ".join(("date_type", "date_value") + tuple(dimensions))
+    return select(
         aggregated_stmt.c.date_type,
         aggregated_stmt.c.date_value,
+        *[aggregated_stmt.c[name] for name in dimensions],
         func.coalesce(aggregated_stmt.c.product, 'All').label("product"),
         func.coalesce(aggregated_stmt.c.quote_channel, 'All').label("quote_channel"),
-        func.sum(aggregated_stmt.c.sale_count).label("sale_count"),
-        func.sum(aggregated_stmt.c.quote_count).label("quote_count"),
-        func.sum(aggregated_stmt.c.sum_attempts).label("sum_attempts"),
-        func.sum(aggregated_stmt.c.new_leads_given).label("new_leads_given"),
-        func.sum(aggregated_stmt.c.new_leads_contacted).label("new_leads_contacted"),
-        func.sum(aggregated_stmt.c.leads_no_recontact_needed).label("leads_no_recontact_needed"),
-        func.sum(aggregated_stmt.c.ta_answering_machine_no_message).label("ta_answering_machine_no_message"),
-        func.sum(aggregated_stmt.c.ta_sale_policy).label("ta_sale_policy"),
-        func.sum(aggregated_stmt.c.ta_call_back_scheduled).label("ta_call_back_scheduled"),
-        func.sum(aggregated_stmt.c.ta_too_expensive).label("ta_too_expensive"),
-        func.sum(aggregated_stmt.c.ta_inbound_extension).label("ta_inbound_extension"),
-        func.sum(aggregated_stmt.c.ta_no_reason_provided).label("ta_no_reason_provided"),
-        func.sum(aggregated_stmt.c.ta_purchased_insurance_elsewhere).label("ta_purchased_insurance_elsewhere"),
-        func.sum(aggregated_stmt.c.ta_no_product_need).label("ta_no_product_need"),
-        func.sum(aggregated_stmt.c.ta_bad_phone_number).label("ta_bad_phone_number"),
-        func.sum(aggregated_stmt.c.ta_customer_policy_not_up_for_renewal).label("ta_customer_policy_not_up_for_renewal"),
-        func.sum(aggregated_stmt.c.ta_customer_satisfied_with_current_insurer).label("ta_customer_satisfied_with_current_insurer"),
-        func.sum(aggregated_stmt.c.ta_declined_by_insurer_for_other_reason).label("ta_declined_by_insurer_for_other_reason"),
-        func.sum(aggregated_stmt.c.ta_active_follow_up_present).label("ta_active_follow_up_present"),
-        func.sum(aggregated_stmt.c.ta_other).label("ta_other"),
-        func.sum(aggregated_stmt.c.ta_none).label("ta_none"),
-        func.sum(aggregated_stmt.c.ta_total).label("ta_total")
+        func.grouping_id(aggregated_stmt.c.product, aggregated_stmt.c.quote_channel).label("grouping_level"),
+        *[func.sum(aggregated_stmt.c[name]).label(name) for name in COUNT_COLUMNS]
     ).select_from(
         aggregated_stmt
     ).group_by(
-        text("GROUPING SETS ((date_type, date_value, product, quote_channel), (date_type, date_value, quote_channel), (date_type, date_value, product), (date_type, date_value))")
+        text(f"GROUPING SETS (({keys}, product, quote_channel), ({keys}, quote_channel), ({keys}, product), ({keys}))")
     ).order_by(
-        text('date_type'),
-        text('date_value'),
-        text('product'),
-        text('quote_channel')
+        *[text(name) for name in ("date_type", "date_value") + tuple(dimensions) + ("product", "quote_channel", "grouping_level")]
+    )
+
+
+def build_partial_stmt(Quote, Outbound, shard, periods=None, state=None, dimensions=()):
+    """
+    Build the statement aggregating one hash shard of quotes into partial
+    repdata cells: the per period, product and channel cells the GROUPING
+    SETS of build_repdata_stmt roll up, without the rollups. Every counter is
+    a sum, so the partials of all shards add up to the full cells.
+
+    Args:
+        Quote: Quote ORM model
+        Outbound: Outbound ORM model
+        shard: (index, count), see build_lead_rows
+        periods: Optional {date_type: [(start, end), ...]}, see build_lead_rows
+        state: Optional quote_state Table, see build_lead_rows
+        dimensions: Extra dfw columns to group by, e.g. ('user_id',) for
+            repdata_advisor cells; rows where one is NULL are left out
+
+    Returns:
+        Select: Statement yielding one row per partial cell of the shard
+    """
+    dfw = build_lead_rows(Quote, Outbound, periods, state, shard)
+    where = and_(*[dfw.c[name].isnot(None) for name in dimensions]) if dimensions else None
+    return union_all(*_period_stmts(dfw, periods, dimensions, where))
+
+
+def _grouping_levels(product, channel, rolled_up):
+    # The four GROUPING SETS cells a (product, channel) pair adds to, keyed by
+    # their GROUPING_ID(product, quote_channel): 2 where the product is rolled
+    # up, 1 where the channel is
+    return (
+        (0, (product, channel)),
+        (2, (rolled_up, channel)),
+        (1, (product, rolled_up)),
+        (3, (rolled_up, rolled_up)),
+    )
+
+
+def merge_partials(partials, dimensions=()):
+    """
+    Sum partial cells across shards and roll them up into the cells the
+    GROUPING SETS of build_repdata_stmt produce: per product and channel, per
+    channel, per product and overall, with product/channel reported as 'All'
+    where they are rolled up or missing and grouping_level set as GROUPING_ID
+    sets it.
+
+    Args:
+        partials: Partial rows from build_partial_stmt, of any number of shards
+        dimensions: The dimensions the partials were grouped by
+
+    Returns:
+        list: One dictionary per repdata cell, ordered like build_repdata_stmt
+    """
+    cells = {}
+    for row in partials:
+        keys = (row["date_type"], row["date_value"], *[row[name] for name in dimensions])
+        product, channel = row["product"], row["quote_channel"]
+        # The grouping set is part of the key: a NULL product is reported as
+        # 'All' as well, but in a cell of its own, just as GROUPING SETS does
+        for level, cell in _grouping_levels(product, channel, None):
+            key = (keys, level, cell)
+            totals = cells.get(key)
+            if totals is None:
+                cells[key] = [row[name] for name in COUNT_COLUMNS]
+                continue
+            for i, name in enumerate(COUNT_COLUMNS):
+                value = row[name]
+                if value is not None:
+                    totals[i] = value if totals[i] is None else totals[i] + value
+
+    rows = []
+    for (keys, level, (product, channel)), totals in cells.items():
+        row = {"date_type": keys[0], "date_value": keys[1]}
+        row.update(zip(dimensions, keys[2:]))
+        row["product"] = product if product is not None else 'All'
+        row["quote_channel"] = channel if channel is not None else 'All'
+        row["grouping_level"] = level
+        row.update(zip(COUNT_COLUMNS, totals))
+        rows.append(row)
+    rows.sort(key=lambda row: (
+        row["date_type"], row["date_value"], *[row[name] for name in dimensions], row["product"], row["quote_channel"],
+        row["grouping_level"]
+    ))
+    return rows
+
+
+def _pool_capacity(engine, wanted):
+    # Connections the engine's pool can hand out at once; more concurrent
+    # shards would only queue on the pool and risk its timeout
+    pool = engine.pool
+    if not hasattr(pool, "size") or not hasattr(pool, "_max_overflow"):
+        return wanted
+    if pool._max_overflow < 0:
+        return wanted
+    return max(1, min(wanted, pool.size() + pool._max_overflow))
+
+
+def aggregate_sharded(engine, Quote, Outbound, shards, periods=None, state=None, dimensions=()):
+    """
+    Aggregate repdata cells as `shards` partial aggregations running
+    concurrently, each in its own database session, and merge them. At most
+    as many shards run at once as the engine's pool has connections.
+
+    Args:
+        engine: SQLAlchemy engine for target database
+        Quote: Quote ORM model
+        Outbound: Outbound ORM model
+        shards: Number of quote_number hash shards
+        periods: Optional {date_type: [(start, end), ...]}, see build_lead_rows
+        state: Optional quote_state Table, see build_lead_rows
+        dimensions: See build_partial_stmt
+
+    Returns:
+        list: The merged cells, see merge_partials
+    """
+    def aggregate(index):
+        stmt = build_partial_stmt(Quote, Outbound, (index, shards), periods, state, dimensions)
+        with Session(engine) as session:
+            return session.execute(stmt).all()
+
+    with ThreadPoolExecutor(max_workers=_pool_capacity(engine, shards), thread_name_prefix="repdata-shard") as pool:
+        # A context copy per shard, so an EtlRun watching this thread also
+        # counts the shards' statements
+        futures = [pool.submit(contextvars.copy_context().run, aggregate, index) for index in range(shards)]
+        partials = (row._mapping for future in futures for row in future.result())
+        return merge_partials(partials, dimensions)
+
+
+def build_quote_sketch_stmt(Quote, Outbound, periods=None, state=None):
+    """Distinct (period ends, product, channel, quote_number) rows to sketch."""
+    dfw = build_lead_rows(Quote, Outbound, periods, state)
+    return select(
+        dfw.c.week_end_date,
+        dfw.c.month_end_date,
+        dfw.c.year_end_date,
+        dfw.c.product,
+        dfw.c.quote_channel,
+        dfw.c.quote_number
+    ).distinct()
+
+
+def attach_quote_sketches(db_session, Quote, Outbound, rows, periods=None, state=None):
+    """
+    Add a HyperLogLog sketch of the distinct quote numbers behind each repdata
+    cell, and its estimate, to the aggregated rows.
+
+    quote_count counts outbound attempts; distinct quotes can't be summed
+    across the 'All' rollups or from weeks into months, but sketches can be
+    merged, so any rollup or date range can be counted later without
+    rescanning Outbound.
+
+    Args:
+        db_session: Database session for target database
+        Quote: Quote ORM model
+        Outbound: Outbound ORM model
+        rows: Aggregated repdata rows
+        periods: The periods the rows were restricted to, if any
+        state: Optional quote_state Table, see build_lead_rows
+
+    Returns:
+        list: The rows as dictionaries with quote_sketch and distinct_quotes
+    """
+    rows = [dict(row) for row in rows]
+    # Keyed by grouping level as well: a NULL product or channel is reported
+    # as 'All', like the rollups, but its cell is a different one
+    sketches = {
+        (row["date_type"], row["date_value"], row["grouping_level"], row["product"], row["quote_channel"]): HyperLogLog()
+        for row in rows
+    }
+
+    stmt = build_quote_sketch_stmt(Quote, Outbound, periods, state)
+
+    for week_end, month_end, year_end, product, channel, quote_number in db_session.execute(stmt.execution_options(yield_per=50_000)):
+        index, rank = position(quote_number)
+        # Same cells GROUPING SETS produces, with NULLs coalesced to 'All'
+        for date_type, date_value in (('week', week_end), ('month', month_end), ('year', year_end)):
+            for level, (product_key, channel_key) in _grouping_levels(product or 'All', channel or 'All', 'All'):
+                sketch = sketches.get((date_type, date_value, level, product_key, channel_key))
+                if sketch is not None:
+                    sketch.add_position(index, rank)
+
+    for row in rows:
+        sketch = sketches[(row["date_type"], row["date_value"], row["grouping_level"], row["product"], row["quote_channel"])]
+        row["quote_sketch"] = sketch.to_bytes()
+        row["distinct_quotes"] = sketch.estimate()
+    return rows
+
+
+def bump_generation(db_session, metadata):
+    """
+    Increment the repdata generation inside the caller's transaction.
+
+    Returns:
+        int: The new generation
+    """
+    generation_table = repdata_generation_table(metadata)
+    updated = db_session.execute(
+        generation_table.update().where(generation_table.c.id == 1).values(
+            generation=generation_table.c.generation + 1,
+            refreshed_at=datetime.utcnow()
+        )
+    )
+    if updated.rowcount == 0:
+        db_session.execute(generation_table.insert(), [{"id": 1, "generation": 1, "refreshed_at": datetime.utcnow()}])
+    return db_session.execute(
+        select(generation_table.c.generation).where(generation_table.c.id == 1)
+    ).scalar()
+
+
+def publish_repdata_snapshots(snapshots, db_session, metadata):
+    """
+    Publish the committed repdata and repdata_advisor tables at their
+    current generation, repdata last: its generation is what readers switch
+    on.
+
+    Returns:
+        str: The published repdata snapshot version
+    """
+    generation_table = repdata_generation_table(metadata)
+    generation = db_session.execute(
+        select(generation_table.c.generation).where(generation_table.c.id == 1)
+    ).scalar()
+    publish_repdata(snapshots, db_session, repdata_advisor_table(metadata), generation, dataset="repdata_advisor")
+    return publish_repdata(snapshots, db_session, repdata_table(metadata), generation)
+
+
+# Re-read quotes changed this long before the last quote_state sync, so
+# changes committed while it ran aren't missed
+QUOTE_STATE_OVERLAP = timedelta(minutes=10)
+
+
+def quote_state_table(metadata, Quote, Outbound):
+    """
+    Define the per-quote state table the repdata aggregations join instead
+    of aggregating all of Quote and windowing all of Outbound: the quote's
+    bound count, last entry date and product/channel, and its first
+    non-organic outbound (the one counted as a new lead).
+    """
+    key = _outbound_key(Outbound)
+    return Table(
+        "quote_state",
+        metadata,
+        Column("quote_number", Quote.__table__.c.quote_number.type, primary_key=True),
+        Column("bound_count", Integer, nullable=False),
+        Column("last_entry_date", DateTime),
+        Column("product", Quote.__table__.c.product.type),
+        Column("quote_channel", Quote.__table__.c.quote_channel.type),
+        Column("first_outbound_id", key.type),
+        Column("first_outbound_at", DateTime),
+        Column("refreshed_at", DateTime, nullable=False),
+        extend_existing=True
     )
 
-    # Step 12: Define the reporting table schema
-    repdata = Table(
-        "repdata",
+
+def quote_state_sync_table(metadata):
+    """Define the single-row table holding when quote_state was last synced."""
+    return Table(
+        "quote_state_sync",
         metadata,
-        Column("id", Integer, primary_key=True, autoincrement=True),
-        Column("date_type", String),
-        Column("date_value", String),
-        Column("product", String),
-        Column("quote_channel", String),
-        Column("sale_count", Integer),
-        Column("quote_count", Integer), 
-        Column("sum_attempts", Integer),
-        Column("new_leads_given", Integer),
-        Column("new_leads_contacted", Integer),
-        Column("leads_no_recontact_needed", Integer),
-        Column("ta_answering_machine_no_message", Integer),
-        Column("ta_sale_policy", Integer),
-        Column("ta_call_back_scheduled", Integer),
-        Column("ta_too_expensive", Integer),
-        Column("ta_inbound_extension", Integer),
-        Column("ta_no_reason_provided", Integer),
-        Column("ta_purchased_insurance_elsewhere", Integer),
-        Column("ta_no_product_need", Integer),
-        Column("ta_bad_phone_number", Integer),
-        Column("ta_customer_policy_not_up_for_renewal", Integer),
-        Column("ta_customer_satisfied_with_current_insurer", Integer),
-        Column("ta_declined_by_insurer_for_other_reason", Integer),
-        Column("ta_active_follow_up_present", Integer),
-        Column("ta_other", Integer),
-        Column("ta_none", Integer),
-        Column("ta_total", Integer),
+        Column("id", Integer, primary_key=True, autoincrement=False),
+        Column("synced_at", DateTime, nullable=False),
         extend_existing=True
     )
 
-    # Step 8: Prepare table for new data
-    if inspector.has_table("repdata"):
-        print("Table repdata exists, deleting all rows...")
-        db_session.execute(repdata.delete())
-        db_session.commit()
-    else:
-        print("Table repdata does not exist, creating it...")
-        repdata.create(bind=engine)
 
-    # Step 9: Execute query and bulk insert results
-    print("Executing query and loading results...")
-    result = db_session.execute(final_stmt)
-    
-    # Convert results to list of dictionaries for bulk insert
-    rows_to_insert = [row._mapping for row in result]
-    
-    # Bulk insert all rows at once - much more efficient than row-by-row
-    if rows_to_insert:
-        db_session.execute(repdata.insert(), rows_to_insert)
+def build_quote_state_stmt(Quote, Outbound, quote_numbers=None):
+    """
+    Build the statement computing quote_state rows for every quote, or only
+    for `quote_numbers`. Quotes with outbounds but no Quote row get a row too,
+    with a bound count of 0, as build_lead_rows treats them.
+    """
+    key = _outbound_key(Outbound)
+    bound = _bound_stmt(Quote, quote_numbers).cte('bound_table')
+
+    # Same non-organic condition and first-outbound order as build_lead_rows
+    ranked = select(
+        Outbound.quote_number,
+        key.label("first_outbound_id"),
+        Outbound.created_at_dtm.label("first_outbound_at"),
+        func.row_number().over(
+            partition_by=Outbound.quote_number,
+            order_by=(Outbound.created_at_dtm, key)
+        ).label("rn")
+    ).select_from(
+        Outbound
+    ).outerjoin(
+        bound,
+        Outbound.quote_number == bound.c.quote_number
+    ).where(
+        Outbound.quote_number.in_(quote_numbers) if quote_numbers is not None else Outbound.quote_number.isnot(None),
+        _non_organic(Outbound.created_at_dtm, bound.c.last_entry_date, func.coalesce(bound.c.bound_count, 0))
+    ).subquery('ranked')
+    first = select(ranked).where(ranked.c.rn == 1).subquery('first_outbound')
+
+    return select(
+        func.coalesce(bound.c.quote_number, first.c.quote_number).label("quote_number"),
+        func.coalesce(bound.c.bound_count, 0).label("bound_count"),
+        bound.c.last_entry_date,
+        bound.c.product,
+        bound.c.quote_channel,
+        first.c.first_outbound_id,
+        first.c.first_outbound_at
+    ).select_from(
+        bound.join(first, bound.c.quote_number == first.c.quote_number, full=True)
+    )
+
+
+def refresh_quote_state(db_session, engine, metadata, Quote, Outbound, quote_numbers=None):
+    """
+    Recompute quote_state rows and swap them in within one transaction.
+
+    Args:
+        db_session: Database session for target database
+        engine: SQLAlchemy engine for target database
+        metadata: SQLAlchemy MetaData object for table definitions
+        Quote: Quote ORM model
+        Outbound: Outbound ORM model
+        quote_numbers: Quotes whose quote rows or outbounds changed, or None
+            to rebuild every row
+
+    Returns:
+        int: Number of quote_state rows written
+    """
+    state = quote_state_table(metadata, Quote, Outbound)
+    if not inspect(engine).has_table("quote_state"):
+        state.create(bind=engine)
+
+    refreshed_at = datetime.utcnow()
+    if quote_numbers is None:
+        rows = [{**row._mapping, "refreshed_at": refreshed_at} for row in db_session.execute(build_quote_state_stmt(Quote, Outbound))]
+        db_session.execute(state.delete())
+        if rows:
+            db_session.execute(state.insert(), rows)
         db_session.commit()
-        print(f"Successfully loaded {len(rows_to_insert)} rows into repdata")
+        return len(rows)
+
+    quote_numbers = [q for q in quote_numbers if q is not None]
+    written = 0
+    # The statement binds each chunk twice; stay below the 2100 parameter limit
+    for i in range(0, len(quote_numbers), 500):
+        chunk = quote_numbers[i:i + 500]
+        rows = [{**row._mapping, "refreshed_at": refreshed_at} for row in db_session.execute(build_quote_state_stmt(Quote, Outbound, chunk))]
+        db_session.execute(state.delete().where(state.c.quote_number.in_(chunk)))
+        if rows:
+            db_session.execute(state.insert(), rows)
+        written += len(rows)
+    db_session.commit()
+    return written
+
+
+def sync_quote_state(db_session, engine, metadata, Quote, Outbound, full=False):
+    """
+    Bring quote_state up to date with the quotes changed since its last
+    sync, using Quote.last_entry_date and the Outbound lifecycle timestamps
+    as change markers (as LiveRepdata.poll does). Builds every row on the
+    first sync.
+
+    The markers miss deleted rows and quote_number changes that leave the
+    timestamps alone, so quote_state is also diffed against the live quote
+    numbers and outbounds (see _stale_quotes). Quote rows deleted or moved
+    from a quote number that still has other rows go unnoticed until a
+    reconcile with full=True recomputes every row.
+
+    Args:
+        db_session: Database session for target database
+        engine: SQLAlchemy engine for target database
+        metadata: SQLAlchemy MetaData object for table definitions
+        Quote: Quote ORM model
+        Outbound: Outbound ORM model
+        full: Recompute every row instead of only the changed quotes
+
+    Returns:
+        int: Number of quote_state rows written
+    """
+    sync = quote_state_sync_table(metadata)
+    if not inspect(engine).has_table("quote_state_sync"):
+        sync.create(bind=engine)
+
+    synced_at = datetime.utcnow()
+    watermark = db_session.execute(select(sync.c.synced_at).where(sync.c.id == 1)).scalar()
+    if full or watermark is None:
+        written = refresh_quote_state(db_session, engine, metadata, Quote, Outbound)
     else:
-        print("No rows to insert")
+        changed = _changed_quotes(db_session, Quote, Outbound, watermark)
+        changed.update(_stale_quotes(db_session, quote_state_table(metadata, Quote, Outbound), Quote, Outbound))
+        written = refresh_quote_state(db_session, engine, metadata, Quote, Outbound, changed)
+
+    # Only advanced once the rows are in; a failed sync is retried from the
+    # previous watermark
+    updated = db_session.execute(sync.update().where(sync.c.id == 1).values(synced_at=synced_at))
+    if updated.rowcount == 0:
+        db_session.execute(sync.insert(), [{"id": 1, "synced_at": synced_at}])
+    db_session.commit()
+    return written
+
+
+def build_changed_quotes_stmts(Quote, Outbound, since):
+    """
+    Statements selecting the quote numbers whose Quote rows or outbounds
+    were stamped after `since`, by the change markers sync_quote_state uses.
+    """
+    return [
+        select(Quote.quote_number).where(Quote.last_entry_date > since),
+        select(Outbound.quote_number).where(or_(
+            Outbound.created_at_dtm > since,
+            Outbound.assigned_at_dtm > since,
+            Outbound.completed_at_dtm > since,
+            Outbound.unassigned_at_dtm > since,
+        )),
+    ]
+
+
+def build_stale_quotes_stmts(state, Quote, Outbound):
+    """
+    Statements selecting the quote numbers whose quote_state row the change
+    markers can't vouch for: rows left by deleted quotes, first outbounds
+    deleted or moved to another quote, quotes without a row, and quotes with
+    an earlier non-organic outbound than the recorded first one (moved in).
+    """
+    key = _outbound_key(Outbound)
+    quote_exists = select(Quote.quote_number).where(Quote.quote_number == state.c.quote_number).exists()
+    outbound_exists = select(Outbound.quote_number).where(Outbound.quote_number == state.c.quote_number).exists()
+    first_exists = select(key).where(
+        key == state.c.first_outbound_id, Outbound.quote_number == state.c.quote_number
+    ).exists()
+    state_exists = select(state.c.quote_number)
+
+    return [
+        select(state.c.quote_number).where(~quote_exists, ~outbound_exists),
+        select(state.c.quote_number).where(state.c.first_outbound_id.isnot(None), ~first_exists),
+        select(Quote.quote_number).distinct().where(Quote.quote_number.notin_(state_exists)),
+        select(Outbound.quote_number).distinct().where(
+            Outbound.quote_number.isnot(None), Outbound.quote_number.notin_(state_exists)
+        ),
+        select(Outbound.quote_number).distinct().join(
+            state, state.c.quote_number == Outbound.quote_number
+        ).where(
+            _non_organic(Outbound.created_at_dtm, state.c.last_entry_date, state.c.bound_count),
+            or_(state.c.first_outbound_at.is_(None), Outbound.created_at_dtm < state.c.first_outbound_at),
+        ),
+    ]
+
+
+def _changed_quotes(db_session, Quote, Outbound, watermark):
+    changed = set()
+    for stmt in build_changed_quotes_stmts(Quote, Outbound, watermark - QUOTE_STATE_OVERLAP):
+        changed.update(db_session.scalars(stmt))
+    return changed
+
 
-    # Step 10: Verify results
-    result_count = db_session.execute(select(func.count()).select_from(repdata)).scalar()
-    print(f"Total rows in repdata: {result_count}")
+def _stale_quotes(db_session, state, Quote, Outbound):
+    stale = set()
+    for stmt in build_stale_quotes_stmts(state, Quote, Outbound):
+        stale.update(db_session.scalars(stmt))
+    return stale
+
+
+def build_repdata_table(db_session, etl_session, engine, metadata, Quote, Outbound, run=None, snapshots=None, shards=None,
+                        rebuild_state=False):
+    """
+    Build and populate the repdata reporting table with aggregated metrics.
     
-    # Show sample row
-    sample = db_session.execute(select(repdata).limit(1)).first()
-    if sample:
-        print(f"Sample row - Date: {sample.date_value}, Product: {sample.product}, Channel: {sample.quote_channel}")
+    This function performs multi-level aggregations of quote and outbound data,
+    grouping by time periods (week/month/year) and dimensions (product/channel).
+    Uses GROUPING SETS for efficient aggregation across multiple dimension combinations.
     
-    print("Done")
+    Args:
+        db_session: Database session for target database
+        etl_session: Database session for ETL database
+        engine: SQLAlchemy engine for target database
+        metadata: SQLAlchemy MetaData object for table definitions
+        Quote: Quote ORM model
+        Outbound: Outbound ORM model
+        run: Optional EtlRun collecting metrics. When omitted, a run is created,
+            recorded in etl_runs and written to $ETL_METRICS_FILE if set.
+        snapshots: Optional SnapshotStore to publish the loaded table to,
+            defaults to $QUOTES_SNAPSHOT_DIR if set
+        shards: Number of quote_number hash shards aggregated concurrently
+            and merged (see aggregate_sharded), defaults to $REPDATA_SHARDS
+            or 1 for the single GROUPING SETS query
+        rebuild_state: Recompute every quote_state row instead of syncing
+            the changed quotes, for a scheduled reconcile or after a rule
+            change
+        
+    Returns:
+        int: Number of rows inserted into repdata table
+    """
+    inspector = inspect(engine)
     
+    # Steps 1-7: Aggregate quotes and outbounds into repdata cells, joining
+    # the per-quote state synced below
+    state = quote_state_table(metadata, Quote, Outbound)
+    final_stmt = build_repdata_stmt(Quote, Outbound, state=state)
+
+    # Step 12: Define the reporting table schemas
+    repdata = repdata_table(metadata)
+    repdata_advisor = repdata_advisor_table(metadata)
+
+    if snapshots is None:
+        snapshots = store_from_env()
+    if shards is None:
+        shards = int(os.environ.get("REPDATA_SHARDS", "1"))
+
+    owns_run = run is None
+    if owns_run:
+        run = EtlRun("repdata")
+
+    try:
+        with run.watch(engine):
+            # Step 8: Prepare tables for new data
+            with run.stage("prepare"):
+                if not inspector.has_table("repdata"):
+                    print("Table repdata does not exist, creating it...")
+                    repdata.create(bind=engine)
+                else:
+                    for name in ensure_columns(engine, repdata):
+                        print(f"Added column {name} to repdata")
+                if not inspector.has_table("repdata_advisor"):
+                    repdata_advisor.create(bind=engine)
+                if not inspector.has_table("repdata_generation"):
+                    repdata_generation_table(metadata).create(bind=engine)
+
+            # Bring quote_state up to date with the quotes changed since the
+            # last sync, or recompute it on request
+            with run.stage("state"):
+                written = sync_quote_state(db_session, engine, metadata, Quote, Outbound, full=rebuild_state)
+                print(f"{'Rebuilt' if rebuild_state else 'Synced'} quote_state for {written} quotes")
+
+            # Step 9: Execute query and bulk insert results
+            # Extract, window and aggregate all run server-side in this one statement
+            print("Executing query and loading results...")
+            with run.stage("query"):
+                if shards > 1:
+                    # Partial cells per quote_number hash shard, summed and
+                    # rolled up here
+                    result = aggregate_sharded(engine, Quote, Outbound, shards, state=state)
+                else:
+                    result = db_session.execute(final_stmt)
+
+            # Convert results to list of dictionaries for bulk insert
+            with run.stage("fetch"):
+                rows_to_insert = result if shards > 1 else [row._mapping for row in result]
+                run.add_rows(len(rows_to_insert), estimate_bytes(rows_to_insert))
+
+            # Distinct-quote sketches per cell, from one more pass over the
+            # per-outbound rows
+            with run.stage("sketch"):
+                rows_to_insert = attach_quote_sketches(db_session, Quote, Outbound, rows_to_insert, state=state)
+
+            # The same cells per advisor
+            with run.stage("advisor"):
+                if shards > 1:
+                    advisor_rows = aggregate_sharded(engine, Quote, Outbound, shards, state=state, dimensions=('user_id',))
+                else:
+                    advisor_rows = [row._mapping for row in db_session.execute(build_advisor_repdata_stmt(Quote, Outbound, state=state))]
+                run.add_rows(len(advisor_rows), estimate_bytes(advisor_rows))
+
+            # Replace the old rows and bump the generation in one transaction,
+            # so readers never see an empty or half-loaded table and report
+            # caches can warm up before switching to the new generation
+            with run.stage("load"):
+                print("Replacing all rows in repdata...")
+                db_session.execute(repdata.delete())
+                # Bulk insert all rows at once - much more efficient than row-by-row
+                if rows_to_insert:
+                    db_session.execute(repdata.insert(), rows_to_insert)
+                db_session.execute(repdata_advisor.delete())
+                if advisor_rows:
+                    db_session.execute(repdata_advisor.insert(), advisor_rows)
+                generation = bump_generation(db_session, metadata)
+                db_session.commit()
+                if rows_to_insert:
+                    print(f"Successfully loaded {len(rows_to_insert)} rows into repdata (generation {generation})")
+                else:
+                    print("No rows to insert")
+
+            # Publish the committed table for the report endpoints to read
+            # from disk instead of this database
+            if snapshots:
+                with run.stage("publish"):
+                    # repdata last: its generation is what readers switch on
+                    publish_repdata(snapshots, db_session, repdata_advisor, generation, dataset="repdata_advisor")
+                    version = publish_repdata(snapshots, db_session, repdata, generation)
+                    db_session.commit()
+                    print(f"Published repdata snapshot {version}")
+    except Exception as exc:
+        if owns_run:
+            db_session.rollback()
+            _report_failed_run(run.finish(exc), db_session, engine, metadata)
+        raise
+
+    # Step 10: Report metrics. The inserted row count is already known, so no
+    # COUNT(*) or sample-row scan of repdata is needed to verify the load.
+    if owns_run:
+        _report_run(run.finish(), db_session, engine, metadata)
+
     return len(rows_to_insert) if rows_to_insert else 0
 
 
+def _report_run(run, db_session, engine, metadata):
+    print(run.summary())
+    run.record(db_session, engine, metadata)
+    metrics_path = os.environ.get("ETL_METRICS_FILE")
+    if metrics_path:
+        run.write_prometheus(metrics_path)
+
+
+def _report_failed_run(run, db_session, engine, metadata):
+    # Never let reporting hide the exception that failed the run
+    try:
+        db_session.rollback()
+        _report_run(run, db_session, engine, metadata)
+    except Exception as exc:
+        print(f"Could not record failed run {run.name}: {exc!r}")
+
+
+DATE_TYPES = ('week', 'month', 'year')
+
+
+def affected_periods(db_session, Outbound, quote_numbers, created_times=()):
+    """
+    Find the week/month/year periods whose repdata cells depend on the given
+    quotes: every period containing one of their outbounds.
+
+    Args:
+        db_session: Database session for target database
+        Outbound: Outbound ORM model
+        quote_numbers: Quote numbers that changed
+        created_times: Extra outbound timestamps to include, e.g. the previous
+            created_at_dtm of an outbound whose timestamp was edited
+
+    Returns:
+        dict: {date_type: [(start, end), ...]} suitable for build_repdata_stmt
+    """
+    times = [t for t in created_times if t is not None]
+    quote_numbers = list(quote_numbers)
+    # Stay well below SQL Server's 2100 parameter limit
+    for i in range(0, len(quote_numbers), 1000):
+        times += db_session.scalars(
+            select(Outbound.created_at_dtm).where(Outbound.quote_number.in_(quote_numbers[i:i + 1000]))
+        ).all()
+
+    periods = {}
+    for date_type in DATE_TYPES:
+        ranges = {period_bounds(date_type, t) for t in times if t is not None}
+        if ranges:
+            periods[date_type] = sorted(ranges)
+    return periods
+
+
+def refresh_repdata_periods(db_session, engine, metadata, Quote, Outbound, periods, run=None, snapshots=None, sync_state=True,
+                            shards=1, bump=True):
+    """
+    Recompute the repdata cells of the given periods, including the 'All'
+    rollups, and swap them in within one transaction.
+
+    Args:
+        db_session: Database session for target database
+        engine: SQLAlchemy engine for target database
+        metadata: SQLAlchemy MetaData object for table definitions
+        Quote: Quote ORM model
+        Outbound: Outbound ORM model
+        periods: {date_type: [(start, end), ...]} as returned by affected_periods
+        run: Optional EtlRun collecting metrics
+        snapshots: Optional SnapshotStore to publish the refreshed table to,
+            defaults to $QUOTES_SNAPSHOT_DIR if set; False to skip publishing
+        sync_state: Sync quote_state first. Pass False when the caller has
+            synced it already, e.g. for parallel refreshes
+        shards: Number of quote_number hash shards, see build_repdata_table.
+            Not read from $REPDATA_SHARDS: refreshes are usually small, and
+            callers such as the backfill workers have one-connection pools
+        bump: Bump the repdata generation with the load. Pass False when
+            the caller bumps it once after many refreshes, e.g. a backfill,
+            so report caches don't rewarm after each one; nothing is
+            published then
+
+    Returns:
+        int: Number of repdata rows written, advisor rows excluded
+    """
+    if not periods:
+        return 0
+
+    repdata = repdata_table(metadata)
+    repdata_advisor = repdata_advisor_table(metadata)
+    state = quote_state_table(metadata, Quote, Outbound)
+    stmt = build_repdata_stmt(Quote, Outbound, periods, state)
+    advisor_stmt = build_advisor_repdata_stmt(Quote, Outbound, periods, state)
+    if not inspect(engine).has_table("repdata_advisor"):
+        repdata_advisor.create(bind=engine)
+    if not inspect(engine).has_table("repdata_generation"):
+        repdata_generation_table(metadata).create(bind=engine)
+    if snapshots is None:
+        snapshots = store_from_env()
+
+    owns_run = run is None
+    if owns_run:
+        run = EtlRun("repdata_refresh")
+
+    try:
+        with run.watch(engine):
+            if sync_state:
+                with run.stage("state"):
+                    sync_quote_state(db_session, engine, metadata, Quote, Outbound)
+
+            with run.stage("query"):
+                if shards > 1:
+                    rows = aggregate_sharded(engine, Quote, Outbound, shards, periods, state)
+                    advisor_rows = aggregate_sharded(engine, Quote, Outbound, shards, periods, state, ('user_id',))
+                else:
+                    rows = [row._mapping for row in db_session.execute(stmt)]
+                    advisor_rows = [row._mapping for row in db_session.execute(advisor_stmt)]
+                run.add_rows(len(rows) + len(advisor_rows), estimate_bytes(rows) + estimate_bytes(advisor_rows))
+
+            with run.stage("sketch"):
+                rows = attach_quote_sketches(db_session, Quote, Outbound, rows, periods, state)
+
+            with run.stage("load"):
+                for date_type, ranges in periods.items():
+                    # date_value is a string column; SQL Server converts it to
+                    # datetime for the comparison, just as it converted the
+                    # datetime to a string when the row was inserted.
+                    values = [period_end_value(date_type, start) for start, _ in ranges]
+                    for table in (repdata, repdata_advisor):
+                        for i in range(0, len(values), 1000):
+                            db_session.execute(table.delete().where(
+                                table.c.date_type == date_type,
+                                table.c.date_value.in_(values[i:i + 1000])
+                            ))
+                if rows:
+                    db_session.execute(repdata.insert(), rows)
+                if advisor_rows:
+                    db_session.execute(repdata_advisor.insert(), advisor_rows)
+                generation = bump_generation(db_session, metadata) if bump else None
+                db_session.commit()
+
+            if snapshots and bump:
+                with run.stage("publish"):
+                    publish_repdata(snapshots, db_session, repdata_advisor, generation, dataset="repdata_advisor")
+                    publish_repdata(snapshots, db_session, repdata, generation)
+                    db_session.commit()
+    except Exception as exc:
+        db_session.rollback()
+        if owns_run:
+            _report_failed_run(run.finish(exc), db_session, engine, metadata)
+        raise
+
+    if owns_run:
+        _report_run(run.finish(), db_session, engine, metadata)
+
+    return len(rows)
+
+
 # Example usage:
 # Uncomment and modify the following code block to run the data preparation
 """
 if __name__ == "__main__":
     # Import your models and session factories
     # from your_models import Quote, Outbound, SessionLocal, SessionLocal_ETL, engine, metadata
-    
-    with SessionLocal() as db, SessionLocal_ETL() as etl:
-        # Step 1: Build repdata table
-        rows_inserted = build_repdata_table(db, etl, engine, metadata, Quote, Outbound)
-        print(f"Step 1 complete: {rows_inserted} rows in repdata")
-        
-        # Step 2: Build other tables (add more steps as needed)
-        # rows_inserted = build_other_table(db, etl, engine, metadata, ...)
-        # print(f"Step 2 complete: {rows_inserted} rows in other_table")
-        
-        # Step 3: Additional processing
-        # ...
+    import models
+    from etl_runner import Pipeline, Step, repdata_step, supporting_indexes_step
+
+    pipeline = Pipeline(
+        [
+            # Step 1: Build repdata table
+            repdata_step(Quote, Outbound, retries=2),
+            # Indexes the exports and reports rely on (indexes.py)
+            supporting_indexes_step(models),
+            # Step 2: Build other tables (add more steps as needed). Steps that
+            # don't read each other's outputs run in parallel.
+            # Step("other_table", build_other_table, reads=("quote",), writes=("other_table",)),
+            # Step 3: Additional processing, runs once repdata is rebuilt
+            # Step("post_processing", post_process, reads=("repdata",), writes=(...)),
+        ],
+        engine,
+        SessionLocal,
+        SessionLocal_ETL,
+    )
+
+    # Pass only=["repdata"] to retry a single step, force=True to ignore
+    # unchanged inputs.
+    for name, (status, rows) in pipeline.run(max_workers=4).items():
+        print(f"{name}: {status} ({rows})")
 """
@@ -0,0 +1,308 @@
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import MetaData, event, func, inspect, or_, select
+from sqlalchemy.orm import Session
+
+from actionable import refresh_actionable_quotes
+from agg3a import (
+    QUOTE_STATE_OVERLAP, affected_periods, publish_repdata_snapshots, refresh_quote_state, refresh_repdata_periods
+)
+from etl_metrics import EtlRun
+from snapshots import store_from_env
+
+
+class LiveRepdata:
+    """
+    Keep repdata and the actionable_quotes projection close to real time by
+    recomputing only the periods and quotes touched by changed quotes and
+    outbounds.
+
+    Changes are collected either from SQLAlchemy mapper events on Quote and
+    Outbound (listen) or by polling their timestamp columns (poll). Changed
+    quote numbers accumulate until no new change has arrived for `debounce`
+    seconds, or `max_delay` seconds after the first one, and are then
+    recomputed together in one small refresh.
+
+    Args:
+        engine: SQLAlchemy engine for target database
+        Quote: Quote ORM model
+        Outbound: Outbound ORM model
+        debounce: Quiet period, in seconds, that closes a batch
+        max_delay: Upper bound, in seconds, on how long a change can wait
+        publish_interval: Least number of seconds between publishing repdata
+            snapshots (to $QUOTES_SNAPSHOT_DIR if set); refreshes in between
+            are published together
+    """
+
+    def __init__(self, engine, Quote, Outbound, debounce=5.0, max_delay=60.0, publish_interval=60.0):
+        self.engine = engine
+        self.Quote = Quote
+        self.Outbound = Outbound
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.publish_interval = publish_interval
+        self.snapshots = store_from_env()
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._quote_numbers = set()
+        self._created_times = set()
+        self._first_change = None
+        self._last_change = None
+        self._thread = None
+        self._watermark = None
+        self._seen = set()
+        self._scheduled = {}
+        self._publish_pending = False
+        self._published_at = float("-inf")
+
+    # Change capture
+
+    def add(self, quote_numbers, created_times=()):
+        """Queue quote numbers (and old outbound timestamps) for recompute."""
+        now = time.monotonic()
+        with self._lock:
+            self._quote_numbers.update(q for q in quote_numbers if q is not None)
+            self._created_times.update(t for t in created_times if t is not None)
+            if self._first_change is None:
+                self._first_change = now
+            self._last_change = now
+        self._wakeup.set()
+
+    def _pending(self, session):
+        return session.info.setdefault("repdata_pending", (set(), set()))
+
+    def _on_quote(self, mapper, connection, target):
+        session = Session.object_session(target)
+        if session is not None:
+            self._pending(session)[0].add(target.quote_number)
+
+    def _on_outbound(self, mapper, connection, target):
+        session = Session.object_session(target)
+        if session is None:
+            return
+        quote_numbers, created_times = self._pending(session)
+        quote_numbers.add(target.quote_number)
+        # affected_periods only finds outbounds that still exist, so a deleted
+        # outbound's period must be queued from the row itself
+        created_times.add(target.created_at_dtm)
+        # An outbound moved to another quote or period also leaves its old cells
+        state = inspect(target)
+        quote_numbers.update(state.attrs.quote_number.history.deleted or ())
+        created_times.update(state.attrs.created_at_dtm.history.deleted or ())
+
+    def _after_commit(self, session):
+        pending = session.info.pop("repdata_pending", None)
+        if pending and pending[0]:
+            self.add(*pending)
+
+    def _after_rollback(self, session):
+        session.info.pop("repdata_pending", None)
+
+    def listen(self):
+        """
+        Capture changes from every session writing Quote or Outbound rows in
+        this process. Changes are queued only once their transaction commits.
+        """
+        for name in ("after_insert", "after_update", "after_delete"):
+            event.listen(self.Quote, name, self._on_quote)
+            event.listen(self.Outbound, name, self._on_outbound)
+        event.listen(Session, "after_commit", self._after_commit)
+        event.listen(Session, "after_rollback", self._after_rollback)
+
+    def unlisten(self):
+        for name in ("after_insert", "after_update", "after_delete"):
+            event.remove(self.Quote, name, self._on_quote)
+            event.remove(self.Outbound, name, self._on_outbound)
+        event.remove(Session, "after_commit", self._after_commit)
+        event.remove(Session, "after_rollback", self._after_rollback)
+
+    def poll(self, session):
+        """
+        Queue quotes changed since the previous poll, for writers that don't
+        go through this process. Uses Quote.last_entry_date, the Outbound
+        lifecycle timestamps and the latest scheduled_outbound_dt per quote as
+        change markers.
+        """
+        since = self._watermark
+        now = datetime.utcnow()
+        if since is None:
+            # First poll only establishes the watermarks
+            self._watermark = now
+            self._seen = self._markers(session, now - QUOTE_STATE_OVERLAP)
+            self._scheduled = self._latest_scheduled(session, now)
+            return 0
+
+        # Rows stamped before the previous poll may commit after it, so look
+        # back QUOTE_STATE_OVERLAP further and queue only the markers that
+        # weren't seen yet
+        markers = self._markers(session, since - QUOTE_STATE_OVERLAP)
+        changed = {quote_number for quote_number, _ in markers - self._seen}
+        self._seen = markers
+        # scheduled_outbound_dt lies in the future, so it can't serve as a
+        # watermark itself; compare each quote's latest schedule with the
+        # previous poll's instead, so a rescheduled or unscheduled outbound is
+        # picked up
+        scheduled = self._latest_scheduled(session, since)
+        changed.update(
+            quote_number for quote_number, scheduled_dt in scheduled.items()
+            if self._scheduled.get(quote_number) != scheduled_dt
+        )
+        changed.update(
+            quote_number for quote_number, scheduled_dt in self._scheduled.items()
+            if scheduled_dt > since and quote_number not in scheduled
+        )
+        self._scheduled = scheduled
+        self._watermark = now
+        if changed:
+            self.add(changed)
+        return len(changed)
+
+    def _markers(self, session, since):
+        # (quote_number, timestamp) change markers stamped after `since`
+        Quote, Outbound = self.Quote, self.Outbound
+        markers = set(session.execute(
+            select(Quote.quote_number, Quote.last_entry_date).where(Quote.last_entry_date > since)
+        ).all())
+        timestamps = (
+            Outbound.created_at_dtm,
+            Outbound.assigned_at_dtm,
+            Outbound.completed_at_dtm,
+            Outbound.unassigned_at_dtm,
+        )
+        rows = session.execute(
+            select(Outbound.quote_number, *timestamps).where(or_(*[t > since for t in timestamps]))
+        )
+        for quote_number, *times in rows:
+            markers.update((quote_number, t) for t in times if t is not None and t > since)
+        return markers
+
+    def _latest_scheduled(self, session, since):
+        Outbound = self.Outbound
+        return dict(session.execute(
+            select(Outbound.quote_number, func.max(Outbound.scheduled_outbound_dt))
+            .where(Outbound.scheduled_outbound_dt > since)
+            .group_by(Outbound.quote_number)
+        ).all())
+
+    # Recompute
+
+    def _take_batch(self):
+        with self._lock:
+            if not self._quote_numbers:
+                return None
+            now = time.monotonic()
+            if now - self._last_change < self.debounce and now - self._first_change < self.max_delay:
+                return None
+            batch = (self._quote_numbers, self._created_times)
+            self._quote_numbers, self._created_times = set(), set()
+            self._first_change = self._last_change = None
+            return batch
+
+    def flush(self):
+        """
+        Recompute the pending batch now, ignoring the debounce window.
+
+        Returns:
+            int: Number of repdata rows rewritten
+        """
+        with self._lock:
+            batch = (self._quote_numbers, self._created_times)
+            self._quote_numbers, self._created_times = set(), set()
+            self._first_change = self._last_change = None
+        return self._refresh(*batch) if batch[0] or batch[1] else 0
+
+    def _refresh(self, quote_numbers, created_times):
+        with Session(self.engine) as session:
+            periods = affected_periods(session, self.Outbound, quote_numbers, created_times)
+            # The captured quotes are exactly the ones whose state changed, so
+            # no marker scan over all of Quote and Outbound is needed
+            refresh_quote_state(session, self.engine, MetaData(), self.Quote, self.Outbound, quote_numbers)
+            # A run of our own, so these frequent small refreshes aren't
+            # recorded in etl_runs or reported like builds
+            # Publishing rewrites both full snapshots, so it is throttled
+            # separately (see publish)
+            rows = refresh_repdata_periods(
+                session, self.engine, MetaData(), self.Quote, self.Outbound, periods,
+                run=EtlRun("repdata_live"), snapshots=False, sync_state=False
+            )
+            actionable = refresh_actionable_quotes(session, self.engine, MetaData(), self.Quote, self.Outbound, quote_numbers)
+        if periods:
+            self._publish_pending = True
+        cells = sum(len(r) for r in periods.values())
+        print(f"Refreshed {cells} repdata periods ({rows} rows) and {actionable} actionable quotes "
+              f"for {len(quote_numbers)} changed quotes")
+        return rows
+
+    def publish(self, force=False):
+        """
+        Publish the refreshed repdata snapshots if a refresh is unpublished
+        and publish_interval has passed since the last publish, or `force`.
+
+        Returns:
+            bool: Whether snapshots were published
+        """
+        if self.snapshots is None or not self._publish_pending:
+            return False
+        if not force and time.monotonic() - self._published_at < self.publish_interval:
+            return False
+        self._publish_pending = False
+        try:
+            with Session(self.engine) as session:
+                publish_repdata_snapshots(self.snapshots, session, MetaData())
+        except Exception:
+            self._publish_pending = True
+            raise
+        self._published_at = time.monotonic()
+        return True
+
+    def _loop(self, poll_interval):
+        while not self._stop.is_set():
+            if poll_interval is not None:
+                # A failed poll is retried from the same watermark next time
+                try:
+                    with Session(self.engine) as session:
+                        self.poll(session)
+                except Exception as exc:
+                    print(f"Repdata change poll failed, retrying: {exc!r}")
+            batch = self._take_batch()
+            if batch is not None:
+                try:
+                    self._refresh(*batch)
+                except Exception as exc:
+                    print(f"Repdata refresh failed, requeueing: {exc!r}")
+                    self.add(*batch)
+            try:
+                self.publish()
+            except Exception as exc:
+                print(f"Repdata snapshot publish failed, retrying: {exc!r}")
+            self._wakeup.wait(timeout=min(self.debounce, poll_interval or self.debounce))
+            self._wakeup.clear()
+
+    def start(self, poll_interval=None):
+        """
+        Start the background maintenance thread.
+
+        Args:
+            poll_interval: Seconds between polls, or None to rely on listen()
+        """
+        if poll_interval is not None:
+            with Session(self.engine) as session:
+                self.poll(session)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, args=(poll_interval,), name="repdata-live", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, flush=True):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if flush:
+            self.flush()
+            self.publish(force=True)
@@ -1,22 +1,165 @@
+import asyncio
+import hashlib
+import json
+import os
 from datetime import date, datetime, timedelta
-from typing import List, Union
+from functools import lru_cache
+from types import SimpleNamespace
+from typing import List, Optional, Union
 
-from fastapi import APIRouter, Depends, HTTPException, Request
-from sqlalchemy import and_, case, desc, func, or_, select
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, StreamingResponse
+from pydantic import TypeAdapter, create_model
+from sqlalchemy import MetaData, and_, case, column, desc, func, or_, select, table
+from sqlalchemy.orm import aliased
 
+import hll
+import actionable
+import derived
+import downsample
+import loaders
+import schema
+import snapshots
+from admission import AdmissionController, PriorityClass, Rejected
+from export_jobs import ExportJobs
+from reportcache import ReportCache
+from singleflight import SingleFlight
+from ttlcache import TTLCache
 from src import serializers, validators
 from src.database import dbutils, models
 from src.validators.api import quotes as QuoteValidator
 
-router = APIRouter(prefix="/quotes")
 
+async def _resume_exports(request: Request):
+    # The first request after startup brings the engine that export jobs
+    # interrupted by the previous process resume on
+    if export_jobs.has_unfinished():
+        export_jobs.resume_unfinished(request.state.db.get_bind())
 
-@router.get("", response_model=serializers.pagination_factory(serializers.Quote))
+
+router = APIRouter(prefix="/quotes", dependencies=[Depends(_resume_exports)])
+
+# Test mode: count statements per request so a harness can assert the page
+# size doesn't change how many round-trips a page costs
+QUERY_BUDGET_MODE = bool(os.environ.get("QUOTES_QUERY_BUDGET_MODE"))
+
+# Statements besides eager loads: dbutils.paginate runs a count and a page query
+QUERY_BUDGETS = {"index": 2, "show": 1}
+
+# Concurrent identical report requests share one query and encoded body
+report_flight = SingleFlight()
+
+# Seconds between keep-alive comments on an idle report event stream
+REPORT_EVENTS_HEARTBEAT = 15.0
+
+# Downsampled, projected and derived report bodies, per repdata generation
+report_views = TTLCache(ttl=float(os.environ.get("QUOTES_REPORT_VIEW_TTL", "300")), maxsize=2000)
+
+# Encoded quotes with their ETag, shared by show and batch
+quote_cache = TTLCache(ttl=float(os.environ.get("QUOTES_CACHE_TTL", "15")))
+MAX_BATCH_SIZE = 500
+
+# Background exports, written as part files under QUOTES_EXPORT_DIR
+export_jobs = ExportJobs(
+    os.environ.get("QUOTES_EXPORT_DIR", "exports"),
+    models.QuoteHistory,
+    [name for name in serializers.QuoteHistory.model_fields if name in models.QuoteHistory.__table__.c],
+    workers=int(os.environ.get("QUOTES_EXPORT_WORKERS", "4")),
+)
+
+# Columnar copies of repdata and QuoteHistory under QUOTES_SNAPSHOT_DIR; when
+# published, report reads and exports are served from them
+snapshot_store = snapshots.store_from_env()
+
+# Parallel sessions of a ReportCache warm-up
+REPORT_WARMUP_WORKERS = int(os.environ.get("QUOTES_REPORT_WARMUP_WORKERS", "4"))
+
+# Database slots shared by the request classes, normally the pool size.
+# Advisors' list and quote views may use every slot; reports and exports are
+# capped below the capacity, so the rest always stays free for them. Background
+# export workers and report cache warm-ups hold connections outside admission,
+# so their slots are taken off the capacity up front.
+admission = AdmissionController(
+    max(1, int(os.environ.get("QUOTES_ADMISSION_CAPACITY", "16")) - export_jobs.workers - REPORT_WARMUP_WORKERS),
+    [
+        PriorityClass("interactive", 0, queue_size=200, timeout=5.0),
+        PriorityClass("report", 1, limit=int(os.environ.get("QUOTES_ADMISSION_REPORTS", "6")), queue_size=50, timeout=15.0),
+        PriorityClass("export", 2, limit=int(os.environ.get("QUOTES_ADMISSION_EXPORTS", "2")), queue_size=10, timeout=30.0),
+    ],
+)
+
+
+
+def _admit(name):
+    """Dependency holding an admission slot of class `name` for the request."""
+    async def admit():
+        try:
+            await admission.acquire(name)
+        except Rejected as exc:
+            raise HTTPException(status_code=503, detail=str(exc), headers={"Retry-After": str(int(exc.retry_after))})
+        try:
+            yield
+        finally:
+            admission.release(name)
+
+    return admit
+
+
+# Read the admin index from the actionable_quotes projection (kept current by
+# the actionable_quotes ETL step and LiveRepdata) instead of evaluating the
+# actionable predicate over every quote
+ACTIONABLE_PROJECTION = bool(os.environ.get("QUOTES_ACTIONABLE_PROJECTION"))
+actionable_quotes = actionable.actionable_quotes_table(MetaData(), models.Quote)
+
+QuoteItem = TypeAdapter(serializers.Quote)
+QuoteHistoryList = TypeAdapter(List[serializers.QuoteHistory])
+RepDataList = TypeAdapter(List[serializers.RepData])
+AdvisorRepDataList = TypeAdapter(List[serializers.AdvisorRepData])
+MeltedAttemptDataList = TypeAdapter(List[serializers.MeltedAttemptData])
+
+# Define the mapping of column names to series names
+SERIES_MAPPING = {
+    'ta_answering_machine_no_message': 'Answering Machine - No Message',
+    'ta_sale_policy': 'Sale - Policy',
+    'ta_call_back_scheduled': 'Call back scheduled',
+    'ta_too_expensive': 'Too expensive',
+    'ta_inbound_extension': 'Inbound - extension',
+    'ta_no_reason_provided': 'No Reason Provided',
+    'ta_purchased_insurance_elsewhere': 'Purchased insurance elsewhere',
+    'ta_no_product_need': 'No Product Need',
+    'ta_bad_phone_number': 'Bad phone number',
+    'ta_customer_policy_not_up_for_renewal': 'Customer Policy not up for renewal',
+    'ta_customer_satisfied_with_current_insurer': 'Customer satisfied with current insurer',
+    'ta_declined_by_insurer_for_other_reason': 'Declined by Insurer for other reason',
+    'ta_active_follow_up_present': 'Active Follow-up Present',
+    'ta_other': 'Other',
+    'ta_none': 'None',
+    'ta_total': 'Total'
+}
+
+# Every column the report charts and table plot, for downsampling
+REPORT_SERIES = (
+    'sale_count',
+    'quote_count',
+    'sum_attempts',
+    'new_leads_given',
+    'new_leads_contacted',
+    'leads_no_recontact_needed',
+    *SERIES_MAPPING,
+)
+
+
+@router.get("", response_model=serializers.pagination_factory(serializers.Quote), dependencies=[Depends(_admit("interactive"))])
 def index(
     request: Request,
     query: dict = Depends(QuoteValidator.index_query),
 ):
-    stmt = select(models.Quote)
+    plan = loaders.loader_plan(models.Quote, serializers.Quote)
+    if QUERY_BUDGET_MODE:
+        loaders.count_statements(request.state.db, QUERY_BUDGETS["index"] + plan.extra_statements)
+
+    stmt = select(models.Quote).options(*plan.options)
 
     if query["filters"]["self_assigned"] is not None:
         latest_outbounds_subquery = (
@@ -57,24 +200,38 @@ def index(
         """
             Actionable Quotes
         """
-        stmt = stmt.where(
-            and_(
-                models.Quote.transaction_status.in_(["Quoted", "Draft", "Quoting"]),
-                models.Quote.quote_channel.in_(["Web", "Inbound"]),
-                models.Quote.reject_reason.is_(None),
-                models.Quote.sqpm_quote_sale_reporting_in == 1,
-                or_(
-                    models.Quote.last_entry_date
-                    > (datetime.utcnow() - timedelta(days=10)),
-                    models.Quote.quote_number.in_(
-                        select(models.Outbound.quote_number).where(
-                            models.Outbound.scheduled_outbound_dt
-                            > (datetime.utcnow() - timedelta(days=10))
-                        )
-                    ),
+        if ACTIONABLE_PROJECTION:
+            # Served by ix_actionable_quotes_last_activity; the remaining
+            # filters and sorts then only see the pre-narrowed set. The
+            # projection is per quote number, so the per-row conditions still
+            # apply to the joined Quote rows
+            stmt = stmt.join(
+                actionable_quotes, actionable_quotes.c.quote_number == models.Quote.quote_number
+            ).where(
+                actionable.actionable_filter(models.Quote),
+                actionable.actionable_window(
+                    actionable_quotes, models.Quote, actionable.actionable_since()
                 ),
             )
-        )
+        else:
+            stmt = stmt.where(
+                and_(
+                    models.Quote.transaction_status.in_(["Quoted", "Draft", "Quoting"]),
+                    models.Quote.quote_channel.in_(["Web", "Inbound"]),
+                    models.Quote.reject_reason.is_(None),
+                    models.Quote.sqpm_quote_sale_reporting_in == 1,
+                    or_(
+                        models.Quote.last_entry_date
+                        > (datetime.utcnow() - timedelta(days=10)),
+                        models.Quote.quote_number.in_(
+                            select(models.Outbound.quote_number).where(
+                                models.Outbound.scheduled_outbound_dt
+                                > (datetime.utcnow() - timedelta(days=10))
+                            )
+                        ),
+                    ),
+                )
+            )
 
     for filter in [
         _filter for _filter in query["filters"] if _filter != "self_assigned"
@@ -179,69 +336,170 @@ def index(
     return dbutils.paginate(request.state.db, stmt, orderby, **query["pagination"])
 
 
-@router.get("/export", response_model=List[serializers.QuoteHistory])
+def _export_stmt(start, end, latest_only=False):
+    if start is not None:
+        # convert the date to the start of the day datetime
+        start = datetime.combine(start, datetime.min.time())
+
+    if end is not None:
+        # convert the date to the end of the day datetime
+        end = datetime.combine(end, datetime.max.time())
+
+    conditions = []
+    if start is not None:
+        conditions.append(models.QuoteHistory.quote_entry_date >= start)
+    if end is not None:
+        conditions.append(models.QuoteHistory.quote_entry_date <= end)
+
+    if not latest_only:
+        # filter the quotes
+        return select(models.QuoteHistory).where(*conditions).order_by(
+            models.QuoteHistory.quote_number,
+            desc(models.QuoteHistory.quote_entry_date),
+        )
+
+    # Newest version per quote within the range, picked by the database.
+    # ix_quote_history_quote_number_entry_date (indexes.py) lets it read each
+    # quote's versions already in window order instead of sorting them.
+    ranked = (
+        select(
+            models.QuoteHistory,
+            func.row_number()
+            .over(
+                partition_by=models.QuoteHistory.quote_number,
+                order_by=desc(models.QuoteHistory.quote_entry_date),
+            )
+            .label("version_rank"),
+        )
+        .where(*conditions)
+        .subquery()
+    )
+    latest = aliased(models.QuoteHistory, ranked)
+
+    return select(latest).where(ranked.c.version_rank == 1).order_by(latest.quote_number)
+
+
+def _snapshot_export(start, end, latest_only=False):
+    """Stream an export from the quote_history snapshot, if one is published."""
+    if snapshot_store is None:
+        return None
+
+    batches = snapshot_store.history_batches(
+        datetime.combine(start, datetime.min.time()) if start is not None else None,
+        datetime.combine(end, datetime.max.time()) if end is not None else None,
+        latest_only,
+    )
+    if batches is None:
+        return None
+
+    def stream():
+        yield b"["
+        first = True
+        for batch in batches:
+            if not batch:
+                continue
+            if not first:
+                yield b","
+            first = False
+            # Encode each batch as an array and splice it into the outer one
+            yield _encode(QuoteHistoryList, batch)[1:-1]
+        yield b"]"
+
+    return StreamingResponse(
+        stream(),
+        media_type="application/json",
+        headers={"X-Snapshot-Version": snapshot_store.current_version("quote_history")},
+    )
+
+
+@router.get("/export", response_model=List[serializers.QuoteHistory], dependencies=[Depends(_admit("export"))])
 def export_quotes(
     request: Request,
     start: Union[date, None] = None,
     end: Union[date, None] = None,
+    latest_only: bool = False,
 ):
     if "ADMIN" not in request.state.auth["roles"]:
         raise HTTPException(status_code=403)
 
-    quotes_stmt = select(models.QuoteHistory).order_by(
-        models.QuoteHistory.quote_number,
-        desc(models.QuoteHistory.quote_entry_date),
-    )
+    response = _snapshot_export(start, end, latest_only)
+    if response is not None:
+        return response
+
+    quotes_stmt = _export_stmt(start, end, latest_only)
+
+    return request.state.db.scalars(quotes_stmt).all()
+
+
+@router.post("/export/jobs", response_model=serializers.ExportJob, status_code=202)
+def create_export_job(
+    request: Request,
+    start: Union[date, None] = None,
+    end: Union[date, None] = None,
+    format: str = "csv",
+    latest_only: bool = False,
+):
+    if "ADMIN" not in request.state.auth["roles"]:
+        raise HTTPException(status_code=403)
 
     if start is not None:
-        # convert the date to the start of the day datetime
         start = datetime.combine(start, datetime.min.time())
 
-        # filter the quotes
-        quotes_stmt = quotes_stmt.where(models.QuoteHistory.quote_entry_date >= start)
-
     if end is not None:
-        # convert the date to the end of the day datetime
         end = datetime.combine(end, datetime.max.time())
 
-        # filter the quotes
-        quotes_stmt = quotes_stmt.where(models.QuoteHistory.quote_entry_date <= end)
+    try:
+        job = export_jobs.submit(request.state.db.get_bind(), start, end, format, latest_only)
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
 
-    return request.state.db.scalars(quotes_stmt).all()
+    return job.as_dict()
 
 
-@router.get("/report_data", response_model=List[serializers.RepData])
-def report_data(
-    request: Request,
-    channel: str,
-    product: str,
-    date_type: str,
-):
+@router.get("/export/jobs/{job_id}", response_model=serializers.ExportJob)
+def export_job_status(job_id: str, request: Request):
     if "ADMIN" not in request.state.auth["roles"]:
         raise HTTPException(status_code=403)
 
-    report_stmt = select(models.RepData).where(
-        and_(
-            models.RepData.quote_channel == channel,
-            models.RepData.product == product,
-            models.RepData.date_type == date_type,
-        )
-    )
+    job = export_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404)
 
-    return request.state.db.scalars(report_stmt).all()
+    return job.as_dict()
 
 
-@router.get("/report_data_melted", response_model=List[serializers.MeltedAttemptData])
-def report_data_melted(
-    request: Request,
-    channel: str,
-    product: str,
-    date_type: str,
-):
+@router.get("/export/jobs/{job_id}/download")
+def download_export_job(job_id: str, request: Request):
     if "ADMIN" not in request.state.auth["roles"]:
         raise HTTPException(status_code=403)
 
-    report_stmt = select(models.RepData).where(
+    job = export_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404)
+
+    if job.status != "succeeded":
+        raise HTTPException(status_code=409, detail=f"Export is {job.status}")
+
+    return FileResponse(job.path, filename=f"quotes-{job.start:%Y%m%d}-{job.end:%Y%m%d}.{os.path.basename(job.path).split('.', 1)[1]}")
+
+
+def _encode(adapter, items):
+    return adapter.dump_json(adapter.validate_python(items, from_attributes=True))
+
+
+def _snapshot_report_rows(channel, product, date_type, fields=None):
+    if snapshot_store is None:
+        return None
+    rows = snapshot_store.report_rows(channel, product, date_type, fields or tuple(serializers.RepData.model_fields))
+    if rows is None:
+        return None
+    # Attribute access, like the ORM rows the serializers and melt expect
+    return [SimpleNamespace(**row) for row in rows]
+
+
+def _report_stmt(channel, product, date_type, fields=None):
+    columns = (models.RepData,) if fields is None else [getattr(models.RepData, name) for name in fields]
+    return select(*columns).where(
         and_(
             models.RepData.quote_channel == channel,
             models.RepData.product == product,
@@ -249,33 +507,91 @@ def report_data_melted(
         )
     )
 
-    report_data = request.state.db.scalars(report_stmt).all()
 
+def _report_rows(db, channel, product, date_type, fields=None):
+    rows = _snapshot_report_rows(channel, product, date_type, fields)
+    if rows is not None:
+        return rows
+
+    report_stmt = _report_stmt(channel, product, date_type, fields)
+    if fields is not None:
+        return db.execute(report_stmt).all()
+
+    return db.scalars(report_stmt).all()
+
+
+def _report_fields(fields):
+    """
+    Parse a comma-separated fields= value into a tuple of RepData columns in
+    serializer order, so equal sets share one cached serializer.
+    """
+    if fields is None:
+        return None
+    requested = {name.strip() for name in fields.split(",") if name.strip()}
+    available = [
+        name for name in serializers.RepData.model_fields
+        if name in models.RepData.__table__.c
+    ]
+    unknown = requested.difference(available)
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    # The charts key every point by its date
+    requested.add("date_value")
+    return tuple(name for name in available if name in requested)
+
+
+def _report_metrics(metrics):
+    """Parse a comma-separated metrics= value, see derived.parse."""
+    if metrics is None:
+        return None
+    try:
+        return derived.parse([name.strip() for name in metrics.split(",") if name.strip()], REPORT_SERIES) or None
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+
+
+def _select_fields(fields, metrics):
+    """Columns to load: the requested ones plus the inputs of the metrics."""
+    if fields is None or metrics is None:
+        return fields
+    needed = set(fields) | derived.required_columns(metrics)
+    return tuple(name for name in serializers.RepData.model_fields if name in needed)
+
+
+@lru_cache(maxsize=128)
+def _projected_list(fields, metrics=None, serializer=serializers.RepData):
+    """
+    TypeAdapter for a list of `serializer` restricted to `fields` (all
+    fields when None), with a float field per derived metric.
+    """
+    if fields is None:
+        fields = tuple(serializer.model_fields)
+    projected = create_model(
+        f"{serializer.__name__}Fields",
+        __config__=serializer.model_config,
+        **{
+            name: (serializer.model_fields[name].annotation, serializer.model_fields[name])
+            for name in fields
+        },
+        **{name: (Optional[float], None) for name in metrics or ()},
+    )
+    return TypeAdapter(List[projected])
+
+
+def _report_data_json(db, channel, product, date_type):
+    return _encode(RepDataList, _report_rows(db, channel, product, date_type))
+
+
+def _report_data_melted_json(db, channel, product, date_type):
+    return _encode(MeltedAttemptDataList, _melt(_report_rows(db, channel, product, date_type)))
+
+
+def _melt(report_data):
     # Melt the data: transform wide format to long format
     melted_data = []
-    
-    # Define the mapping of column names to series names
-    series_mapping = {
-        'ta_answering_machine_no_message': 'Answering Machine - No Message',
-        'ta_sale_policy': 'Sale - Policy',
-        'ta_call_back_scheduled': 'Call back scheduled',
-        'ta_too_expensive': 'Too expensive',
-        'ta_inbound_extension': 'Inbound - extension',
-        'ta_no_reason_provided': 'No Reason Provided',
-        'ta_purchased_insurance_elsewhere': 'Purchased insurance elsewhere',
-        'ta_no_product_need': 'No Product Need',
-        'ta_bad_phone_number': 'Bad phone number',
-        'ta_customer_policy_not_up_for_renewal': 'Customer Policy not up for renewal',
-        'ta_customer_satisfied_with_current_insurer': 'Customer satisfied with current insurer',
-        'ta_declined_by_insurer_for_other_reason': 'Declined by Insurer for other reason',
-        'ta_active_follow_up_present': 'Active Follow-up Present',
-        'ta_other': 'Other',
-        'ta_none': 'None',
-        'ta_total': 'Total'
-    }
-    
+
     for row in report_data:
-        for column_name, series_name in series_mapping.items():
+        for column_name, series_name in SERIES_MAPPING.items():
             value = getattr(row, column_name, 0)
             melted_data.append(
                 serializers.MeltedAttemptData(
@@ -284,17 +600,482 @@ def report_data_melted(
                     series_value=value if value is not None else 0
                 )
             )
-    
+
     return melted_data
 
 
-@router.get("/{quote_number}", response_model=serializers.Quote)
-def show(quote_number, request: Request):
-    quote = request.state.db.scalar(
-        select(models.Quote).where(models.Quote.quote_number == quote_number)
+def _report_view_json(endpoint, rows, max_points=None, fields=None, metrics=None):
+    rows = sorted(rows, key=lambda row: row.date_value)
+    # Derive over the full series first, so deltas and moving averages don't
+    # depend on which points downsampling keeps
+    if metrics is not None:
+        rows = derived.attach(rows, metrics)
+    if max_points is not None:
+        rows = downsample.lttb(rows, REPORT_SERIES, max_points)
+    if endpoint == "report_data":
+        if fields is None and metrics is None:
+            return _encode(RepDataList, rows)
+        return _encode(_projected_list(fields, metrics), rows)
+    if endpoint == "report_data_advisor":
+        if metrics is None:
+            return _encode(AdvisorRepDataList, rows)
+        return _encode(_projected_list(None, metrics, serializers.AdvisorRepData), rows)
+    return _encode(MeltedAttemptDataList, _melt(rows))
+
+
+def _report_view(db, endpoint, channel, product, date_type, max_points=None, fields=None, metrics=None):
+    name = _dashboard_view(endpoint, max_points, fields, metrics)
+    if name is not None:
+        body = report_cache.get(db, name, channel, product, date_type)
+        if body is not None:
+            return body
+
+    key = (endpoint, channel, product, date_type, max_points, fields, metrics, report_cache.generation)
+    body = report_views.get(key)
+    if body is None:
+        body = report_flight.do(
+            key,
+            lambda: _report_view_json(
+                endpoint,
+                _report_rows(db, channel, product, date_type, _select_fields(fields, metrics)),
+                max_points,
+                fields,
+                metrics,
+            ),
+        )
+        report_views.set(key, body)
+    return body
+
+
+# The views the dashboards request, warmed along with the full reports:
+# {name: (endpoint, max_points, fields, metrics)}. Keep in step with the
+# dashboards' maxChartPoints, reportFields and reportMetrics.
+DASHBOARD_MAX_POINTS = 260
+DASHBOARD_VIEWS = {
+    # Graphs2.vue's charts
+    "report_data_chart2": (
+        "report_data",
+        DASHBOARD_MAX_POINTS,
+        _report_fields("date_value,sale_count,quote_count,sum_attempts,new_leads_given,new_leads_contacted,leads_no_recontact_needed"),
+        _report_metrics("leads_no_recontact_made,non_sales,contact_conversion_rate"),
+    ),
+    # Graphs.vue's full series, which it downsamples for its charts itself
+    "report_data_table": (
+        "report_data",
+        None,
+        _report_fields("date_value,sale_count,quote_count"),
+        _report_metrics("non_sales,conversion_rate"),
+    ),
+}
+
+
+def _dashboard_view(endpoint, max_points, fields, metrics):
+    """Name of the warmed dashboard view matching a request, if any."""
+    for name, view in DASHBOARD_VIEWS.items():
+        if view == (endpoint, max_points, fields, metrics):
+            return name
+    return None
+
+
+def _view_builder(endpoint, max_points, fields, metrics):
+    def build(db, channel, product, date_type):
+        rows = _report_rows(db, channel, product, date_type, _select_fields(fields, metrics))
+        return _report_view_json(endpoint, rows, max_points, fields, metrics)
+
+    return build
+
+
+# Warmed, per-generation bodies for every dashboard filter combination
+report_cache = ReportCache(
+    {
+        "report_data": _report_data_json,
+        "report_data_melted": _report_data_melted_json,
+        **{name: _view_builder(*view) for name, view in DASHBOARD_VIEWS.items()},
+    },
+    workers=REPORT_WARMUP_WORKERS,
+    # Warm from the snapshot only once it has been published, not as soon as
+    # the load commits
+    generation_source=snapshot_store.generation if snapshot_store is not None else None,
+)
+
+
+def _generation_headers(request, generation):
+    """
+    Headers stamping a report response with the repdata generation it was
+    built from. The ETag lets clients revalidate with If-None-Match and get
+    a 304 until the next refresh.
+    """
+    if generation is None:
+        return {}
+    digest = hashlib.sha1(request.url.query.encode()).hexdigest()[:12]
+    return {
+        "X-Repdata-Generation": str(generation),
+        "ETag": f'W/"g{generation}-{digest}"',
+        "Cache-Control": "private, no-cache",
+    }
+
+
+def _generation_response(request, build):
+    generation = report_cache.announced_generation(request.state.db.get_bind())
+    headers = _generation_headers(request, generation)
+    if headers and _not_modified(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=build(), media_type="application/json", headers=headers)
+
+
+@router.get("/report_data", response_model=List[serializers.RepData], dependencies=[Depends(_admit("report"))])
+def report_data(
+    request: Request,
+    channel: str,
+    product: str,
+    date_type: str,
+    max_points: Union[int, None] = Query(None, ge=3),
+    fields: Union[str, None] = None,
+    metrics: Union[str, None] = None,
+):
+    if "ADMIN" not in request.state.auth["roles"]:
+        raise HTTPException(status_code=403)
+
+    fields = _report_fields(fields)
+    metrics = _report_metrics(metrics)
+
+    def build():
+        if max_points is not None or fields is not None or metrics is not None:
+            # Only the requested columns, selected and serialised, plus
+            # derived metrics, over at most max_points dates picked by LTTB
+            return _report_view(request.state.db, "report_data", channel, product, date_type, max_points, fields, metrics)
+
+        body = report_cache.get(request.state.db, "report_data", channel, product, date_type)
+        if body is None:
+            body = report_flight.do(
+                ("report_data", channel, product, date_type),
+                lambda: _report_data_json(request.state.db, channel, product, date_type),
+            )
+        return body
+
+    return _generation_response(request, build)
+
+
+@router.get("/report_data_melted", response_model=List[serializers.MeltedAttemptData], dependencies=[Depends(_admit("report"))])
+def report_data_melted(
+    request: Request,
+    channel: str,
+    product: str,
+    date_type: str,
+    max_points: Union[int, None] = Query(None, ge=3),
+):
+    if "ADMIN" not in request.state.auth["roles"]:
+        raise HTTPException(status_code=403)
+
+    def build():
+        if max_points is not None:
+            # At most max_points dates, picked by LTTB so the series keep their shape
+            return _report_view(request.state.db, "report_data_melted", channel, product, date_type, max_points)
+
+        body = report_cache.get(request.state.db, "report_data_melted", channel, product, date_type)
+        if body is None:
+            body = report_flight.do(
+                ("report_data_melted", channel, product, date_type),
+                lambda: _report_data_melted_json(request.state.db, channel, product, date_type),
+            )
+        return body
+
+    return _generation_response(request, build)
+
+
+@router.get("/report_events")
+async def report_events(request: Request):
+    """
+    Server-Sent Events stream of the repdata generation. Sends the current
+    generation on connect and again whenever a refresh has been published
+    and its reports are cached, so dashboards refetch only then.
+    """
+    if "ADMIN" not in request.state.auth["roles"]:
+        raise HTTPException(status_code=403)
+
+    engine = request.state.db.get_bind()
+
+    async def stream():
+        yield b"retry: 5000\n\n"
+        sent = None
+        idle = 0.0
+        while not await request.is_disconnected():
+            # The generation read is throttled and shared by every stream
+            generation = await run_in_threadpool(report_cache.announced_generation, engine)
+            if generation != sent:
+                sent = generation
+                idle = 0.0
+                yield f"event: generation\ndata: {json.dumps({'generation': generation})}\n\n".encode()
+            elif idle >= REPORT_EVENTS_HEARTBEAT:
+                idle = 0.0
+                yield b": keep-alive\n\n"
+            await asyncio.sleep(report_cache.check_interval)
+            idle += report_cache.check_interval
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
 
-    if quote is None:
-        raise HTTPException(status_code=404)
 
-    return quote
+repdata_advisor = schema.repdata_advisor_table(MetaData())
+
+
+def _advisor_rows(db, user_id, channel, product, date_type):
+    if snapshot_store is not None:
+        rows = snapshot_store.report_rows(
+            channel, product, date_type, tuple(serializers.AdvisorRepData.model_fields), user_id=user_id
+        )
+        if rows is not None:
+            return [SimpleNamespace(**row) for row in rows]
+
+    # Served by ix_repdata_advisor_lookup
+    return db.execute(
+        select(repdata_advisor).where(
+            repdata_advisor.c.user_id == user_id,
+            repdata_advisor.c.quote_channel == channel,
+            repdata_advisor.c.product == product,
+            repdata_advisor.c.date_type == date_type,
+        )
+    ).all()
+
+
+@router.get("/report_data_advisor", response_model=List[serializers.AdvisorRepData], dependencies=[Depends(_admit("report"))])
+def report_data_advisor(
+    request: Request,
+    user_id: int,
+    channel: str,
+    product: str,
+    date_type: str,
+    max_points: Union[int, None] = Query(None, ge=3),
+    metrics: Union[str, None] = None,
+):
+    if "ADMIN" not in request.state.auth["roles"]:
+        raise HTTPException(status_code=403)
+
+    metrics = _report_metrics(metrics)
+
+    def build():
+        key = ("report_data_advisor", user_id, channel, product, date_type, max_points, metrics, report_cache.generation)
+        body = report_views.get(key)
+        if body is None:
+            body = report_flight.do(
+                key,
+                lambda: _report_view_json(
+                    "report_data_advisor",
+                    _advisor_rows(request.state.db, user_id, channel, product, date_type),
+                    max_points,
+                    None,
+                    metrics,
+                ),
+            )
+            report_views.set(key, body)
+        return body
+
+    return _generation_response(request, build)
+
+
+repdata_sketches = table(
+    "repdata",
+    column("date_type"),
+    column("date_value"),
+    column("product"),
+    column("quote_channel"),
+    column("quote_sketch"),
+)
+
+
+@router.get("/report_distinct_quotes", response_model=serializers.DistinctQuotes, dependencies=[Depends(_admit("report"))])
+def report_distinct_quotes(
+    request: Request,
+    channel: str,
+    product: str,
+    start: date,
+    end: date,
+    date_type: str = "week",
+):
+    """
+    Distinct quotes with outbound activity in [start, end], estimated by
+    merging the per-period HyperLogLog sketches the ETL stores in repdata.
+    Periods are included when their end date falls in the range.
+    """
+    if "ADMIN" not in request.state.auth["roles"]:
+        raise HTTPException(status_code=403)
+
+    sketches = request.state.db.execute(
+        select(repdata_sketches.c.quote_sketch).where(
+            repdata_sketches.c.quote_channel == channel,
+            repdata_sketches.c.product == product,
+            repdata_sketches.c.date_type == date_type,
+            # date_value is stored as a string; compare as datetimes
+            repdata_sketches.c.date_value >= datetime.combine(start, datetime.min.time()),
+            repdata_sketches.c.date_value <= datetime.combine(end, datetime.max.time()),
+        )
+    ).scalars().all()
+
+    return {
+        "channel": channel,
+        "product": product,
+        "date_type": date_type,
+        "start": start,
+        "end": end,
+        "periods": len(sketches),
+        "distinct_quotes": hll.merge_all(sketches).estimate() if sketches else 0,
+    }
+
+
+def _etag(*versions):
+    digest = hashlib.sha1(
+        "|".join(f"{quote_number}@" + ",".join(v.isoformat() if hasattr(v, "isoformat") else str(v or "") for v in version)
+                 for quote_number, version in versions).encode()
+    ).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def _outbound_versions(db, quote_numbers):
+    """
+    Per quote number, the count and latest lifecycle and schedule timestamps
+    of its outbounds, which change whenever an outbound is added, removed or
+    updated. Quotes without outbounds are left out.
+    """
+    Outbound = models.Outbound
+    versions = {}
+    # One IN query per chunk, well below SQL Server's 2100 parameter limit
+    for i in range(0, len(quote_numbers), 1000):
+        rows = db.execute(
+            select(
+                Outbound.quote_number,
+                func.count(),
+                func.max(Outbound.created_at_dtm),
+                func.max(Outbound.assigned_at_dtm),
+                func.max(Outbound.completed_at_dtm),
+                func.max(Outbound.unassigned_at_dtm),
+                func.max(Outbound.scheduled_outbound_dt),
+            )
+            .where(Outbound.quote_number.in_(quote_numbers[i:i + 1000]))
+            .group_by(Outbound.quote_number)
+        )
+        for quote_number, *version in rows:
+            versions[quote_number] = tuple(version)
+    return versions
+
+
+def _not_modified(request, etag):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return False
+    return if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]
+
+
+def _cache_quote(quote, outbound_version):
+    entry = ((quote.last_entry_date, *outbound_version), _encode(QuoteItem, quote))
+    quote_cache.set(quote.quote_number, entry)
+    return entry
+
+
+@router.get("/batch", response_model=List[serializers.Quote], dependencies=[Depends(_admit("interactive"))])
+def batch(request: Request, quote_numbers: List[str] = Query(...)):
+    quote_numbers = list(dict.fromkeys(quote_numbers))
+    if len(quote_numbers) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=422, detail=f"At most {MAX_BATCH_SIZE} quote numbers per request")
+
+    entries = {}
+    missing = []
+    for quote_number in quote_numbers:
+        entry = quote_cache.get(quote_number)
+        if entry is None:
+            missing.append(quote_number)
+        else:
+            entries[quote_number] = entry
+
+    if missing:
+        plan = loaders.loader_plan(models.Quote, serializers.Quote)
+        outbound_versions = _outbound_versions(request.state.db, missing)
+        # One IN query per chunk, well below SQL Server's 2100 parameter limit
+        for i in range(0, len(missing), 1000):
+            quotes = request.state.db.scalars(
+                select(models.Quote)
+                .options(*plan.options)
+                .where(models.Quote.quote_number.in_(missing[i:i + 1000]))
+            ).all()
+            for quote in quotes:
+                entries[quote.quote_number] = _cache_quote(quote, outbound_versions.get(quote.quote_number, ()))
+
+    found = [quote_number for quote_number in quote_numbers if quote_number in entries]
+    etag = _etag(*[(quote_number, entries[quote_number][0]) for quote_number in found])
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    return Response(
+        content=b"[" + b",".join(entries[quote_number][1] for quote_number in found) + b"]",
+        media_type="application/json",
+        headers={"ETag": etag},
+    )
+
+
+@router.get("/admission")
+def admission_stats(request: Request):
+    """Admission slots in use, and queue depth and wait times per request class."""
+    if "ADMIN" not in request.state.auth["roles"]:
+        raise HTTPException(status_code=403)
+
+    return admission.stats()
+
+
+def _show_quote(db, request, quote_number):
+    """
+    Respond with one quote: from quote_cache when cached, with an ETag over
+    the quote's and its outbounds' timestamps and a 304 when it matches
+    If-None-Match. Shared by both show endpoints; api_async runs it on its
+    AsyncSession through run_sync.
+    """
+    entry = quote_cache.get(quote_number)
+    outbound_version = None
+
+    if entry is None and request.headers.get("if-none-match"):
+        # Revalidate against last_entry_date and the outbounds' timestamps
+        # before loading the quote
+        last_entry_date = db.execute(
+            select(models.Quote.last_entry_date).where(models.Quote.quote_number == quote_number)
+        ).first()
+
+        if last_entry_date is None:
+            raise HTTPException(status_code=404)
+
+        outbound_version = _outbound_versions(db, [quote_number]).get(quote_number, ())
+        etag = _etag((quote_number, (last_entry_date[0], *outbound_version)))
+        if _not_modified(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+
+    if entry is None:
+        if outbound_version is None:
+            # Read before counting, so the quote's own budget is unchanged
+            outbound_version = _outbound_versions(db, [quote_number]).get(quote_number, ())
+        plan = loaders.loader_plan(models.Quote, serializers.Quote)
+        if QUERY_BUDGET_MODE:
+            loaders.count_statements(db, QUERY_BUDGETS["show"] + plan.extra_statements)
+
+        quote = db.scalar(
+            select(models.Quote)
+            .options(*plan.options)
+            .where(models.Quote.quote_number == quote_number)
+        )
+
+        if quote is None:
+            raise HTTPException(status_code=404)
+
+        entry = _cache_quote(quote, outbound_version)
+
+    version, body = entry
+    etag = _etag((quote_number, version))
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+
+@router.get("/{quote_number}", response_model=serializers.Quote, dependencies=[Depends(_admit("interactive"))])
+def show(quote_number, request: Request):
+    return _show_quote(request.state.db, request, quote_number)
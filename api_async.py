@@ -0,0 +1,236 @@
+"""
+asyncio variants of the read-only quotes endpoints.
+
+Set QUOTES_ASYNC_DATABASE_URL (e.g. mssql+aioodbc://...) to serve report_data,
+report_data_melted, show and export from SQLAlchemy's async engine instead of
+blocking sessions in the threadpool. Mount quotes_router() instead of
+api.router to pick the configured variant. Reports and exports still come
+from the snapshot store first when one is published (see api.snapshot_store).
+"""
+import os
+from datetime import date
+from typing import List, Union
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import TypeAdapter
+from starlette.background import BackgroundTask
+
+import api
+from admission import Rejected
+from singleflight import AsyncSingleFlight
+from src import serializers
+
+engine = None
+SessionLocalAsync = None
+
+router = APIRouter(prefix="/quotes")
+
+report_flight = AsyncSingleFlight()
+
+QuoteHistoryItem = TypeAdapter(serializers.QuoteHistory)
+
+
+def configure(url, **engine_kwargs):
+    """Create the async engine and session factory for these endpoints."""
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    global engine, SessionLocalAsync
+    engine = create_async_engine(url, **engine_kwargs)
+    SessionLocalAsync = async_sessionmaker(engine, expire_on_commit=False)
+    return engine
+
+
+if os.environ.get("QUOTES_ASYNC_DATABASE_URL"):
+    configure(
+        os.environ["QUOTES_ASYNC_DATABASE_URL"],
+        pool_size=int(os.environ.get("QUOTES_ASYNC_POOL_SIZE", "20")),
+    )
+
+
+def quotes_router():
+    """
+    The quotes router to mount: api.router, with its read endpoints replaced
+    by the async ones when an async database URL is configured. Route order
+    is preserved, so /{quote_number} still matches last.
+    """
+    if engine is None:
+        return api.router
+
+    combined = APIRouter()
+    replacements = {(route.path, frozenset(route.methods)): route for route in router.routes}
+    for route in api.router.routes:
+        combined.routes.append(replacements.get((route.path, frozenset(route.methods)), route))
+    return combined
+
+
+async def get_db():
+    async with SessionLocalAsync() as db:
+        yield db
+
+
+async def _report_rows(db, channel, product, date_type, fields=None):
+    rows = api._snapshot_report_rows(channel, product, date_type, fields)
+    if rows is not None:
+        return rows
+
+    report_stmt = api._report_stmt(channel, product, date_type, fields)
+    if fields is not None:
+        return (await db.execute(report_stmt)).all()
+
+    return (await db.scalars(report_stmt)).all()
+
+
+async def _report_data_json(db, channel, product, date_type):
+    return api._encode(api.RepDataList, await _report_rows(db, channel, product, date_type))
+
+
+async def _report_data_melted_json(db, channel, product, date_type):
+    return api._encode(api.MeltedAttemptDataList, api._melt(await _report_rows(db, channel, product, date_type)))
+
+
+def _view_builder(endpoint, max_points, fields, metrics):
+    async def build(db, channel, product, date_type):
+        rows = await _report_rows(db, channel, product, date_type, api._select_fields(fields, metrics))
+        return api._report_view_json(endpoint, rows, max_points, fields, metrics)
+
+    return build
+
+
+# Same keys as api.report_cache's builders, which it warms
+BUILDERS = {
+    "report_data": _report_data_json,
+    "report_data_melted": _report_data_melted_json,
+    **{name: _view_builder(*view) for name, view in api.DASHBOARD_VIEWS.items()},
+}
+
+
+async def _report(request, endpoint, channel, product, date_type, max_points=None, fields=None, metrics=None):
+    if "ADMIN" not in request.state.auth["roles"]:
+        raise HTTPException(status_code=403)
+
+    fields = api._report_fields(fields)
+    metrics = api._report_metrics(metrics)
+
+    # Also starts warming a newly published generation
+    cached = await api.report_cache.aget(engine, BUILDERS, endpoint, channel, product, date_type)
+    headers = api._generation_headers(request, api.report_cache.announce(await api.report_cache.alatest_generation(engine)))
+    if headers and api._not_modified(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    if max_points is not None or fields is not None or metrics is not None:
+        name = api._dashboard_view(endpoint, max_points, fields, metrics)
+        if name is not None:
+            body = api.report_cache.entries.get((name, channel, product, date_type))
+            if body is not None:
+                return Response(content=body, media_type="application/json", headers=headers)
+
+        key = (endpoint, channel, product, date_type, max_points, fields, metrics, api.report_cache.generation)
+        body = api.report_views.get(key)
+        if body is None:
+            # Other requests may join this flight after the leader's request
+            # finished, so the build opens its own session instead of
+            # borrowing the request's
+            async def build():
+                async with SessionLocalAsync() as build_db:
+                    rows = await _report_rows(build_db, channel, product, date_type, api._select_fields(fields, metrics))
+                return api._report_view_json(endpoint, rows, max_points, fields, metrics)
+
+            body = await report_flight.do(key, build)
+            api.report_views.set(key, body)
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    body = cached
+    if body is None:
+        async def build():
+            async with SessionLocalAsync() as build_db:
+                return await BUILDERS[endpoint](build_db, channel, product, date_type)
+
+        body = await report_flight.do((endpoint, channel, product, date_type), build)
+
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@router.get("/export", response_model=List[serializers.QuoteHistory])
+async def export_quotes(
+    request: Request,
+    start: Union[date, None] = None,
+    end: Union[date, None] = None,
+    latest_only: bool = False,
+):
+    if "ADMIN" not in request.state.auth["roles"]:
+        raise HTTPException(status_code=403)
+
+    response = api._snapshot_export(start, end, latest_only)
+    if response is not None:
+        return response
+
+    quotes_stmt = api._export_stmt(start, end, latest_only)
+
+    # Held until the stream ends rather than through a dependency, which
+    # would release it before the rows are read
+    try:
+        await api.admission.acquire("export")
+    except Rejected as exc:
+        raise HTTPException(status_code=503, detail=str(exc), headers={"Retry-After": str(int(exc.retry_after))})
+
+    released = False
+
+    def release():
+        # Called when the stream ends and again as the response's background
+        # task, which also runs when the client left before the body started
+        nonlocal released
+        if not released:
+            released = True
+            api.admission.release("export")
+
+    async def stream():
+        # Serialise row by row as the driver delivers them instead of
+        # materialising the whole range. The session lives inside the stream
+        # because dependencies are closed before the body is sent.
+        try:
+            yield b"["
+            first = True
+            async with SessionLocalAsync() as db:
+                result = await db.stream_scalars(quotes_stmt.execution_options(yield_per=1000))
+                async for quote in result:
+                    if not first:
+                        yield b","
+                    first = False
+                    yield QuoteHistoryItem.dump_json(QuoteHistoryItem.validate_python(quote, from_attributes=True))
+            yield b"]"
+        finally:
+            release()
+
+    return StreamingResponse(stream(), media_type="application/json", background=BackgroundTask(release))
+
+
+@router.get("/report_data", response_model=List[serializers.RepData], dependencies=[Depends(api._admit("report"))])
+async def report_data(
+    request: Request,
+    channel: str,
+    product: str,
+    date_type: str,
+    max_points: Union[int, None] = Query(None, ge=3),
+    fields: Union[str, None] = None,
+    metrics: Union[str, None] = None,
+):
+    return await _report(request, "report_data", channel, product, date_type, max_points, fields, metrics)
+
+
+@router.get("/report_data_melted", response_model=List[serializers.MeltedAttemptData], dependencies=[Depends(api._admit("report"))])
+async def report_data_melted(
+    request: Request,
+    channel: str,
+    product: str,
+    date_type: str,
+    max_points: Union[int, None] = Query(None, ge=3),
+):
+    return await _report(request, "report_data_melted", channel, product, date_type, max_points)
+
+
+@router.get("/{quote_number}", response_model=serializers.Quote, dependencies=[Depends(api._admit("interactive"))])
+async def show(quote_number, request: Request, db=Depends(get_db)):
+    # The same cache, ETag and 304 handling as the threadpool endpoint, on
+    # this session's connection
+    return await db.run_sync(api._show_quote, request, quote_number)
@@ -0,0 +1,219 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import MetaData, create_engine, inspect
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+import agg3a
+from etl_metrics import EtlRun, etl_runs_table
+from snapshots import store_from_env
+
+
+def partitions(start, end):
+    """
+    Split [start, end] into independently rebuildable repdata partitions.
+
+    Cells cover whole periods, so the range is widened to whole months. Each
+    month partition rebuilds that month's cell and the weeks starting in it
+    (plus, for the first month, the week straddling its start). Year cells
+    span twelve months, so each year is a partition of its own.
+
+    Returns:
+        list: (key, {date_type: [(start, end), ...]}) tuples, years first
+    """
+    start = datetime(start.year, start.month, 1)
+    last_month = agg3a.period_bounds("month", datetime(end.year, end.month, 1))
+    end = last_month[1]
+
+    result = []
+    for year in range(start.year, (end - timedelta(days=1)).year + 1):
+        year_start = datetime(year, 1, 1)
+        result.append((f"year-{year}", {"year": [agg3a.period_bounds("year", year_start)]}))
+
+    month_start = start
+    while month_start < end:
+        month = agg3a.period_bounds("month", month_start)
+        week_start = agg3a.period_bounds("week", month_start)[0]
+        if week_start < month_start and month_start != start:
+            # Belongs to the previous month's partition
+            week_start += timedelta(days=7)
+        weeks = []
+        while week_start < month[1]:
+            weeks.append((week_start, week_start + timedelta(days=7)))
+            week_start += timedelta(days=7)
+        result.append((f"month-{month_start:%Y-%m}", {"month": [month], "week": weeks}))
+        month_start = month[1]
+    return result
+
+
+class Checkpoint:
+    """
+    Completed partitions of one backfill, persisted as JSON after every
+    partition so an interrupted backfill resumes where it stopped.
+    """
+
+    def __init__(self, path, start, end):
+        self.path = path
+        self.start = start.isoformat()
+        self.end = end.isoformat()
+        self.done = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            if (data["start"], data["end"]) != (self.start, self.end):
+                raise ValueError(f"{path} belongs to a backfill of {data['start']}..{data['end']}")
+            self.done = data["done"]
+
+    def complete(self, key, stats):
+        self.done[key] = stats
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"start": self.start, "end": self.end, "done": self.done}, f, indent=2, default=str)
+        os.replace(tmp_path, self.path)
+
+
+_engine = None
+
+
+def _worker_engine(url):
+    # One engine per worker process, reused across its partitions
+    global _engine
+    if _engine is None:
+        _engine = create_engine(url, pool_size=1, max_overflow=0)
+    return _engine
+
+
+def rebuild_partition(url, key, periods, retries=2):
+    """
+    Rebuild one partition in its own transaction. Runs in a worker process.
+
+    Returns:
+        dict: The partition's EtlRun metrics
+    """
+    from src.database import models
+
+    engine = _worker_engine(url)
+    metadata = MetaData()
+    for attempt in range(retries + 1):
+        run = EtlRun(f"repdata_backfill {key}")
+        with Session(engine) as db:
+            try:
+                # Bump the generation and publish once when the whole
+                # backfill is done, not per partition
+                rows = agg3a.refresh_repdata_periods(
+                    db, engine, metadata, models.Quote, models.Outbound, periods, run=run, snapshots=False,
+                    sync_state=False, bump=False
+                )
+            except DBAPIError as exc:
+                # Parallel partitions can deadlock on repdata's pages; retry
+                run.finish(exc)
+                run.record_failure(db, engine, metadata)
+                if attempt == retries:
+                    raise
+                time.sleep(2 ** attempt)
+                continue
+            run.finish()
+            run.record(db, engine, metadata)
+        stats = run.as_dict()
+        stats["repdata_rows"] = rows
+        return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild repdata for a date range in parallel month partitions")
+    parser.add_argument("--url", default=os.environ.get("DATABASE_URL"), required="DATABASE_URL" not in os.environ,
+                        help="SQLAlchemy URL of the target database")
+    parser.add_argument("--start", type=date.fromisoformat, required=True)
+    parser.add_argument("--end", type=date.fromisoformat, required=True)
+    parser.add_argument("--workers", type=int, default=4, help="Partitions rebuilt in parallel")
+    parser.add_argument("--checkpoint", help="Checkpoint file, defaults to backfill-<start>-<end>.json")
+    parser.add_argument("--only", help="Comma separated partition keys to rebuild, e.g. month-2024-03")
+    parser.add_argument("--rebuild-state", action="store_true",
+                        help="Recompute every quote_state row instead of syncing the changed quotes")
+    args = parser.parse_args(argv)
+
+    if args.end < args.start:
+        parser.error("--end must not be before --start")
+
+    checkpoint = Checkpoint(args.checkpoint or f"backfill-{args.start}-{args.end}.json", args.start, args.end)
+    todo = [
+        (key, periods) for key, periods in partitions(args.start, args.end)
+        if key not in checkpoint.done and (not args.only or key in args.only.split(","))
+    ]
+    print(f"{len(checkpoint.done)} partition(s) already done, {len(todo)} to rebuild with {args.workers} workers")
+
+    engine = create_engine(args.url)
+    metadata = MetaData()
+    # Create the tables once up front rather than racing in the workers;
+    # etl_runs too, since every worker records its partitions' runs
+    for table in (
+        agg3a.repdata_table(metadata),
+        agg3a.repdata_advisor_table(metadata),
+        agg3a.repdata_generation_table(metadata),
+        etl_runs_table(metadata),
+    ):
+        if not inspect(engine).has_table(table.name):
+            table.create(bind=engine)
+
+    # Sync quote_state once, before the workers read it in parallel; a
+    # backfill after a rule change passes --rebuild-state to re-derive every
+    # quote's state
+    from src.database import models
+
+    with Session(engine) as db:
+        written = agg3a.sync_quote_state(db, engine, metadata, models.Quote, models.Outbound, full=args.rebuild_state)
+        print(f"{'Rebuilt' if args.rebuild_state else 'Synced'} quote_state for {written} quotes")
+
+    started = time.perf_counter()
+    failed = []
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        pending = {pool.submit(rebuild_partition, args.url, key, periods): key for key, periods in todo}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = pending.pop(future)
+                try:
+                    stats = future.result()
+                except Exception as exc:
+                    failed.append(key)
+                    print(f"{key:18} FAILED {exc!r}")
+                    continue
+                checkpoint.complete(key, stats)
+                seconds = stats["wall_seconds"] or 1e-9
+                print(
+                    f"{key:18} {stats['repdata_rows']:8} repdata rows  {stats['rows_processed']:8} rows aggregated  "
+                    f"{seconds:8.1f}s  {stats['rows_processed'] / seconds:10.0f} rows/s  "
+                    f"{stats['bytes_received'] / seconds / 1e6:6.2f} MB/s"
+                )
+
+    elapsed = time.perf_counter() - started
+    total = sum(checkpoint.done[key]["rows_processed"] for key, _ in todo if key in checkpoint.done)
+    print(f"Rebuilt {len(todo) - len(failed)}/{len(todo)} partition(s) in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.0f} aggregated rows/s)")
+
+    # One new generation for all rebuilt partitions, so report caches rewarm
+    # once rather than after every partition
+    if len(todo) > len(failed):
+        with Session(engine) as db:
+            generation = agg3a.bump_generation(db, metadata)
+            db.commit()
+        print(f"Bumped repdata generation to {generation}")
+
+    if failed:
+        print(f"Rerun the same command to retry: {', '.join(failed)}")
+        return 1
+
+    snapshots = store_from_env()
+    if snapshots is not None:
+        with Session(engine) as db:
+            version = agg3a.publish_repdata_snapshots(snapshots, db, metadata)
+        print(f"Published repdata snapshot {version}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
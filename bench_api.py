@@ -0,0 +1,322 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import statistics
+import time
+from types import SimpleNamespace
+from urllib.parse import urlencode
+
+from sqlalchemy import MetaData, create_engine, delete, insert
+from sqlalchemy.orm import Session
+
+import agg3a
+import loaders
+import synth
+
+
+# Query parameters understood by QuoteValidator.index_query. Each entry is one
+# value of one filter; the matrix combines up to --max-filters of them.
+FILTERS = {
+    "self_assigned": {"self_assigned": "true"},
+    "assigned_to": {"assigned_to": "Advisor1"},
+    "expiring_in": {"expiring_in": "7"},
+    "latest_result": {"latest_result": "Call back scheduled"},
+    "latest_result_blank": {"latest_result": "<Blank>"},
+    "ilike_scalar": {"business_name": "Business 1"},
+    "ilike_list": {"product": ["Auto", "Liability"]},
+}
+
+SORTS = [None, "pending", "expiring_in", "latest_result", "quote_number"]
+DIRECTIONS = ["asc", "desc"]
+
+
+def build_matrix(max_filters=1):
+    """
+    Enumerate every filter/sort combination of the quotes index.
+
+    Returns:
+        list: (name, query params) tuples
+    """
+    filter_sets = [()]
+    for size in range(1, max_filters + 1):
+        for combo in itertools.combinations(FILTERS, size):
+            # Two values for the same query parameter can't be combined
+            keys = [k for name in combo for k in FILTERS[name]]
+            if len(keys) == len(set(keys)):
+                filter_sets.append(combo)
+
+    matrix = []
+    for combo in filter_sets:
+        params = {}
+        for name in combo:
+            params.update(FILTERS[name])
+        for sort in SORTS:
+            for direction in DIRECTIONS if sort else [None]:
+                query = dict(params)
+                if sort:
+                    query["sort_value"] = sort
+                    query["sort_direction"] = direction
+                name = "+".join(combo) or "none"
+                name += f" sort={sort}:{direction}" if sort else ""
+                matrix.append((name, query))
+    return matrix
+
+
+def build_app(engine, roles, user_id, router=None):
+    """
+    Mount the quotes router on a bare app whose middleware provides what the
+    production middleware would: a database session and an auth context.
+    """
+    from fastapi import FastAPI
+    from fastapi.responses import PlainTextResponse
+
+    import api
+
+    app = FastAPI()
+    router = router or api.router
+
+    @app.middleware("http")
+    async def state(request, call_next):
+        with Session(engine) as db:
+            request.state.db = db
+            request.state.auth = {"user": SimpleNamespace(id=user_id), "roles": roles}
+            response = await call_next(request)
+            # With QUOTES_QUERY_BUDGET_MODE set, fail requests whose page cost
+            # more statements than its eager-loading plan allows
+            try:
+                loaders.assert_budget(db)
+            except AssertionError as exc:
+                return PlainTextResponse(str(exc), status_code=599)
+            return response
+
+    app.include_router(router)
+    return app
+
+
+def percentile(latencies, p):
+    if len(latencies) < 2:
+        return latencies[0] if latencies else 0.0
+    return statistics.quantiles(latencies, n=100, method="inclusive")[p - 1]
+
+
+async def drive(client, path, query, requests, concurrency):
+    """
+    Issue `requests` calls to one combination with `concurrency` callers.
+    `path` may be a callable taking the request index, to vary the URL.
+
+    Returns:
+        dict: Throughput, latency percentiles (ms) and count of non-2xx
+            responses
+    """
+    latencies = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in remaining:
+            started = time.perf_counter()
+            response = await client.get(path(i) if callable(path) else path, params=query)
+            latencies.append((time.perf_counter() - started) * 1000)
+            # Redirects and 304s aren't what the matrix measures either
+            if not 200 <= response.status_code < 300:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests": requests,
+        "errors": errors,
+        "rps": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+    }
+
+
+def regressions(results, baseline, tolerance):
+    """
+    Compare results against a saved baseline.
+
+    Returns:
+        list: Descriptions of combinations that got slower than allowed
+    """
+    failures = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if result["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            failures.append(f"{name}: p95 {result['p95_ms']}ms > baseline {previous['p95_ms']}ms")
+        if result["rps"] < previous["rps"] * (1 - tolerance):
+            failures.append(f"{name}: {result['rps']} rps < baseline {previous['rps']} rps")
+    return failures
+
+
+def error_failures(results):
+    """
+    Combinations that got any non-2xx response. A failing request is usually
+    fast, so errors fail the run regardless of the baseline.
+
+    Returns:
+        list: Descriptions of the failing combinations
+    """
+    return [
+        f"{name}: {result['errors']}/{result['requests']} non-2xx responses"
+        for name, result in results.items()
+        if result["errors"]
+    ]
+
+
+def seed(engine, models, spec):
+    with Session(engine) as session:
+        session.execute(delete(models.Outbound))
+        session.execute(delete(models.Quote))
+        if session.query(models.User).count() < spec.advisors:
+            session.execute(delete(models.User))
+            session.execute(insert(models.User), synth.project(models.User, synth.iter_users(spec)))
+        session.commit()
+        counts = synth.load(session, models.Quote, models.Outbound, spec)
+        # The report endpoints read repdata, which seeding doesn't touch
+        agg3a.build_repdata_table(session, session, engine, MetaData(), models.Quote, models.Outbound, rebuild_state=True)
+        return counts
+
+
+async def run(app, matrix, args):
+    import httpx
+
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for name, query in matrix:
+            results[name] = await drive(client, args.path, query, args.requests, args.concurrency)
+            print(f"{name:70} {results[name]}")
+    return results
+
+
+def build_read_matrix(quote_count):
+    """
+    Read endpoints served by both the threadpool and the asyncio variants.
+    Reports rotate through every dashboard filter combination request by
+    request.
+    """
+    from reportcache import CHANNELS, DATE_TYPES, PRODUCTS
+
+    combos = list(itertools.product(CHANNELS, PRODUCTS, DATE_TYPES))
+
+    def rotate(path):
+        # Consecutive requests ask for different combinations, so concurrent
+        # callers rarely coalesce into one single-flight build
+        def url(i):
+            channel, product, date_type = combos[(i * 7) % len(combos)]
+            return f"{path}?{urlencode({'channel': channel, 'product': product, 'date_type': date_type})}"
+
+        return url
+
+    return [
+        ("show", lambda i: f"/quotes/Q{(i * 7919) % quote_count:09d}", {}),
+        ("report_data", rotate("/quotes/report_data"), None),
+        ("report_data_melted", rotate("/quotes/report_data_melted"), None),
+    ]
+
+
+async def compare_read_paths(apps, quote_count, args):
+    """
+    Drive the read endpoints through each app and report throughput side by
+    side, e.g. {"threadpool": sync_app, "asyncio": async_app}.
+    """
+    import httpx
+
+    import api
+
+    # Measure the database read path: no warmed reports (without a
+    # generation nothing is warmed) and no cached report views or quotes
+    api.report_cache.generation_source = lambda: None
+    api.report_views.ttl = 0
+    api.quote_cache.ttl = 0
+
+    results = {}
+    for mode, app in apps.items():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for name, path, query in build_read_matrix(quote_count):
+                results.setdefault(name, {})[mode] = await drive(client, path, query, args.requests, args.concurrency)
+
+    for name, by_mode in results.items():
+        print(f"{name:70} " + "  ".join(f"{mode}: {r['rps']} rps p95 {r['p95_ms']}ms" for mode, r in by_mode.items()))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the /quotes index filter and sort matrix")
+    parser.add_argument("--url", default=os.environ.get("BENCH_DATABASE_URL"), required="BENCH_DATABASE_URL" not in os.environ,
+                        help="SQLAlchemy URL of a local, disposable database")
+    parser.add_argument("--quotes", type=int, default=50_000, help="Number of quotes to seed")
+    parser.add_argument("--skip-seed", action="store_true", help="Reuse the data already in the database")
+    parser.add_argument("--path", default="/quotes")
+    parser.add_argument("--max-filters", type=int, default=1, help="Largest number of filters combined in one request")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per combination")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--roles", default="ADMIN")
+    parser.add_argument("--user-id", type=int, default=1)
+    parser.add_argument("--baseline", default="bench_api_baseline.json")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression")
+    parser.add_argument("--compare-async", metavar="ASYNC_URL",
+                        help="Compare threadpool and asyncio read endpoints using this async driver URL")
+    args = parser.parse_args(argv)
+
+    from src.database import models
+
+    engine = create_engine(args.url, pool_size=args.concurrency, max_overflow=0)
+    if not args.skip_seed:
+        quotes, outbounds = seed(engine, models, synth.SynthSpec(quote_count=args.quotes))
+        print(f"Seeded {quotes} quotes / {outbounds} outbounds")
+
+    if args.compare_async:
+        import api_async
+
+        api_async.configure(args.compare_async, pool_size=args.concurrency, max_overflow=0)
+        apps = {
+            "threadpool": build_app(engine, args.roles.split(","), args.user_id),
+            "asyncio": build_app(engine, args.roles.split(","), args.user_id, api_async.quotes_router()),
+        }
+        compared = asyncio.run(compare_read_paths(apps, args.quotes, args))
+        failed = error_failures({
+            f"{name} [{mode}]": result for name, by_mode in compared.items() for mode, result in by_mode.items()
+        })
+        for failure in failed:
+            print(f"ERROR {failure}")
+        return 1 if failed else 0
+
+    app = build_app(engine, args.roles.split(","), args.user_id)
+    results = asyncio.run(run(app, build_matrix(args.max_filters), args))
+
+    failed = error_failures(results)
+    for failure in failed:
+        print(f"ERROR {failure}")
+    if failed:
+        return 1
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            failures = regressions(results, json.load(f), args.tolerance)
+        for failure in failures:
+            print(f"REGRESSION {failure}")
+        return 1 if failures else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,209 @@
+import argparse
+import hashlib
+import importlib
+import json
+import os
+import resource
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+
+from sqlalchemy import MetaData, create_engine, delete, event
+from sqlalchemy.orm import Session
+
+import synth
+
+
+SCALES = {"100k": 100_000, "1M": 1_000_000, "10M": 10_000_000}
+
+# Map the leading keyword of each statement issued by the builder onto a stage
+STAGES = {
+    "CREATE": "prepare",
+    "DELETE": "prepare",
+    "SELECT": "aggregate",
+    "WITH": "aggregate",
+    "INSERT": "load",
+}
+
+
+@contextmanager
+def stage_timer(engine, timings):
+    """
+    Accumulate time spent in each ETL stage by watching the statements the
+    builder sends to the database.
+
+    Args:
+        engine: SQLAlchemy engine the builder runs against
+        timings: Dictionary updated in place with seconds per stage
+    """
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("bench_start", []).append(time.perf_counter())
+
+    def after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["bench_start"].pop()
+        keyword = statement.lstrip().split(None, 1)[0].upper()
+        timings[STAGES.get(keyword, "other")] += time.perf_counter() - started
+
+    event.listen(engine, "before_cursor_execute", before)
+    event.listen(engine, "after_cursor_execute", after)
+    try:
+        yield timings
+    finally:
+        event.remove(engine, "before_cursor_execute", before)
+        event.remove(engine, "after_cursor_execute", after)
+
+
+def snapshot(session, metadata):
+    """
+    Read the built repdata table into a canonical, order independent form.
+
+    Returns:
+        dict: "{date_type}|{date_value}|{product}|{quote_channel}" -> measures
+    """
+    repdata = metadata.tables["repdata"]
+    measures = [c.name for c in repdata.c if c.name not in ("id", "date_type", "date_value", "product", "quote_channel")]
+    cells = {}
+    for row in session.execute(repdata.select()).mappings():
+        key = f"{row['date_type']}|{row['date_value']}|{row['product']}|{row['quote_channel']}"
+        cells[key] = {m: row[m] for m in measures}
+    return cells
+
+
+def digest(cells):
+    return hashlib.sha256(json.dumps(cells, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def compare(cells, reference, limit=10):
+    """
+    Compare a repdata snapshot against a reference snapshot.
+
+    Returns:
+        list: Human readable differences, at most `limit` entries
+    """
+    differences = []
+    for key in sorted(set(cells) | set(reference)):
+        if key not in cells:
+            differences.append(f"missing cell {key}")
+        elif key not in reference:
+            differences.append(f"unexpected cell {key}")
+        else:
+            for measure, expected in reference[key].items():
+                if cells[key].get(measure) != expected:
+                    differences.append(f"{key} {measure}: {cells[key].get(measure)} != {expected}")
+        if len(differences) >= limit:
+            break
+    return differences
+
+
+def run_scale(engine, models, builder, label, rows, args):
+    """
+    Seed the database at one scale, run the builder and measure it.
+
+    Returns:
+        dict: Benchmark result for this scale
+    """
+    spec = synth.SynthSpec.for_outbound_rows(
+        rows,
+        outbounds_per_quote=args.outbounds_per_quote,
+        bound_ratio=args.bound_ratio,
+        years=args.years,
+        seed=args.seed,
+    )
+
+    with Session(engine) as session:
+        if not args.skip_seed:
+            print(f"[{label}] Seeding {spec.quote_count} quotes...")
+            session.execute(delete(models.Outbound))
+            session.execute(delete(models.Quote))
+            session.commit()
+            seeded = time.perf_counter()
+            quotes, outbounds = synth.load(session, models.Quote, models.Outbound, spec)
+            print(f"[{label}] Seeded {quotes} quotes / {outbounds} outbounds in {time.perf_counter() - seeded:.1f}s")
+
+    metadata = MetaData()
+    timings = defaultdict(float)
+    with Session(engine) as db, Session(engine) as etl, stage_timer(engine, timings):
+        tracemalloc.start()
+        started = time.perf_counter()
+        inserted = builder(db, etl, engine, metadata, models.Quote, models.Outbound)
+        wall = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    with Session(engine) as session:
+        cells = snapshot(session, metadata)
+
+    result = {
+        "scale": label,
+        "outbound_rows": rows,
+        "repdata_rows": inserted,
+        "wall_seconds": round(wall, 3),
+        "stage_seconds": {stage: round(seconds, 3) for stage, seconds in timings.items()},
+        "peak_python_bytes": peak,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "digest": digest(cells),
+    }
+
+    reference_path = os.path.join(args.reference_dir, f"repdata_{label}_seed{args.seed}.json")
+    if args.save_reference:
+        os.makedirs(args.reference_dir, exist_ok=True)
+        with open(reference_path, "w") as f:
+            json.dump(cells, f, sort_keys=True, default=str)
+        result["reference"] = "saved"
+    elif os.path.exists(reference_path):
+        with open(reference_path) as f:
+            reference = json.load(f)
+        # Round-trip through JSON so both sides use the same value types
+        differences = compare(json.loads(json.dumps(cells, default=str)), reference)
+        result["reference"] = "match" if not differences else "MISMATCH"
+        result["differences"] = differences
+    else:
+        result["reference"] = "none"
+
+    return result
+
+
+def load_builder(path):
+    module_name, _, func_name = path.partition(":")
+    return getattr(importlib.import_module(module_name), func_name or "build_repdata_table")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark build_repdata_table on synthetic data")
+    parser.add_argument("--url", default=os.environ.get("BENCH_DATABASE_URL"), required="BENCH_DATABASE_URL" not in os.environ,
+                        help="SQLAlchemy URL of a local, disposable database")
+    parser.add_argument("--scales", default="100k,1M,10M", help="Comma separated subset of " + ",".join(SCALES))
+    parser.add_argument("--builder", default="agg3a:build_repdata_table", help="module:function to benchmark")
+    parser.add_argument("--outbounds-per-quote", type=float, default=3.0)
+    parser.add_argument("--bound-ratio", type=float, default=0.2)
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip-seed", action="store_true", help="Reuse the data already in the database")
+    parser.add_argument("--reference-dir", default="bench_reference")
+    parser.add_argument("--save-reference", action="store_true", help="Store this run's output as the reference")
+    parser.add_argument("--output", default="bench_output.txt")
+    args = parser.parse_args(argv)
+
+    from src.database import models
+
+    engine = create_engine(args.url)
+    models.Quote.__table__.create(bind=engine, checkfirst=True)
+    models.Outbound.__table__.create(bind=engine, checkfirst=True)
+    builder = load_builder(args.builder)
+
+    results = []
+    for label in args.scales.split(","):
+        result = run_scale(engine, models, builder, label, SCALES[label], args)
+        print(json.dumps(result, indent=2))
+        results.append(result)
+
+    with open(args.output, "a") as f:
+        for result in results:
+            f.write(json.dumps({"builder": args.builder, **result}) + "\n")
+
+    return 1 if any(r["reference"] == "MISMATCH" for r in results) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
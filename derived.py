@@ -0,0 +1,171 @@
+import re
+
+
+# Ratios are percentages rounded like the dashboards display them
+def _percent(numerators, denominators):
+    return [
+        round(n / d * 100, 2) if n is not None and d else 0.0
+        for n, d in zip(numerators, denominators)
+    ]
+
+
+def _zero(values):
+    return [v if v is not None else 0 for v in values]
+
+
+# name: (input columns, callable(*columns) -> values)
+METRICS = {
+    "conversion_rate": (
+        ("sale_count", "quote_count"),
+        _percent,
+    ),
+    "contact_conversion_rate": (
+        ("sale_count", "new_leads_contacted"),
+        _percent,
+    ),
+    "contact_rate": (
+        ("new_leads_contacted", "new_leads_given"),
+        _percent,
+    ),
+    "non_sales": (
+        ("quote_count", "sale_count"),
+        lambda quotes, sales: [max(q - s, 0) for q, s in zip(_zero(quotes), _zero(sales))],
+    ),
+    "leads_no_recontact_made": (
+        ("new_leads_given", "new_leads_contacted", "leads_no_recontact_needed"),
+        lambda given, contacted, not_needed: [
+            g - (c + n) for g, c, n in zip(_zero(given), _zero(contacted), _zero(not_needed))
+        ],
+    ),
+}
+
+# <series>_delta, <series>_pct_change and <series>_ma<N>, where <series> is a
+# report column or one of METRICS
+_TRANSFORM = re.compile(r"^(?P<series>.+?)_(?:(?P<kind>delta|pct_change)|ma(?P<window>[1-9][0-9]?))$")
+
+
+def _delta(values):
+    return [None] + [
+        b - a if a is not None and b is not None else None
+        for a, b in zip(values, values[1:])
+    ]
+
+
+def _pct_change(values):
+    return [None] + [
+        round((b - a) / a * 100, 2) if a and b is not None else None
+        for a, b in zip(values, values[1:])
+    ]
+
+
+def _moving_average(values, window):
+    values = _zero(values)
+    averages = []
+    total = 0
+    for i, value in enumerate(values):
+        total += value
+        if i >= window:
+            total -= values[i - window]
+        averages.append(round(total / window, 2) if i >= window - 1 else None)
+    return averages
+
+
+def parse(names, columns):
+    """
+    Validate requested metric names.
+
+    Args:
+        names: Metric names, e.g. ("conversion_rate", "quote_count_ma4")
+        columns: Report columns transforms may be applied to
+
+    Returns:
+        tuple: The names, deduplicated, in request order
+
+    Raises:
+        ValueError: For names that aren't a metric or a transform of one
+    """
+    unknown = [name for name in names if not _known(name, columns)]
+    if unknown:
+        raise ValueError(f"Unknown metrics: {', '.join(unknown)}")
+    return tuple(dict.fromkeys(names))
+
+
+def _known(name, columns):
+    if name in METRICS:
+        return True
+    match = _TRANSFORM.match(name)
+    return match is not None and (match["series"] in METRICS or match["series"] in columns)
+
+
+def required_columns(names):
+    """Report columns needed to compute `names`."""
+    required = set()
+    for name in names:
+        match = _TRANSFORM.match(name) if name not in METRICS else None
+        series = match["series"] if match is not None else name
+        if series in METRICS:
+            required.update(METRICS[series][0])
+        else:
+            required.add(series)
+    return required
+
+
+class DerivedRow:
+    """A report row with derived metric values as extra attributes."""
+
+    __slots__ = ("_row", "_values")
+
+    def __init__(self, row, values):
+        self._row = row
+        self._values = values
+
+    def __getattr__(self, name):
+        if name in self._values:
+            return self._values[name]
+        return getattr(self._row, name)
+
+
+def attach(rows, names):
+    """
+    Compute metrics over rows ordered by date, one column at a time, and
+    return the rows with the metric values attached. Deltas, percentage
+    changes and moving averages are relative to the preceding rows of the
+    series.
+
+    Args:
+        rows: Report rows ordered by date_value
+        names: Names accepted by parse()
+
+    Returns:
+        list: DerivedRow per input row
+    """
+    rows = list(rows)
+    columns = {}
+
+    def column(series):
+        if series not in columns:
+            if series in METRICS:
+                inputs, compute = METRICS[series]
+                columns[series] = compute(*[column(name) for name in inputs])
+            else:
+                columns[series] = [getattr(row, series, None) for row in rows]
+        return columns[series]
+
+    values = {}
+    for name in names:
+        if name in METRICS:
+            values[name] = column(name)
+            continue
+        match = _TRANSFORM.match(name)
+        series = column(match["series"])
+        if match["kind"] == "delta":
+            values[name] = _delta(series)
+        elif match["kind"] == "pct_change":
+            values[name] = _pct_change(series)
+        else:
+            values[name] = _moving_average(series, int(match["window"]))
+
+    return [
+        DerivedRow(row, {name: values[name][i] for name in names})
+        for i, row in enumerate(rows)
+    ]
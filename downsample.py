@@ -0,0 +1,70 @@
+def _value(row, column):
+    value = getattr(row, column, None)
+    return float(value) if value is not None else 0.0
+
+
+def lttb(rows, columns, max_points):
+    """
+    Largest-Triangle-Three-Buckets downsampling of an ordered series.
+
+    Keeps the first and last rows and, for each of `max_points - 2` equal
+    buckets in between, the row forming the largest triangle with the row
+    kept from the previous bucket and the average of the next bucket. The
+    triangle area is summed over `columns`, each scaled by its range, so one
+    row is picked per bucket for all series together and peaks in any of
+    them survive. Whole rows are returned, so values derived from several
+    columns of a point stay consistent.
+
+    Args:
+        rows: Rows ordered by date, with the columns as attributes
+        columns: Names of the numeric columns the chart plots
+        max_points: Maximum number of rows to return, at least 3
+
+    Returns:
+        list: The selected rows, in order
+    """
+    rows = list(rows)
+    if max_points < 3:
+        raise ValueError("max_points must be at least 3")
+    if len(rows) <= max_points:
+        return rows
+
+    series = []
+    for column in columns:
+        values = [_value(row, column) for row in rows]
+        spread = max(values) - min(values)
+        if spread:
+            series.append([v / spread for v in values])
+    if not series:
+        # Every series is flat: any evenly spaced subset preserves the shape
+        step = (len(rows) - 1) / (max_points - 1)
+        return [rows[round(i * step)] for i in range(max_points)]
+
+    selected = [0]
+    bucket_size = (len(rows) - 2) / (max_points - 2)
+    a = 0
+    for bucket in range(max_points - 2):
+        start = int(bucket * bucket_size) + 1
+        end = int((bucket + 1) * bucket_size) + 1
+
+        # Average point of the next bucket (the last row for the final one)
+        next_start = end
+        next_end = min(int((bucket + 2) * bucket_size) + 1, len(rows))
+        if bucket == max_points - 3:
+            next_start, next_end = len(rows) - 1, len(rows)
+        next_x = (next_start + next_end - 1) / 2
+        next_ys = [sum(values[next_start:next_end]) / (next_end - next_start) for values in series]
+
+        best, best_area = start, -1.0
+        for i in range(start, end):
+            area = sum(
+                abs((a - next_x) * (values[i] - values[a]) - (a - i) * (next_y - values[a]))
+                for values, next_y in zip(series, next_ys)
+            )
+            if area > best_area:
+                best, best_area = i, area
+        selected.append(best)
+        a = best
+
+    selected.append(len(rows) - 1)
+    return [rows[i] for i in selected]
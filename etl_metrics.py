@@ -0,0 +1,282 @@
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+
+from sqlalchemy import BigInteger, Column, DateTime, Float, Integer, String, Table, event, inspect, text
+
+
+def _size(value):
+    # Rough wire size of a single value; good enough to spot trends
+    if value is None:
+        return 0
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode())
+    return 8
+
+
+# The run watch() is collecting for in the current thread or task, so runs
+# watching the same engine in parallel only count their own statements
+_active_run = ContextVar("etl_active_run", default=None)
+
+
+def _peak_rss():
+    # Peak resident size of the process so far; 0 where getrusage is missing
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def estimate_bytes(rows):
+    """Estimate the number of bytes in an iterable of row mappings."""
+    return sum(_size(v) for row in rows for v in row.values())
+
+
+def etl_runs_table(metadata):
+    """
+    Define the etl_runs history table.
+
+    Args:
+        metadata: SQLAlchemy MetaData object for table definitions
+    """
+    return Table(
+        "etl_runs",
+        metadata,
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        Column("run_name", String(100)),
+        Column("status", String(20)),
+        Column("started_at", DateTime),
+        Column("finished_at", DateTime),
+        Column("wall_seconds", Float),
+        Column("rows_processed", BigInteger),
+        Column("peak_memory_bytes", BigInteger),
+        Column("db_round_trips", Integer),
+        Column("bytes_sent", BigInteger),
+        Column("bytes_received", BigInteger),
+        Column("stage_seconds", String),
+        Column("error", String),
+        extend_existing=True
+    )
+
+
+def _widen_counters(engine, etl_runs):
+    # etl_runs tables created with INT counters overflow above 2 GiB on SQL
+    # Server; widen them to the BIGINT etl_runs_table declares
+    if engine.dialect.name != "mssql":
+        return
+    existing = {c["name"]: c["type"] for c in inspect(engine).get_columns(etl_runs.name)}
+    narrow = [
+        c for c in etl_runs.c
+        if isinstance(c.type, BigInteger) and c.name in existing and not isinstance(existing[c.name], BigInteger)
+    ]
+    if not narrow:
+        return
+    preparer = engine.dialect.identifier_preparer
+    with engine.begin() as connection:
+        for c in narrow:
+            connection.execute(text(
+                f"ALTER TABLE {preparer.format_table(etl_runs)} ALTER COLUMN {preparer.format_column(c)} BIGINT"
+            ))
+
+
+class EtlRun:
+    """
+    Collects metrics for one ETL run: per-stage timings, rows processed,
+    peak memory, database round-trips and bytes transferred.
+
+    Peak memory is the process's peak resident size unless `trace_memory`
+    is set. Tracing follows every allocation in the process and slows it
+    down considerably, so it is meant for profiling runs, not production
+    builds.
+
+    Usage:
+        run = EtlRun("repdata")
+        with run.watch(engine), run.stage("load"):
+            ...
+        run.finish()
+        run.record(db_session, engine, metadata)
+    """
+
+    def __init__(self, name, trace_memory=False):
+        self.name = name
+        self.status = "running"
+        self.error = None
+        self.started_at = datetime.utcnow()
+        self.finished_at = None
+        self.stage_seconds = {}
+        self.rows_processed = 0
+        self.db_round_trips = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.peak_memory_bytes = 0
+        self._started = time.perf_counter()
+        self._wall = None
+        self._owns_tracemalloc = trace_memory and not tracemalloc.is_tracing()
+        if self._owns_tracemalloc:
+            tracemalloc.start()
+
+    @property
+    def wall_seconds(self):
+        if self._wall is not None:
+            return self._wall
+        return time.perf_counter() - self._started
+
+    @contextmanager
+    def stage(self, name):
+        """Time a stage; repeated stages with the same name accumulate."""
+        started = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + time.perf_counter() - started
+
+    @contextmanager
+    def watch(self, engine):
+        """
+        Count round-trips and parameter bytes sent through `engine` from this
+        thread, or from threads started with a copy of its context (see
+        contextvars.copy_context).
+        """
+        def after(conn, cursor, statement, parameters, context, executemany):
+            if _active_run.get() is not self:
+                return
+            self.db_round_trips += 1
+            self.bytes_sent += len(statement.encode())
+            if executemany:
+                for params in parameters or ():
+                    self.bytes_sent += sum(_size(v) for v in (params.values() if isinstance(params, dict) else params))
+            elif parameters:
+                self.bytes_sent += sum(_size(v) for v in (parameters.values() if isinstance(parameters, dict) else parameters))
+
+        token = _active_run.set(self)
+        event.listen(engine, "after_cursor_execute", after)
+        try:
+            yield self
+        finally:
+            event.remove(engine, "after_cursor_execute", after)
+            _active_run.reset(token)
+
+    def add_rows(self, count, received_bytes=0):
+        self.rows_processed += count
+        self.bytes_received += received_bytes
+
+    def finish(self, error=None):
+        """Stop the clock and capture peak memory."""
+        self._wall = time.perf_counter() - self._started
+        self.finished_at = datetime.utcnow()
+        self.status = "failed" if error is not None else "succeeded"
+        self.error = None if error is None else repr(error)[:4000]
+        if tracemalloc.is_tracing():
+            self.peak_memory_bytes = tracemalloc.get_traced_memory()[1]
+            if self._owns_tracemalloc:
+                tracemalloc.stop()
+        else:
+            self.peak_memory_bytes = _peak_rss()
+        return self
+
+    def as_dict(self):
+        return {
+            "run_name": self.name,
+            "status": self.status,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "wall_seconds": round(self.wall_seconds, 3),
+            "rows_processed": self.rows_processed,
+            "peak_memory_bytes": self.peak_memory_bytes,
+            "db_round_trips": self.db_round_trips,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "stage_seconds": json.dumps({k: round(v, 3) for k, v in self.stage_seconds.items()}),
+            "error": self.error,
+        }
+
+    def record(self, db_session, engine, metadata):
+        """
+        Append this run to the etl_runs history table, creating it if needed.
+
+        Args:
+            db_session: Database session for target database
+            engine: SQLAlchemy engine for target database
+            metadata: SQLAlchemy MetaData object for table definitions
+        """
+        etl_runs = etl_runs_table(metadata)
+        if not inspect(engine).has_table("etl_runs"):
+            etl_runs.create(bind=engine)
+        else:
+            _widen_counters(engine, etl_runs)
+        db_session.execute(etl_runs.insert(), [self.as_dict()])
+        db_session.commit()
+
+    def record_failure(self, db_session, engine, metadata):
+        """
+        record() for a failed run, from an exception handler: rolls back the
+        failed transaction first, and prints rather than raises a recording
+        error, so it never replaces the exception that failed the run.
+
+        Returns:
+            bool: Whether the run was recorded
+        """
+        try:
+            db_session.rollback()
+            self.record(db_session, engine, metadata)
+        except Exception as exc:
+            print(f"Could not record failed run {self.name}: {exc!r}")
+            return False
+        return True
+
+    def prometheus(self):
+        """Render the run as Prometheus text exposition format."""
+        labels = f'run="{self.name}"'
+        lines = [
+            "# TYPE etl_run_duration_seconds gauge",
+            f"etl_run_duration_seconds{{{labels}}} {self.wall_seconds:.3f}",
+            "# TYPE etl_run_success gauge",
+            f"etl_run_success{{{labels}}} {int(self.status == 'succeeded')}",
+            "# TYPE etl_run_finished_timestamp_seconds gauge",
+            f"etl_run_finished_timestamp_seconds{{{labels}}} {time.time():.0f}",
+            "# TYPE etl_stage_duration_seconds gauge",
+        ]
+        for stage, seconds in self.stage_seconds.items():
+            lines.append(f'etl_stage_duration_seconds{{{labels},stage="{stage}"}} {seconds:.3f}')
+        lines += [
+            "# TYPE etl_rows_processed gauge",
+            f"etl_rows_processed{{{labels}}} {self.rows_processed}",
+            "# TYPE etl_peak_memory_bytes gauge",
+            f"etl_peak_memory_bytes{{{labels}}} {self.peak_memory_bytes}",
+            "# TYPE etl_db_round_trips gauge",
+            f"etl_db_round_trips{{{labels}}} {self.db_round_trips}",
+            "# TYPE etl_bytes_sent gauge",
+            f"etl_bytes_sent{{{labels}}} {self.bytes_sent}",
+            "# TYPE etl_bytes_received gauge",
+            f"etl_bytes_received{{{labels}}} {self.bytes_received}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """
+        Write the metrics to a node_exporter textfile collector file. The file
+        is replaced atomically so the collector never reads a partial write.
+        """
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.prometheus())
+        os.replace(tmp_path, path)
+
+    def summary(self):
+        stages = ", ".join(f"{k} {v:.2f}s" for k, v in self.stage_seconds.items())
+        return (
+            f"{self.name}: {self.status} in {self.wall_seconds:.2f}s ({stages}); "
+            f"{self.rows_processed} rows, {self.db_round_trips} round-trips, "
+            f"{self.bytes_sent} bytes sent, {self.bytes_received} bytes received, "
+            f"peak memory {self.peak_memory_bytes / 1e6:.1f} MB"
+        )
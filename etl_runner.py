@@ -0,0 +1,281 @@
+import json
+import threading
+import time
+import tracemalloc
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, MetaData, String, Table, inspect, select, text
+
+from etl_metrics import EtlRun
+
+
+class Step:
+    """
+    One ETL builder and the tables it reads and writes.
+
+    Args:
+        name: Unique step name, used as the key of its saved state
+        func: Callable (db_session, etl_session, engine, metadata, run) -> rows
+        reads: Names of the tables the step reads
+        writes: Names of the tables the step writes
+        retries: Number of extra attempts after a failure
+        retry_delay: Seconds to wait before the first retry; doubles each time
+    """
+
+    def __init__(self, name, func, reads=(), writes=(), retries=0, retry_delay=5.0):
+        self.name = name
+        self.func = func
+        self.reads = tuple(reads)
+        self.writes = tuple(writes)
+        self.retries = retries
+        self.retry_delay = retry_delay
+
+    def __repr__(self):
+        return f"Step({self.name!r}, reads={self.reads}, writes={self.writes})"
+
+
+def repdata_step(Quote, Outbound, **kwargs):
+    """Step wrapping agg3a.build_repdata_table."""
+    from agg3a import build_repdata_table
+
+    return Step(
+        "repdata",
+        lambda db, etl, engine, metadata, run: build_repdata_table(db, etl, engine, metadata, Quote, Outbound, run=run),
+        reads=(Quote.__table__.name, Outbound.__table__.name),
+        writes=("repdata",),
+        **kwargs
+    )
+
+
+def actionable_quotes_step(Quote, Outbound, **kwargs):
+    """Step wrapping actionable.build_actionable_quotes."""
+    from actionable import build_actionable_quotes
+
+    return Step(
+        "actionable_quotes",
+        lambda db, etl, engine, metadata, run: build_actionable_quotes(db, engine, metadata, Quote, Outbound, run=run),
+        reads=(Quote.__table__.name, Outbound.__table__.name),
+        writes=("actionable_quotes",),
+        **kwargs
+    )
+
+
+def supporting_indexes_step(models, **kwargs):
+    """Step wrapping indexes.create_indexes, run ahead of the exports relying on them."""
+    from indexes import create_indexes
+
+    def create(db, etl, engine, metadata, run):
+        with run.stage("create"):
+            return create_indexes(engine, models)
+
+    return Step(
+        "supporting_indexes",
+        create,
+        reads=(models.QuoteHistory.__table__.name,),
+        **kwargs
+    )
+
+
+def history_snapshot_step(QuoteHistory, snapshots, columns=None, **kwargs):
+    """Step publishing a quote_history snapshot (snapshots.publish_quote_history)."""
+    from snapshots import publish_quote_history
+
+    def publish(db, etl, engine, metadata, run):
+        with run.stage("publish"):
+            publish_quote_history(snapshots, engine, QuoteHistory, columns)
+        rows = snapshots.current("quote_history").rows
+        run.add_rows(rows)
+        return rows
+
+    return Step(
+        "quote_history_snapshot",
+        publish,
+        reads=(QuoteHistory.__table__.name,),
+        **kwargs
+    )
+
+
+def step_state_table(metadata):
+    return Table(
+        "etl_step_state",
+        metadata,
+        Column("step_name", String(100), primary_key=True),
+        Column("inputs_fingerprint", String(1000)),
+        Column("succeeded_at", DateTime),
+        extend_existing=True
+    )
+
+
+def table_fingerprint(connection, table_name):
+    """
+    Cheap change detector for one table: row count plus an aggregate
+    checksum of every row, on SQL Server. Elsewhere there is no cheap
+    checksum and a row count alone misses UPDATEs, so None is returned and
+    the step always runs.
+    """
+    if connection.dialect.name != "mssql":
+        return None
+    quoted = connection.dialect.identifier_preparer.quote(table_name)
+    stmt = text(f"SELECT COUNT_BIG(*), CHECKSUM_AGG(BINARY_CHECKSUM(*)) FROM {quoted}")
+    return [str(v) for v in connection.execute(stmt).one()]
+
+
+class Pipeline:
+    """
+    Run ETL steps as a DAG on a worker pool.
+
+    A step depends on every earlier-declared step that writes a table it reads
+    or writes. Independent steps run in parallel, so the total refresh time is
+    the critical path rather than the sum of all steps. A step is skipped when
+    the fingerprints of its input tables match those of its last successful
+    run.
+
+    Args:
+        steps: Steps in declaration order
+        engine: SQLAlchemy engine for target database
+        session_factory: Callable returning a new session for target database
+        etl_session_factory: Callable returning a new ETL session; defaults to
+            session_factory
+        fingerprint: Callable (connection, table_name) -> JSON-serialisable
+            value, or None when changes to the table can't be detected
+    """
+
+    def __init__(self, steps, engine, session_factory, etl_session_factory=None, fingerprint=table_fingerprint):
+        self.steps = {step.name: step for step in steps}
+        if len(self.steps) != len(steps):
+            raise ValueError("Step names must be unique")
+        self.engine = engine
+        self.session_factory = session_factory
+        self.etl_session_factory = etl_session_factory or session_factory
+        self.fingerprint = fingerprint
+        self.depends_on = self._dependencies(steps)
+        self._state_lock = threading.Lock()
+
+    @staticmethod
+    def _dependencies(steps):
+        depends_on = {step.name: set() for step in steps}
+        for i, step in enumerate(steps):
+            for earlier in steps[:i]:
+                if set(earlier.writes) & (set(step.reads) | set(step.writes)):
+                    depends_on[step.name].add(earlier.name)
+        return depends_on
+
+    def _inputs_fingerprint(self, step):
+        with self.engine.connect() as connection:
+            fingerprints = {t: self.fingerprint(connection, t) for t in sorted(step.reads)}
+        if any(value is None for value in fingerprints.values()):
+            return None
+        return json.dumps(fingerprints)
+
+    def _last_fingerprint(self, step):
+        if not inspect(self.engine).has_table("etl_step_state"):
+            return None
+        state = step_state_table(MetaData())
+        with self.engine.connect() as connection:
+            return connection.execute(
+                select(state.c.inputs_fingerprint).where(state.c.step_name == step.name)
+            ).scalar()
+
+    def _save_fingerprint(self, step, fingerprint):
+        state = step_state_table(MetaData())
+        with self._state_lock:
+            if not inspect(self.engine).has_table("etl_step_state"):
+                state.create(bind=self.engine)
+        with self.engine.begin() as connection:
+            connection.execute(state.delete().where(state.c.step_name == step.name))
+            connection.execute(state.insert(), [{
+                "step_name": step.name,
+                "inputs_fingerprint": fingerprint,
+                "succeeded_at": datetime.utcnow(),
+            }])
+
+    def _run_step(self, step, force):
+        fingerprint = self._inputs_fingerprint(step) if step.reads else None
+        if not force and fingerprint is not None and fingerprint == self._last_fingerprint(step):
+            print(f"[{step.name}] inputs unchanged since last successful run, skipping")
+            return "skipped", 0
+
+        delay = step.retry_delay
+        for attempt in range(step.retries + 1):
+            run = EtlRun(step.name)
+            metadata = MetaData()
+            with self.session_factory() as db, self.etl_session_factory() as etl:
+                try:
+                    rows = step.func(db, etl, self.engine, metadata, run)
+                except Exception as exc:
+                    run.finish(exc)
+                    print(f"[{step.name}] attempt {attempt + 1} failed: {exc!r}")
+                    run.record_failure(db, self.engine, metadata)
+                    if attempt == step.retries:
+                        raise
+                else:
+                    run.finish()
+                    print(run.summary())
+                    run.record(db, self.engine, metadata)
+                    if fingerprint is not None:
+                        self._save_fingerprint(step, fingerprint)
+                    return "succeeded", rows
+            time.sleep(delay)
+            delay *= 2
+
+    def run(self, max_workers=4, only=None, force=False, trace_memory=False):
+        """
+        Execute the pipeline.
+
+        Args:
+            max_workers: Size of the worker pool
+            only: Optional names of the steps to run, e.g. to retry one step;
+                other steps are treated as already done
+            force: Run steps even if their inputs have not changed
+            trace_memory: Trace allocations with tracemalloc for the whole
+                pipeline. Tracing is process-wide, so each step then reports
+                the peak of the pipeline so far, not its own
+
+        Returns:
+            dict: step name -> (status, rows or exception)
+        """
+        selected = set(only) if only is not None else set(self.steps)
+        unknown = selected - set(self.steps)
+        if unknown:
+            raise ValueError(f"Unknown steps: {sorted(unknown)}")
+
+        results = {}
+        pending = {name: self.depends_on[name] & selected for name in selected}
+        running = {}
+
+        # Started and stopped here rather than per step, so a step finishing
+        # early can't stop tracing under the others
+        owns_tracemalloc = trace_memory and not tracemalloc.is_tracing()
+        if owns_tracemalloc:
+            tracemalloc.start()
+        try:
+            self._run_all(pending, running, results, max_workers, force)
+        finally:
+            if owns_tracemalloc:
+                tracemalloc.stop()
+        return results
+
+    def _run_all(self, pending, running, results, max_workers, force):
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            while pending or running:
+                for name in [n for n, deps in pending.items() if not deps]:
+                    del pending[name]
+                    running[pool.submit(self._run_step, self.steps[name], force)] = name
+
+                if not running:
+                    # Whatever is still pending waits on a failed step
+                    for name in pending:
+                        results[name] = ("blocked", None)
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as exc:
+                        results[name] = ("failed", exc)
+                        continue
+                    for deps in pending.values():
+                        deps.discard(name)
@@ -0,0 +1,348 @@
+import csv
+import gzip
+import io
+import json
+import os
+import re
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import desc, exists, func, select
+
+from snapshots import arrow_schema
+
+FORMATS = ("csv", "parquet")
+
+# Job ids are uuid4().hex; anything else never names a job directory
+JOB_ID = re.compile(r"[0-9a-f]{32}")
+
+
+class ExportJob:
+    """
+    State of one background export. Persisted as job.json next to its part
+    files so an interrupted job can be resumed after a restart.
+    """
+
+    def __init__(self, job_id, start, end, format, directory, latest_only=False):
+        self.id = job_id
+        self.start = start
+        self.end = end
+        self.format = format
+        self.latest_only = latest_only
+        self.directory = directory
+        self.status = "queued"
+        self.partitions_total = 0
+        self.partitions_done = 0
+        self.rows = 0
+        self.error = None
+        self.created_at = datetime.utcnow()
+        self.finished_at = None
+
+    @property
+    def path(self):
+        suffix = "csv.gz" if self.format == "csv" else "parquet"
+        return os.path.join(self.directory, f"export.{suffix}")
+
+    @property
+    def progress(self):
+        if not self.partitions_total:
+            return 0.0
+        return round(self.partitions_done / self.partitions_total, 4)
+
+    def as_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "format": self.format,
+            "latest_only": self.latest_only,
+            "start": self.start,
+            "end": self.end,
+            "partitions_total": self.partitions_total,
+            "partitions_done": self.partitions_done,
+            "progress": self.progress,
+            "rows": self.rows,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+    def save(self):
+        tmp_path = os.path.join(self.directory, f"job.json.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.as_dict(), f, default=str)
+        os.replace(tmp_path, os.path.join(self.directory, "job.json"))
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, "job.json")) as f:
+            data = json.load(f)
+        job = cls(
+            data["id"],
+            datetime.fromisoformat(data["start"]),
+            datetime.fromisoformat(data["end"]),
+            data["format"],
+            directory,
+            data.get("latest_only", False),
+        )
+        job.status = data["status"]
+        job.partitions_total = data["partitions_total"]
+        job.partitions_done = data["partitions_done"]
+        job.rows = data["rows"]
+        job.error = data["error"]
+        job.created_at = datetime.fromisoformat(data["created_at"])
+        if data["finished_at"]:
+            job.finished_at = datetime.fromisoformat(data["finished_at"])
+        return job
+
+
+class ExportJobs:
+    """
+    Run QuoteHistory exports in the background.
+
+    A job splits its [start, end] range into date partitions that a worker
+    pool exports in parallel, each to its own compressed part file. Parts are
+    written to a temporary name and renamed when complete, so a resumed job
+    only redoes the partitions that hadn't finished. The finished parts are
+    then combined into a single file for download.
+
+    Jobs left queued or running by a previous process are found when the
+    directory is opened and reported as queued until resume_unfinished()
+    restarts them.
+
+    Args:
+        directory: Local directory holding one sub-directory per job
+        model: QuoteHistory ORM model
+        columns: Names of the columns to export, in order
+        workers: Number of partitions exported in parallel, each holding
+            a pooled connection while it runs
+        partition_days: Width of each date partition
+    """
+
+    def __init__(self, directory, model, columns, workers=4, partition_days=7):
+        self.directory = directory
+        self.model = model
+        self.columns = list(columns)
+        self.partition_days = partition_days
+        self.workers = workers
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="export")
+        os.makedirs(directory, exist_ok=True)
+        self._unfinished = self._find_unfinished()
+
+    @property
+    def schema(self):
+        """Arrow schema of the exported columns, from their column types."""
+        table = self.model.__table__
+        return arrow_schema([table.c[name] for name in self.columns])
+
+    def _find_unfinished(self):
+        unfinished = []
+        for job_id in sorted(os.listdir(self.directory)):
+            if not JOB_ID.fullmatch(job_id) or not os.path.exists(os.path.join(self.directory, job_id, "job.json")):
+                continue
+            job = ExportJob.load(os.path.join(self.directory, job_id))
+            if job.status in ("queued", "running"):
+                job.status = "queued"
+                self._save(job)
+                self.jobs[job_id] = job
+                unfinished.append(job)
+        return unfinished
+
+    def _save(self, job):
+        # Partition workers update and save a job concurrently; saving under
+        # the lock keeps an older snapshot from replacing a newer job.json
+        with self._lock:
+            job.save()
+
+    def _range(self, engine, start, end):
+        if start is None or end is None:
+            entry_date = self.model.quote_entry_date
+            with engine.connect() as connection:
+                low, high = connection.execute(select(func.min(entry_date), func.max(entry_date))).one()
+            start = start or low or datetime.utcnow()
+            end = end or high or datetime.utcnow()
+        return start, end
+
+    def partitions(self, start, end):
+        """Half-open [lower, upper) ranges covering [start, end]."""
+        step = timedelta(days=self.partition_days)
+        lower = start
+        while lower <= end:
+            upper = min(lower + step, end + timedelta(microseconds=1))
+            yield lower, upper
+            lower = upper
+
+    def submit(self, engine, start=None, end=None, format="csv", latest_only=False):
+        """
+        Create a job and queue it on the worker pool.
+
+        Args:
+            engine: SQLAlchemy engine to export from
+            start: Earliest quote_entry_date, defaults to the oldest row
+            end: Latest quote_entry_date, defaults to the newest row
+            format: "csv" or "parquet"
+            latest_only: Export only the newest version of each quote
+
+        Returns:
+            ExportJob: The queued job
+        """
+        if format not in FORMATS:
+            raise ValueError(f"Unsupported format {format!r}")
+        start, end = self._range(engine, start, end)
+        if end < start:
+            raise ValueError("end must not be before start")
+        job_id = uuid.uuid4().hex
+        job = ExportJob(job_id, start, end, format, os.path.join(self.directory, job_id), latest_only)
+        os.makedirs(job.directory, exist_ok=True)
+        self._save(job)
+        with self._lock:
+            self.jobs[job_id] = job
+        threading.Thread(target=self._run, args=(engine, job), name=f"export-{job_id}", daemon=True).start()
+        return job
+
+    def resume(self, engine, job_id):
+        """Restart a job found on disk, e.g. after the API restarted."""
+        if not JOB_ID.fullmatch(job_id):
+            raise ValueError(f"Invalid job id {job_id!r}")
+        job = ExportJob.load(os.path.join(self.directory, job_id))
+        with self._lock:
+            self.jobs[job_id] = job
+        threading.Thread(target=self._run, args=(engine, job), name=f"export-{job_id}", daemon=True).start()
+        return job
+
+    def resume_unfinished(self, engine):
+        """
+        Restart the jobs a previous process left unfinished, once.
+
+        Returns:
+            list: The restarted jobs
+        """
+        with self._lock:
+            unfinished, self._unfinished = self._unfinished, []
+        for job in unfinished:
+            threading.Thread(target=self._run, args=(engine, job), name=f"export-{job.id}", daemon=True).start()
+        return unfinished
+
+    def has_unfinished(self):
+        return bool(self._unfinished)
+
+    def get(self, job_id):
+        if not JOB_ID.fullmatch(job_id):
+            return None
+        with self._lock:
+            job = self.jobs.get(job_id)
+        if job is None and os.path.exists(os.path.join(self.directory, job_id, "job.json")):
+            job = ExportJob.load(os.path.join(self.directory, job_id))
+        return job
+
+    def _part_path(self, job, lower, upper):
+        suffix = "csv.gz" if job.format == "csv" else "parquet"
+        return os.path.join(job.directory, f"part-{lower:%Y%m%d%H%M%S}-{upper:%Y%m%d%H%M%S}.{suffix}")
+
+    def _run(self, engine, job):
+        parts = list(self.partitions(job.start, job.end))
+        job.partitions_total = len(parts)
+        job.partitions_done = sum(os.path.exists(self._part_path(job, *p)) for p in parts)
+        job.status = "running"
+        self._save(job)
+
+        try:
+            futures = [
+                self._pool.submit(self._export_partition, engine, job, lower, upper)
+                for lower, upper in parts
+                if not os.path.exists(self._part_path(job, lower, upper))
+            ]
+            for future in futures:
+                future.result()
+            self._combine(job, [self._part_path(job, *p) for p in parts])
+        except Exception as exc:
+            job.status = "failed"
+            job.error = repr(exc)
+        else:
+            job.status = "succeeded"
+        job.finished_at = datetime.utcnow()
+        self._save(job)
+
+    def _export_partition(self, engine, job, lower, upper):
+        table = self.model.__table__
+        stmt = select(*[table.c[name] for name in self.columns]).where(
+            table.c.quote_entry_date >= lower,
+            table.c.quote_entry_date < upper,
+        ).order_by(table.c.quote_number, desc(table.c.quote_entry_date))
+
+        if job.latest_only:
+            # A quote's versions can straddle partitions, so rank against the
+            # whole job range: keep rows with no newer version up to job.end
+            newer = table.alias("newer")
+            stmt = stmt.where(~exists().where(
+                newer.c.quote_number == table.c.quote_number,
+                newer.c.quote_entry_date > table.c.quote_entry_date,
+                newer.c.quote_entry_date <= job.end,
+            ))
+
+        path = self._part_path(job, lower, upper)
+        tmp_path = path + ".tmp"
+        with engine.connect() as connection:
+            result = connection.execution_options(yield_per=5000).execute(stmt)
+            if job.format == "csv":
+                rows = self._write_csv(tmp_path, result)
+            else:
+                rows = self._write_parquet(tmp_path, result)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            job.rows += rows
+            job.partitions_done += 1
+            job.save()
+
+    def _write_csv(self, path, result):
+        rows = 0
+        with gzip.open(path, "wt", newline="") as f:
+            writer = csv.writer(f)
+            for partition in result.partitions():
+                writer.writerows(partition)
+                rows += len(partition)
+        return rows
+
+    def _write_parquet(self, path, result):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        # Typed from the columns, not the first batch, where a column that is
+        # all NULL would be inferred as null and break every later batch
+        schema = self.schema
+        rows = 0
+        # Also written for an empty partition, as a marker a resume skips
+        with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+            for partition in result.partitions():
+                writer.write_table(pa.Table.from_pylist([dict(row._mapping) for row in partition], schema=schema))
+                rows += len(partition)
+        return rows
+
+    def _combine(self, job, part_paths):
+        tmp_path = job.path + ".tmp"
+        if job.format == "csv":
+            # Concatenated gzip members are a valid gzip stream
+            with open(tmp_path, "wb") as out:
+                header = io.StringIO()
+                csv.writer(header).writerow(self.columns)
+                out.write(gzip.compress(header.getvalue().encode()))
+                for part_path in part_paths:
+                    with open(part_path, "rb") as part:
+                        shutil.copyfileobj(part, out)
+        else:
+            import pyarrow.parquet as pq
+
+            schema = self.schema
+            with pq.ParquetWriter(tmp_path, schema, compression="zstd") as writer:
+                for part_path in part_paths:
+                    table = pq.read_table(part_path)
+                    if table.num_rows:
+                        # Parts written before the schema was fixed may have
+                        # null-typed columns
+                        writer.write_table(table.cast(schema))
+        os.replace(tmp_path, job.path)
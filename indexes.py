@@ -0,0 +1,36 @@
+from functools import lru_cache
+
+from sqlalchemy import Index
+
+
+@lru_cache(maxsize=None)
+def supporting_indexes(models):
+    """
+    Indexes the reporting and export queries rely on, beyond those declared
+    on the models themselves. An Index attaches itself to its table, so they
+    are built once per models module.
+
+    Args:
+        models: Module exposing the ORM models
+    """
+    return (
+        # export_quotes(latest_only=True): newest QuoteHistory row per quote
+        Index(
+            "ix_quote_history_quote_number_entry_date",
+            models.QuoteHistory.quote_number,
+            models.QuoteHistory.quote_entry_date.desc(),
+        ),
+    )
+
+
+def create_indexes(engine, models):
+    """
+    Create any supporting index that doesn't exist yet.
+
+    Returns:
+        int: Number of supporting indexes
+    """
+    created = supporting_indexes(models)
+    for index in created:
+        index.create(bind=engine, checkfirst=True)
+    return len(created)
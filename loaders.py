@@ -0,0 +1,98 @@
+import typing
+from functools import lru_cache
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import joinedload, selectinload
+
+
+class LoaderPlan:
+    """
+    Eager-loading options derived from a serializer, and the number of extra
+    SELECT statements they cost regardless of how many rows are loaded.
+    """
+
+    def __init__(self, options, extra_statements):
+        self.options = tuple(options)
+        self.extra_statements = extra_statements
+
+
+def _nested_serializer(annotation):
+    # Unwrap List[X], Optional[X], Union[X, None] down to a serializer class
+    if hasattr(annotation, "model_fields"):
+        return annotation
+    for arg in typing.get_args(annotation):
+        nested = _nested_serializer(arg)
+        if nested is not None:
+            return nested
+    return None
+
+
+def _options(model, serializer, seen):
+    options = []
+    extra = 0
+    relationships = inspect(model).relationships
+    for name, field in serializer.model_fields.items():
+        relationship = relationships.get(name)
+        if relationship is None or (model, name) in seen:
+            continue
+        attribute = getattr(model, name)
+        # Collections get one IN query per page; many-to-one rides on the JOIN
+        if relationship.uselist:
+            loader = selectinload(attribute)
+            extra += 1
+        else:
+            loader = joinedload(attribute)
+
+        nested = _nested_serializer(field.annotation)
+        if nested is not None:
+            sub_options, sub_extra = _options(relationship.mapper.class_, nested, seen | {(model, name)})
+            if sub_options:
+                loader = loader.options(*sub_options)
+            extra += sub_extra
+        options.append(loader)
+    return options, extra
+
+
+@lru_cache(maxsize=None)
+def loader_plan(model, serializer):
+    """
+    Build the loader options needed to serialise `model` rows through
+    `serializer` without lazy loads: selectinload for collections and
+    joinedload for many-to-one relationships, following nested serializers.
+
+    Args:
+        model: ORM model being queried
+        serializer: Pydantic serializer used as the response model
+
+    Returns:
+        LoaderPlan: Cached per (model, serializer)
+    """
+    options, extra = _options(model, serializer, frozenset())
+    return LoaderPlan(options, extra)
+
+
+def count_statements(session, budget=None):
+    """
+    Start counting the ORM statements `session` executes, lazy loads
+    included. Use assert_budget() once the response has been serialised.
+
+    Args:
+        session: Session serving the request
+        budget: Maximum number of statements allowed
+    """
+    if "statement_count" not in session.info:
+        def counter(orm_execute_state):
+            session.info["statement_count"] += 1
+
+        event.listen(session, "do_orm_execute", counter)
+    session.info["statement_count"] = 0
+    session.info["statement_budget"] = budget
+
+
+def assert_budget(session):
+    """Raise AssertionError if the session exceeded its statement budget."""
+    budget = session.info.get("statement_budget")
+    count = session.info.get("statement_count", 0)
+    if budget is not None and count > budget:
+        raise AssertionError(f"Executed {count} statements, budget is {budget}")
+    return count
@@ -0,0 +1,328 @@
+import argparse
+import asyncio
+import json
+import os
+import re
+import xml.etree.ElementTree as ET
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import MetaData, create_engine, event, inspect, select
+
+import agg3a
+import bench_api
+import indexes
+
+SHOWPLAN_NS = {"sp": "http://schemas.microsoft.com/sqlserver/2004/07/showplan"}
+
+# Operators an index on the right columns can usually turn into seeks or
+# ordered reads
+SCAN_OPS = {"Table Scan", "Clustered Index Scan", "Index Scan"}
+SORT_OPS = {"Sort"}
+
+
+@contextmanager
+def capture(engine, statements, label):
+    """
+    Record the SELECT statements sent through `engine`, with their
+    parameters, under `label`.
+    """
+    def before(conn, cursor, statement, parameters, context, executemany):
+        keyword = statement.lstrip().split(None, 1)[0].upper()
+        if keyword in ("SELECT", "WITH") and not executemany:
+            statements.append((label, statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", before)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before)
+
+
+def etl_statements(engine, models):
+    """
+    The statements build_repdata_table and refresh_repdata_periods issue:
+    a full and an incremental quote_state sync, full and sharded builds,
+    the sketch pass and a one-week refresh.
+    """
+    Quote, Outbound = models.Quote, models.Outbound
+    week = agg3a.period_bounds("week", datetime.utcnow() - timedelta(days=7))
+    periods = {date_type: [agg3a.period_bounds(date_type, week[0])] for date_type in agg3a.DATE_TYPES}
+    state = agg3a.quote_state_table(MetaData(), Quote, Outbound)
+    # Incremental syncs recompute chunks of up to 500 changed quotes
+    with engine.connect() as connection:
+        sample = list(connection.scalars(select(Quote.quote_number).distinct().limit(500))) or [""]
+    # The sharded statements' plans are the same for every shard
+    shard = (0, 4)
+
+    builders = {
+        "etl quote_state": agg3a.build_quote_state_stmt(Quote, Outbound),
+        **{
+            f"etl quote_state changed {i}": stmt
+            for i, stmt in enumerate(agg3a.build_changed_quotes_stmts(Quote, Outbound, week[0]), 1)
+        },
+        **{
+            f"etl quote_state stale {i}": stmt
+            for i, stmt in enumerate(agg3a.build_stale_quotes_stmts(state, Quote, Outbound), 1)
+        },
+        "etl quote_state incremental": agg3a.build_quote_state_stmt(Quote, Outbound, sample),
+        "etl repdata shard": agg3a.build_partial_stmt(Quote, Outbound, shard, state=state),
+        "etl repdata_advisor shard": agg3a.build_partial_stmt(Quote, Outbound, shard, state=state, dimensions=("user_id",)),
+        "etl repdata": agg3a.build_repdata_stmt(Quote, Outbound, state=state),
+        "etl repdata_advisor": agg3a.build_advisor_repdata_stmt(Quote, Outbound, state=state),
+        "etl quote_sketch": agg3a.build_quote_sketch_stmt(Quote, Outbound, state=state),
+        "etl refresh repdata": agg3a.build_repdata_stmt(Quote, Outbound, periods, state),
+        "etl refresh repdata_advisor": agg3a.build_advisor_repdata_stmt(Quote, Outbound, periods, state),
+    }
+
+    # Compiled rather than run here: actual_plan runs each statement once
+    statements = []
+    for label, stmt in builders.items():
+        compiled = stmt.compile(dialect=engine.dialect)
+        parameters = compiled.construct_params()
+        statements.append((label, str(compiled), tuple(parameters[name] for name in compiled.positiontup or ())))
+    return statements
+
+
+def index_statements(engine, max_filters, roles, user_id):
+    """The statements behind every /quotes filter/sort combination."""
+    import httpx
+
+    app = bench_api.build_app(engine, roles, user_id)
+    statements = []
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://plans") as client:
+            for name, query in bench_api.build_matrix(max_filters):
+                with capture(engine, statements, f"index {name}"):
+                    await client.get("/quotes", params=query)
+
+    asyncio.run(run())
+    return statements
+
+
+def actual_plan(engine, statement, parameters):
+    """
+    Run a statement with SET STATISTICS XML ON and return its actual
+    execution plan XML (SQL Server only).
+    """
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SET STATISTICS XML ON")
+        cursor.execute(statement, parameters or ())
+        plans = []
+        while True:
+            if cursor.description:
+                rows = cursor.fetchall()
+                if cursor.description[0][0].endswith("XML Showplan") and rows:
+                    plans.append(rows[0][0])
+            if not cursor.nextset():
+                break
+        cursor.execute("SET STATISTICS XML OFF")
+        return plans[-1] if plans else None
+    finally:
+        connection.rollback()
+        connection.close()
+
+
+def _columns(element):
+    return [
+        (ref.get("Table", "").strip("[]"), ref.get("Column"))
+        for ref in element.iterfind(".//sp:ColumnReference", SHOWPLAN_NS)
+        if ref.get("Column")
+    ]
+
+
+def _actual_rows(relop):
+    counters = relop.findall("./sp:RunTimeInformation/sp:RunTimeCountersPerThread", SHOWPLAN_NS)
+    if not counters:
+        return None
+    return sum(int(c.get("ActualRows", 0)) for c in counters)
+
+
+def analyse(plan_xml):
+    """
+    Summarise a showplan: statement cost, elapsed time, the scans and sorts
+    an index could remove, and SQL Server's own missing index hints.
+
+    Returns:
+        dict: cost, elapsed_ms, findings and proposals
+    """
+    root = ET.fromstring(plan_xml)
+    stmt = root.find(".//sp:StmtSimple", SHOWPLAN_NS)
+    times = root.find(".//sp:QueryTimeStats", SHOWPLAN_NS)
+    summary = {
+        "cost": float(stmt.get("StatementSubTreeCost", 0)) if stmt is not None else None,
+        "elapsed_ms": int(times.get("ElapsedTime")) if times is not None else None,
+        "findings": [],
+        "proposals": [],
+    }
+
+    for relop in root.iterfind(".//sp:RelOp", SHOWPLAN_NS):
+        op = relop.get("PhysicalOp")
+        cost = float(relop.get("EstimatedTotalSubtreeCost", 0))
+        if op in SCAN_OPS:
+            obj = relop.find(".//sp:Object", SHOWPLAN_NS)
+            predicate = relop.find("./*/sp:Predicate", SHOWPLAN_NS)
+            if obj is None or predicate is None:
+                continue
+            table = obj.get("Table", "").strip("[]")
+            columns = [c for t, c in _columns(predicate) if t == table]
+            summary["findings"].append({
+                "op": op, "table": table, "columns": columns, "cost": cost, "actual_rows": _actual_rows(relop)
+            })
+            if columns:
+                summary["proposals"].append({"table": table, "keys": list(dict.fromkeys(columns)), "include": [], "reason": f"{op} with predicate"})
+        elif op in SORT_OPS:
+            order_by = relop.find("./sp:Sort/sp:OrderBy", SHOWPLAN_NS)
+            if order_by is None:
+                continue
+            keys = _columns(order_by)
+            tables = {t for t, _ in keys if t}
+            summary["findings"].append({
+                "op": op, "table": ",".join(sorted(tables)), "columns": [c for _, c in keys], "cost": cost,
+                "actual_rows": _actual_rows(relop)
+            })
+            # Only a sort on one base table's columns can be served by an index
+            if len(tables) == 1 and all(t for t, _ in keys):
+                summary["proposals"].append({"table": tables.pop(), "keys": [c for _, c in keys], "include": [], "reason": "Sort"})
+
+    for group in root.iterfind(".//sp:MissingIndexGroup", SHOWPLAN_NS):
+        impact = float(group.get("Impact", 0))
+        for missing in group.iterfind("./sp:MissingIndex", SHOWPLAN_NS):
+            usage = defaultdict(list)
+            for column_group in missing.iterfind("./sp:ColumnGroup", SHOWPLAN_NS):
+                usage[column_group.get("Usage")] += [c.get("Name").strip("[]") for c in column_group.iterfind("./sp:Column", SHOWPLAN_NS)]
+            summary["proposals"].append({
+                "table": missing.get("Table").strip("[]"),
+                "keys": usage["EQUALITY"] + usage["INEQUALITY"],
+                "include": usage["INCLUDE"],
+                "reason": f"SQL Server missing index hint, impact {impact:.0f}%",
+            })
+    return summary
+
+
+def existing_index_keys(engine, models):
+    """Leading key columns of the indexes that exist or indexes.py creates."""
+    inspector = inspect(engine)
+    keys = defaultdict(list)
+    for table_name in inspector.get_table_names():
+        for index in inspector.get_indexes(table_name):
+            keys[table_name].append([c for c in index["column_names"] if c])
+        primary = inspector.get_pk_constraint(table_name).get("constrained_columns")
+        if primary:
+            keys[table_name].append(primary)
+    for index in indexes.supporting_indexes(models):
+        keys[index.table.name].append([c.name for c in index.columns])
+    return keys
+
+
+def covered(keys, existing):
+    """An index whose leading columns are `keys` already exists."""
+    return any(index[:len(keys)] == keys for index in existing)
+
+
+def index_name(table, keys):
+    return re.sub(r"\W", "_", f"ix_{table}_{'_'.join(keys)}").lower()[:128]
+
+
+def migration(proposals):
+    """
+    Review-ready T-SQL creating each proposed index once, with the
+    statements and plan operators that motivated it.
+    """
+    lines = [
+        f"-- Index proposals from plan_advisor.py, {datetime.utcnow():%Y-%m-%d %H:%M} UTC",
+        "-- Review before applying: each index speeds up the listed reads and",
+        "-- slows down writes to its table.",
+        "",
+    ]
+    for (table, keys, include), reasons in proposals.items():
+        name = index_name(table, keys)
+        lines.append(f"-- {len(reasons)} finding(s):")
+        for label, reason, cost in sorted(reasons, key=lambda r: -r[2])[:10]:
+            lines.append(f"--   {label}: {reason} (statement cost {cost:.2f})")
+        lines.append(f"IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = '{name}')")
+        create = f"    CREATE INDEX [{name}] ON [{table}] ({', '.join(f'[{k}]' for k in keys)})"
+        if include:
+            create += f" INCLUDE ({', '.join(f'[{c}]' for c in include)})"
+        lines.append(create + ";")
+        lines.append("")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Capture actual plans of the repdata ETL and /quotes index queries and propose indexes"
+    )
+    parser.add_argument("--url", default=os.environ.get("BENCH_DATABASE_URL"), required="BENCH_DATABASE_URL" not in os.environ,
+                        help="SQLAlchemy URL of a SQL Server database with representative data")
+    parser.add_argument("--max-filters", type=int, default=1, help="Largest number of index filters combined")
+    parser.add_argument("--roles", default="ADMIN")
+    parser.add_argument("--user-id", type=int, default=1)
+    parser.add_argument("--skip-etl", action="store_true")
+    parser.add_argument("--skip-index", action="store_true")
+    parser.add_argument("--report", default="plan_report.json", help="Per-statement plan summary")
+    parser.add_argument("--output", default="index_proposals.sql", help="Proposed index migration")
+    args = parser.parse_args(argv)
+
+    from src.database import models
+
+    engine = create_engine(args.url)
+    if engine.dialect.name != "mssql":
+        parser.error("Actual plans are captured with SET STATISTICS XML, which needs SQL Server")
+
+    statements = []
+    if not args.skip_etl:
+        statements += etl_statements(engine, models)
+    if not args.skip_index:
+        statements += index_statements(engine, args.max_filters, args.roles.split(","), args.user_id)
+
+    existing = existing_index_keys(engine, models)
+    proposals = defaultdict(list)
+    report = []
+    seen = set()
+    for label, statement, parameters in statements:
+        key = (statement, repr(parameters))
+        if key in seen:
+            continue
+        seen.add(key)
+
+        plan = actual_plan(engine, statement, parameters)
+        if plan is None:
+            continue
+        summary = analyse(plan)
+        report.append({"label": label, "statement": statement, **summary})
+        print(f"{label:70} cost {summary['cost'] or 0:10.2f}  {summary['elapsed_ms']}ms  "
+              f"{len(summary['findings'])} scan/sort finding(s)")
+
+        for proposal in summary["proposals"]:
+            if not proposal["keys"] or covered(proposal["keys"], existing.get(proposal["table"], [])):
+                continue
+            proposals[(proposal["table"], tuple(proposal["keys"]), tuple(proposal["include"]))].append(
+                (label, proposal["reason"], summary["cost"] or 0.0)
+            )
+
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+
+    # Keep only the widest of proposals sharing leading keys on a table
+    merged = {}
+    for (table, keys, include), reasons in sorted(proposals.items(), key=lambda item: -len(item[0][1])):
+        wider = next((k for k in merged if k[0] == table and k[1][:len(keys)] == keys), None)
+        if wider is not None:
+            merged[wider] += reasons
+        else:
+            merged[(table, keys, include)] = list(reasons)
+
+    with open(args.output, "w") as f:
+        f.write(migration(merged))
+    print(f"{len(report)} plans written to {args.report}; {len(merged)} index proposal(s) written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
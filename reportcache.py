@@ -0,0 +1,221 @@
+import asyncio
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import column, select, table
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# The dashboard filter space, per the dropdowns in Graphs2.vue
+CHANNELS = ("Web", "Inbound", "All")
+PRODUCTS = ("CommercialAuto", "CommercialBuildingGeneralLiability", "All")
+DATE_TYPES = ("week", "month", "year")
+
+repdata_generation = table("repdata_generation", column("id"), column("generation"))
+
+
+class ReportCache:
+    """
+    Encoded report responses for every dashboard filter combination, keyed by
+    repdata generation.
+
+    When a request notices that the ETL has published a new generation, the
+    cache warms the new generation in the background, computing every
+    (endpoint, channel, product, date_type) body in parallel, and only then
+    switches to it. Until the switch, requests keep getting the previous
+    generation's responses, so nobody pays the cold-query cost and every
+    dashboard sees a consistent generation.
+
+    Args:
+        builders: {endpoint: callable(db, channel, product, date_type) -> bytes}
+        workers: Number of parallel warm-up queries
+        check_interval: Seconds between checks for a new generation
+        generation_source: Optional callable returning the current generation,
+            used instead of reading repdata_generation, e.g. when reports are
+            served from a snapshot that is published after the load commits
+    """
+
+    def __init__(self, builders, workers=8, check_interval=5.0, generation_source=None):
+        self.builders = builders
+        self.generation_source = generation_source
+        self.workers = workers
+        self.check_interval = check_interval
+        self.generation = None
+        self.entries = {}
+        self.warmup_seconds = None
+        self.warmed_at = None
+        self._lock = threading.Lock()
+        self._warming = None
+        self._checked_at = 0.0
+        self._latest = None
+        self._failed_at = float("-inf")
+
+    def keys(self):
+        return itertools.product(self.builders, CHANNELS, PRODUCTS, DATE_TYPES)
+
+    def latest_generation(self, engine):
+        """Current repdata generation, read at most once per check_interval."""
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            if self.generation_source is not None:
+                self._latest = self.generation_source()
+                return self._latest
+            try:
+                with engine.connect() as connection:
+                    self._latest = connection.execute(
+                        select(repdata_generation.c.generation).where(repdata_generation.c.id == 1)
+                    ).scalar()
+            except SQLAlchemyError:
+                # No ETL run has published a generation yet
+                self._latest = None
+        return self._latest
+
+    def get(self, db, endpoint, channel, product, date_type):
+        """
+        Return the cached body for a request, or None when it isn't cached
+        (unknown filter value, or no generation warmed yet).
+        """
+        engine = db.get_bind()
+        latest = self.latest_generation(engine)
+        if latest is not None and latest != self.generation:
+            self._start_warmup(engine, latest)
+        return self.entries.get((endpoint, channel, product, date_type))
+
+    def announced_generation(self, engine):
+        """
+        The generation clients should hold: the warmed one while a newer
+        generation is warming (so they refetch once it is cached), otherwise
+        the latest. Starts a warm-up when a new generation is published.
+        """
+        latest = self.latest_generation(engine)
+        if latest is not None and latest != self.generation:
+            self._start_warmup(engine, latest)
+        return self.announce(latest)
+
+    def announce(self, latest):
+        """announced_generation for an already known latest generation."""
+        if latest is not None and latest != self.generation and self._warming is not None and self.generation is not None:
+            return self.generation
+        return latest if latest is not None else self.generation
+
+    def _start_warmup(self, engine, generation):
+        with self._lock:
+            # Don't retry a failed warm-up on every request
+            if self._warming is not None or time.monotonic() - self._failed_at < self.check_interval:
+                return
+            self._warming = generation
+        threading.Thread(
+            target=self.warm_up, args=(engine, generation), name=f"report-warmup-{generation}", daemon=True
+        ).start()
+
+    def _build(self, engine, key):
+        endpoint, channel, product, date_type = key
+        with Session(bind=engine) as db:
+            return key, self.builders[endpoint](db, channel, product, date_type)
+
+    def warm_up(self, engine, generation):
+        """
+        Compute every combination for `generation` and switch to it.
+
+        Returns:
+            float: Warm-up duration in seconds
+        """
+        started = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                entries = dict(pool.map(lambda key: self._build(engine, key), list(self.keys())))
+        except Exception:
+            logger.exception("Report cache warm-up for generation %s failed", generation)
+            with self._lock:
+                self._warming = None
+                self._failed_at = time.monotonic()
+            return None
+
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            # Swap the whole mapping at once; readers never see a mix
+            self.entries = entries
+            self.generation = generation
+            self.warmup_seconds = elapsed
+            self.warmed_at = time.time()
+            self._warming = None
+        logger.info(
+            "Report cache warmed %d responses for repdata generation %s in %.2fs",
+            len(entries), generation, elapsed
+        )
+        return elapsed
+
+    # asyncio path, used by the async read endpoints (api_async.py)
+
+    async def alatest_generation(self, engine):
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            if self.generation_source is not None:
+                self._latest = self.generation_source()
+                return self._latest
+            try:
+                async with engine.connect() as connection:
+                    self._latest = (await connection.execute(
+                        select(repdata_generation.c.generation).where(repdata_generation.c.id == 1)
+                    )).scalar()
+            except SQLAlchemyError:
+                self._latest = None
+        return self._latest
+
+    async def aget(self, engine, builders, endpoint, channel, product, date_type):
+        """
+        Async counterpart of get().
+
+        Args:
+            engine: AsyncEngine for target database
+            builders: {endpoint: async callable(db, channel, product, date_type) -> bytes}
+        """
+        latest = await self.alatest_generation(engine)
+        if latest is not None and latest != self.generation:
+            with self._lock:
+                start = self._warming is None and time.monotonic() - self._failed_at >= self.check_interval
+                if start:
+                    self._warming = latest
+            if start:
+                asyncio.ensure_future(self.awarm_up(engine, builders, latest))
+        return self.entries.get((endpoint, channel, product, date_type))
+
+    async def awarm_up(self, engine, builders, generation):
+        from sqlalchemy.ext.asyncio import AsyncSession
+
+        semaphore = asyncio.Semaphore(self.workers)
+
+        async def build(key):
+            endpoint, channel, product, date_type = key
+            async with semaphore, AsyncSession(engine) as db:
+                return key, await builders[endpoint](db, channel, product, date_type)
+
+        started = time.perf_counter()
+        try:
+            entries = dict(await asyncio.gather(*[build(key) for key in self.keys()]))
+        except Exception:
+            logger.exception("Report cache warm-up for generation %s failed", generation)
+            with self._lock:
+                self._warming = None
+                self._failed_at = time.monotonic()
+            return None
+
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.entries = entries
+            self.generation = generation
+            self.warmup_seconds = elapsed
+            self.warmed_at = time.time()
+            self._warming = None
+        logger.info(
+            "Report cache warmed %d responses for repdata generation %s in %.2fs",
+            len(entries), generation, elapsed
+        )
+        return elapsed
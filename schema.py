@@ -0,0 +1,125 @@
+"""
+Definitions of the reporting tables the repdata ETL (agg3a) writes and the
+API reads.
+"""
+from sqlalchemy import Column, DateTime, Index, Integer, LargeBinary, String, Table, inspect, text
+
+
+# The counters agg3a.create_date_aggregation produces, in column order
+COUNT_COLUMNS = (
+    "sale_count",
+    "quote_count",
+    "sum_attempts",
+    "new_leads_given",
+    "new_leads_contacted",
+    "leads_no_recontact_needed",
+    "ta_answering_machine_no_message",
+    "ta_sale_policy",
+    "ta_call_back_scheduled",
+    "ta_too_expensive",
+    "ta_inbound_extension",
+    "ta_no_reason_provided",
+    "ta_purchased_insurance_elsewhere",
+    "ta_no_product_need",
+    "ta_bad_phone_number",
+    "ta_customer_policy_not_up_for_renewal",
+    "ta_customer_satisfied_with_current_insurer",
+    "ta_declined_by_insurer_for_other_reason",
+    "ta_active_follow_up_present",
+    "ta_other",
+    "ta_none",
+    "ta_total",
+)
+
+
+def repdata_table(metadata):
+    """Define the repdata reporting table schema."""
+    return Table(
+        "repdata",
+        metadata,
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        Column("date_type", String),
+        Column("date_value", String),
+        Column("product", String),
+        Column("quote_channel", String),
+        Column("sale_count", Integer),
+        Column("quote_count", Integer), 
+        Column("sum_attempts", Integer),
+        Column("new_leads_given", Integer),
+        Column("new_leads_contacted", Integer),
+        Column("leads_no_recontact_needed", Integer),
+        Column("ta_answering_machine_no_message", Integer),
+        Column("ta_sale_policy", Integer),
+        Column("ta_call_back_scheduled", Integer),
+        Column("ta_too_expensive", Integer),
+        Column("ta_inbound_extension", Integer),
+        Column("ta_no_reason_provided", Integer),
+        Column("ta_purchased_insurance_elsewhere", Integer),
+        Column("ta_no_product_need", Integer),
+        Column("ta_bad_phone_number", Integer),
+        Column("ta_customer_policy_not_up_for_renewal", Integer),
+        Column("ta_customer_satisfied_with_current_insurer", Integer),
+        Column("ta_declined_by_insurer_for_other_reason", Integer),
+        Column("ta_active_follow_up_present", Integer),
+        Column("ta_other", Integer),
+        Column("ta_none", Integer),
+        Column("ta_total", Integer),
+        Column("distinct_quotes", Integer),
+        Column("quote_sketch", LargeBinary),
+        extend_existing=True
+    )
+
+
+def repdata_advisor_table(metadata):
+    """
+    Define the per-advisor reporting table: repdata's counters for each
+    (advisor, period, product, channel) cell that has outbounds, looked up
+    by advisor through ix_repdata_advisor_lookup.
+    """
+    return Table(
+        "repdata_advisor",
+        metadata,
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        Column("date_type", String(10)),
+        Column("date_value", String(30)),
+        Column("user_id", Integer, nullable=False),
+        Column("product", String(100)),
+        Column("quote_channel", String(100)),
+        *[Column(name, Integer) for name in COUNT_COLUMNS],
+        Index("ix_repdata_advisor_lookup", "user_id", "quote_channel", "product", "date_type"),
+        extend_existing=True
+    )
+
+
+def ensure_columns(engine, table):
+    """
+    Add columns declared on `table` that the existing database table lacks,
+    so tables created by an older version of this module keep loading.
+    """
+    existing = {c["name"] for c in inspect(engine).get_columns(table.name)}
+    missing = [c for c in table.c if c.name not in existing]
+    if not missing:
+        return []
+    preparer = engine.dialect.identifier_preparer
+    with engine.begin() as connection:
+        for c in missing:
+            connection.execute(text(
+                f"ALTER TABLE {preparer.format_table(table)} ADD {preparer.format_column(c)} "
+                f"{c.type.compile(dialect=engine.dialect)}"
+            ))
+    return [c.name for c in missing]
+
+
+def repdata_generation_table(metadata):
+    """
+    Define the single-row table holding the current repdata generation.
+    Every load bumps it, so readers can tell when cached reports are stale.
+    """
+    return Table(
+        "repdata_generation",
+        metadata,
+        Column("id", Integer, primary_key=True, autoincrement=False),
+        Column("generation", Integer, nullable=False),
+        Column("refreshed_at", DateTime),
+        extend_existing=True
+    )
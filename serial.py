@@ -5,3 +5,33 @@ class MeltedAttemptData(BaseSerializer):
     date_value: datetime
     series_name: str
     series_value: int
+
+
+class ExportJob(BaseSerializer):
+    id: str
+    status: str
+    format: str
+    latest_only: bool = False
+    start: datetime
+    end: datetime
+    partitions_total: int
+    partitions_done: int
+    progress: float
+    rows: int
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
+
+class DistinctQuotes(BaseSerializer):
+    channel: str
+    product: str
+    date_type: str
+    start: date
+    end: date
+    periods: int
+    distinct_quotes: int
+
+
+class AdvisorRepData(RepData):
+    user_id: int
@@ -0,0 +1,89 @@
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.shared = 0
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls for the same key into one computation.
+
+    The first caller for a key runs the function; callers arriving while it
+    is in flight block until it finishes and receive the same result (or the
+    same exception). Nothing is cached once the call completes.
+
+    Usage:
+        flight = SingleFlight()
+        body = flight.do(("report_data", channel, product, date_type), compute)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+            else:
+                call.shared += 1
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+
+class AsyncSingleFlight:
+    """
+    asyncio counterpart of SingleFlight for handlers running on the event
+    loop. Waiting callers await the leader's task instead of blocking a
+    thread.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def do(self, key, fn):
+        task = self._calls.get(key)
+        if task is None:
+            task = self._calls[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+            self.executed += 1
+        else:
+            self.coalesced += 1
+        # Shield so one cancelled caller doesn't cancel the shared work
+        return await asyncio.shield(task)
+
+    def in_flight(self):
+        return len(self._calls)
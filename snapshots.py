@@ -0,0 +1,331 @@
+import json
+import os
+import shutil
+import threading
+import uuid
+from datetime import date, datetime, time
+from decimal import Decimal
+
+from sqlalchemy import select
+
+DATASETS = ("repdata", "repdata_advisor", "quote_history")
+
+# The order publish_quote_history writes quote_history in, which is the
+# order exports read it in
+HISTORY_ORDER = [("quote_number", "ascending"), ("quote_entry_date", "descending")]
+
+
+def _arrow_type(sql_type):
+    import pyarrow as pa
+
+    try:
+        python_type = sql_type.python_type
+    except NotImplementedError:
+        return pa.string()
+    if python_type is bool:
+        return pa.bool_()
+    if python_type is int:
+        return pa.int64()
+    if python_type is float:
+        return pa.float64()
+    if python_type is Decimal:
+        precision = getattr(sql_type, "precision", None) or 38
+        return pa.decimal128(precision, getattr(sql_type, "scale", None) or 0)
+    if python_type is datetime:
+        return pa.timestamp("us", tz="UTC" if getattr(sql_type, "timezone", False) else None)
+    if python_type is date:
+        return pa.date32()
+    if python_type is time:
+        return pa.time64("us")
+    if python_type is bytes:
+        return pa.binary()
+    return pa.string()
+
+
+def arrow_schema(columns):
+    """
+    Arrow schema for SQLAlchemy columns. Types come from the column
+    definitions rather than the data, so a column that is NULL throughout
+    the first batch still gets its real type.
+    """
+    import pyarrow as pa
+
+    return pa.schema([pa.field(c.name, _arrow_type(c.type), nullable=c.nullable) for c in columns])
+
+
+class Snapshot:
+    """
+    One published, immutable version of a dataset: an uncompressed Arrow IPC
+    file opened with a memory map, so reads page data in from the OS cache
+    instead of copying it onto the heap.
+    """
+
+    def __init__(self, directory, manifest):
+        import pyarrow as pa
+
+        self.directory = directory
+        self.version = manifest["version"]
+        self.generation = manifest.get("generation")
+        self.published_at = manifest["published_at"]
+        self.rows = manifest["rows"]
+        self.sort_order = [tuple(key) for key in manifest.get("sort_order") or ()] or None
+        self.table = pa.ipc.open_file(pa.memory_map(os.path.join(directory, "data.arrow"))).read_all()
+
+
+class SnapshotStore:
+    """
+    Versioned columnar copies of the reporting tables on local disk, so
+    report reads and history exports don't touch the transactional database.
+
+    Each publish writes a new version directory and then atomically replaces
+    the dataset's CURRENT pointer; readers pick up the new version on their
+    next call and never see a partially written file. Older versions are
+    removed once `keep` newer ones exist.
+
+    Args:
+        directory: Local directory holding one sub-directory per dataset
+        keep: Number of versions kept per dataset
+    """
+
+    def __init__(self, directory, keep=3):
+        self.directory = directory
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._open = {}
+        for dataset in DATASETS:
+            os.makedirs(os.path.join(directory, dataset), exist_ok=True)
+
+    def _pointer(self, dataset):
+        return os.path.join(self.directory, dataset, "CURRENT")
+
+    def current_version(self, dataset):
+        try:
+            with open(self._pointer(dataset)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def current(self, dataset):
+        """
+        The current Snapshot of `dataset`, or None before the first publish.
+        Each version is opened once and shared by all readers.
+        """
+        version = self.current_version(dataset)
+        if version is None:
+            return None
+        with self._lock:
+            snapshot = self._open.get(dataset)
+            if snapshot is None or snapshot.version != version:
+                directory = os.path.join(self.directory, dataset, version)
+                with open(os.path.join(directory, "manifest.json")) as f:
+                    snapshot = Snapshot(directory, json.load(f))
+                self._open[dataset] = snapshot
+            return snapshot
+
+    def generation(self):
+        """The repdata generation of the current repdata snapshot."""
+        snapshot = self.current("repdata")
+        return snapshot.generation if snapshot is not None else None
+
+    def publish(self, dataset, batches, schema=None, generation=None, sort_order=None):
+        """
+        Write record batches as a new version of `dataset` and switch to it.
+
+        Args:
+            dataset: One of DATASETS
+            batches: Iterable of lists of row dictionaries
+            schema: Arrow schema of the rows, see arrow_schema. Inferred from
+                the first batch when omitted, which types columns that are
+                all NULL in it as null
+            generation: repdata generation the data belongs to, if any
+            sort_order: [(column, "ascending"|"descending"), ...] the batches
+                are already sorted by, recorded so readers needn't sort
+
+        Returns:
+            str: The published version
+        """
+        import pyarrow as pa
+
+        if dataset not in DATASETS:
+            raise ValueError(f"Unknown dataset {dataset!r}")
+
+        version = f"{datetime.utcnow():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}"
+        dataset_dir = os.path.join(self.directory, dataset)
+        tmp_dir = os.path.join(dataset_dir, f".{version}.tmp")
+        os.makedirs(tmp_dir)
+
+        rows = 0
+        writer = None
+        try:
+            for batch in batches:
+                if not batch:
+                    continue
+                record_batch = pa.RecordBatch.from_pylist(batch, schema=writer.schema if writer else schema)
+                if writer is None:
+                    writer = pa.ipc.new_file(os.path.join(tmp_dir, "data.arrow"), record_batch.schema)
+                writer.write_batch(record_batch)
+                rows += len(batch)
+            if writer is None:
+                writer = pa.ipc.new_file(os.path.join(tmp_dir, "data.arrow"), schema or pa.schema([]))
+        finally:
+            if writer is not None:
+                writer.close()
+
+        with open(os.path.join(tmp_dir, "manifest.json"), "w") as f:
+            json.dump({
+                "version": version,
+                "generation": generation,
+                "published_at": datetime.utcnow().isoformat(),
+                "rows": rows,
+                "sort_order": sort_order,
+            }, f)
+        os.replace(tmp_dir, os.path.join(dataset_dir, version))
+
+        tmp_pointer = f"{self._pointer(dataset)}.{threading.get_ident()}.tmp"
+        with open(tmp_pointer, "w") as f:
+            f.write(version)
+        os.replace(tmp_pointer, self._pointer(dataset))
+
+        self._prune(dataset, version)
+        return version
+
+    def _prune(self, dataset, current):
+        dataset_dir = os.path.join(self.directory, dataset)
+        versions = sorted(
+            name for name in os.listdir(dataset_dir)
+            if not name.startswith(".") and name != "CURRENT" and not name.startswith("CURRENT.")
+        )
+        # Open readers keep their memory map valid after the unlink
+        for version in versions[:-self.keep]:
+            if version != current:
+                shutil.rmtree(os.path.join(dataset_dir, version), ignore_errors=True)
+
+    def report_rows(self, channel, product, date_type, columns=None, user_id=None):
+        """
+        repdata rows for one dashboard filter combination, or None when no
+        repdata snapshot has been published. `columns` limits the columns
+        materialised; names the snapshot lacks are skipped. Without it,
+        binary columns such as the quote sketches, which no report returns,
+        are left out. With `user_id`, rows come from the repdata_advisor
+        snapshot instead.
+        """
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        snapshot = self.current("repdata" if user_id is None else "repdata_advisor")
+        if snapshot is None:
+            return None
+        table = snapshot.table
+        if table.num_rows == 0:
+            return []
+        mask = pc.and_(
+            pc.and_(pc.equal(table["quote_channel"], channel), pc.equal(table["product"], product)),
+            pc.equal(table["date_type"], date_type),
+        )
+        if user_id is not None:
+            mask = pc.and_(mask, pc.equal(table["user_id"], user_id))
+        # Project before filtering, so unserved columns are never copied
+        if columns is None:
+            columns = [
+                field.name for field in table.schema
+                if not (pa.types.is_binary(field.type) or pa.types.is_large_binary(field.type))
+            ]
+        else:
+            columns = [name for name in columns if name in table.column_names]
+        return table.select(columns).filter(mask).to_pylist()
+
+    def history_batches(self, start=None, end=None, latest_only=False, batch_size=1000):
+        """
+        QuoteHistory rows in export order (quote_number, newest first), in
+        lists of up to `batch_size` dictionaries. Returns None when no
+        quote_history snapshot has been published.
+
+        Args:
+            start: Earliest quote_entry_date, inclusive
+            end: Latest quote_entry_date, inclusive
+            latest_only: Keep only the newest version of each quote in range
+        """
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        snapshot = self.current("quote_history")
+        if snapshot is None:
+            return None
+        table = snapshot.table
+        if table.num_rows == 0:
+            return iter(())
+
+        if start is not None:
+            table = table.filter(pc.greater_equal(table["quote_entry_date"], pa.scalar(start, table.schema.field("quote_entry_date").type)))
+        if end is not None:
+            table = table.filter(pc.less_equal(table["quote_entry_date"], pa.scalar(end, table.schema.field("quote_entry_date").type)))
+        if snapshot.sort_order != HISTORY_ORDER:
+            # Published before snapshots were written in export order
+            table = table.sort_by(HISTORY_ORDER)
+
+        if latest_only and table.num_rows:
+            # Sorted newest first, so a quote's first row is its latest version
+            quote_numbers = table["quote_number"]
+            first = pc.not_equal(quote_numbers.slice(1), quote_numbers.slice(0, table.num_rows - 1))
+            table = table.filter(pa.concat_arrays([pa.array([True])] + first.fill_null(True).chunks))
+
+        return (batch.to_pylist() for batch in table.to_batches(max_chunksize=batch_size))
+
+
+def publish_repdata(store, connection, repdata, generation=None, dataset="repdata"):
+    """
+    Publish the repdata table as it is stored, after a load has committed.
+
+    Args:
+        store: SnapshotStore
+        connection: Session or connection for target database
+        repdata: repdata (or repdata_advisor) Table
+        generation: The generation the load committed
+        dataset: Dataset to publish as
+
+    Returns:
+        str: The published version
+    """
+    result = connection.execute(select(repdata))
+    return store.publish(
+        dataset,
+        ([dict(row._mapping) for row in partition] for partition in result.partitions(10_000)),
+        schema=arrow_schema(repdata.c),
+        generation=generation,
+    )
+
+
+def publish_quote_history(store, engine, QuoteHistory, columns=None):
+    """
+    Extract QuoteHistory into a new quote_history snapshot, streaming it in
+    batches so the extract never holds the whole table in memory.
+
+    Args:
+        store: SnapshotStore
+        engine: SQLAlchemy engine for target database
+        QuoteHistory: QuoteHistory ORM model
+        columns: Names of the columns to keep, defaults to all
+
+    Returns:
+        str: The published version
+    """
+    table = QuoteHistory.__table__
+    names = list(columns) if columns is not None else [c.name for c in table.c]
+    selected = [table.c[name] for name in names]
+    # Written in export order (served by ix_quote_history_quote_number_entry_date),
+    # so exports read the mapped file in place instead of sorting it per request
+    stmt = select(*selected).order_by(table.c.quote_number, table.c.quote_entry_date.desc())
+    with engine.connect() as connection:
+        result = connection.execution_options(yield_per=10_000).execute(stmt)
+        return store.publish(
+            "quote_history",
+            ([dict(row._mapping) for row in partition] for partition in result.partitions()),
+            schema=arrow_schema(selected),
+            sort_order=HISTORY_ORDER if {"quote_number", "quote_entry_date"} <= set(names) else None,
+        )
+
+
+def store_from_env():
+    """SnapshotStore at $QUOTES_SNAPSHOT_DIR, or None when it isn't set."""
+    directory = os.environ.get("QUOTES_SNAPSHOT_DIR")
+    return SnapshotStore(directory) if directory else None
@@ -0,0 +1,181 @@
+import random
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+
+# Result values observed in Outbound.result, with a rough production mix.
+# None stands for outbounds that were never completed.
+DEFAULT_RESULT_WEIGHTS = {
+    "Answering Machine - No Message": 30,
+    "Sale - Policy": 6,
+    "Sale - No recontact": 2,
+    "Call back scheduled": 12,
+    "Too Expensive": 5,
+    "Inbound - extension": 2,
+    "No Reason Provided": 4,
+    "Purchased insurance elsewhere": 4,
+    "No Product Need": 3,
+    "Bad phone number": 3,
+    "Customer Policy not up for renewal": 2,
+    "Customer satisfied with current insurer": 3,
+    "Declined by Insurer for other reason": 1,
+    "Active Follow-up Present": 4,
+    "Other": 4,
+    None: 15,
+}
+
+PRODUCTS = ["CommercialAuto", "CommercialBuildingGeneralLiability"]
+CHANNELS = ["Web", "Inbound"]
+OPEN_STATUSES = ["Quoted", "Draft", "Quoting"]
+
+
+@dataclass
+class SynthSpec:
+    """
+    Shape of a synthetic Quote/Outbound data set.
+
+    Args:
+        quote_count: Number of distinct quotes to generate
+        outbounds_per_quote: Mean number of outbound attempts per quote
+        result_weights: Relative frequency of each Outbound.result value
+        bound_ratio: Fraction of quotes that end up Bound
+        years: Number of years of history ending at `end`
+        end: Last creation timestamp of the data set
+        advisors: Number of distinct advisor user ids
+        seed: Random seed, so the same spec always produces the same rows
+    """
+    quote_count: int = 10_000
+    outbounds_per_quote: float = 3.0
+    result_weights: dict = field(default_factory=lambda: dict(DEFAULT_RESULT_WEIGHTS))
+    bound_ratio: float = 0.2
+    years: int = 3
+    end: datetime = datetime(2025, 12, 31)
+    advisors: int = 50
+    seed: int = 0
+
+    @classmethod
+    def for_outbound_rows(cls, rows, **kwargs):
+        """Build a spec whose expected Outbound volume is `rows`."""
+        outbounds_per_quote = kwargs.pop("outbounds_per_quote", cls.outbounds_per_quote)
+        return cls(
+            quote_count=max(1, round(rows / outbounds_per_quote)),
+            outbounds_per_quote=outbounds_per_quote,
+            **kwargs
+        )
+
+
+def iter_batches(spec, batch_size=10_000):
+    """
+    Generate synthetic Quote and Outbound rows in batches.
+
+    Rows are plain dictionaries keyed by column name so they can be bulk
+    inserted into any model that has (a superset of) these columns.
+
+    Args:
+        spec: SynthSpec describing the data set
+        batch_size: Number of quotes per yielded batch
+
+    Yields:
+        tuple: (quote_rows, outbound_rows) for each batch of quotes
+    """
+    rng = random.Random(spec.seed)
+    results = list(spec.result_weights)
+    weights = list(spec.result_weights.values())
+    span_days = spec.years * 365
+    start = spec.end - timedelta(days=span_days)
+    # Geometric number of extra attempts keeps the mean at outbounds_per_quote
+    p_more = 1 - 1 / max(spec.outbounds_per_quote, 1)
+
+    quote_rows, outbound_rows = [], []
+    for n in range(spec.quote_count):
+        quote_number = f"Q{n:09d}"
+        created = start + timedelta(seconds=rng.randrange(span_days * 86400))
+        bound = rng.random() < spec.bound_ratio
+        last_entry = created + timedelta(days=rng.randrange(0, 45), seconds=rng.randrange(86400))
+
+        quote_rows.append({
+            "quote_number": quote_number,
+            "transaction_status": "Bound" if bound else rng.choice(OPEN_STATUSES),
+            "last_entry_date": last_entry,
+            "product": rng.choice(PRODUCTS),
+            "quote_channel": rng.choice(CHANNELS),
+            "business_name": f"Business {n}",
+            "expiry_dt": created + timedelta(days=30),
+            "latest_result": "",
+            "reject_reason": None,
+            "sqpm_quote_sale_reporting_in": 1,
+        })
+
+        attempts = 1
+        while rng.random() < p_more:
+            attempts += 1
+
+        when = created
+        for _ in range(attempts):
+            when = when + timedelta(hours=rng.randrange(1, 24 * 7))
+            result = rng.choices(results, weights)[0]
+            outbound_rows.append({
+                "quote_number": quote_number,
+                "user_id": rng.randrange(1, spec.advisors + 1),
+                "result": result,
+                "created_at_dtm": when,
+                "assigned_at_dtm": when,
+                "scheduled_outbound_dt": None if rng.random() < 0.05 else when,
+                "completed_at_dtm": None if result is None else when + timedelta(minutes=rng.randrange(1, 240)),
+                "unassigned_at_dtm": None,
+            })
+
+        if len(quote_rows) >= batch_size:
+            yield quote_rows, outbound_rows
+            quote_rows, outbound_rows = [], []
+
+    if quote_rows:
+        yield quote_rows, outbound_rows
+
+
+def project(model, rows):
+    # Only keep the keys the target model actually maps, so the generator can
+    # feed the real models as well as slimmed-down local ones.
+    columns = set(model.__table__.c.keys())
+    return [{k: v for k, v in row.items() if k in columns} for row in rows]
+
+
+def load(session, Quote, Outbound, spec, batch_size=10_000):
+    """
+    Bulk insert a synthetic data set into the Quote and Outbound tables.
+
+    Args:
+        session: Database session for the target database
+        Quote: Quote ORM model
+        Outbound: Outbound ORM model
+        spec: SynthSpec describing the data set
+        batch_size: Number of quotes inserted per transaction
+
+    Returns:
+        tuple: (quotes inserted, outbounds inserted)
+    """
+    quotes = outbounds = 0
+    for quote_rows, outbound_rows in iter_batches(spec, batch_size):
+        session.execute(insert(Quote), project(Quote, quote_rows))
+        session.execute(insert(Outbound), project(Outbound, outbound_rows))
+        session.commit()
+        quotes += len(quote_rows)
+        outbounds += len(outbound_rows)
+    return quotes, outbounds
+
+
+def iter_users(spec):
+    """
+    Generate the advisor users referenced by Outbound.user_id.
+
+    Yields:
+        dict: One row per advisor
+    """
+    for user_id in range(1, spec.advisors + 1):
+        yield {
+            "id": user_id,
+            "first_name": f"Advisor{user_id}",
+            "last_name": "Synthetic",
+        }